@@ -0,0 +1,100 @@
+##################
+# Global settings audit - one APIC query per fabric
+# Flow of the code is as follows:
+# 1. Reads a CSV file containing multiple ACI fabric credentials.
+# 2. Logs into each fabric using the provided credentials.
+# 3. Reads Rogue EP Control, Port Tracking, Remote EP Learning and MCP Instance Policy
+#    in a single subtree query with class filters and config-only properties.
+# 4. Prints a compliance matrix for each fabric and one for the whole fleet.
+# Nothing is changed on the fabrics.
+###################
+
+from ACI_Auth import login
+from ACI_Fleet import read_fabric_credentials, run_fleet
+from ACI_Metrics import traced_operation
+from ACI_Query import Query, eq, or_
+
+# Global policies checked by the audit: (setting, class, dn, attribute, compliant value)
+GLOBAL_SETTINGS = [
+    ("rogue_ep_control", "epControlP", "uni/infra/epCtrlP-default", "adminSt", "enabled"),
+    ("port_tracking", "infraPortTrackPol", "uni/infra/trackEqptFabP-default", "adminSt", "on"),
+    ("remote_ep_learning", "infraSetPol", "uni/infra/settings", "unicastXrEpLearnDisable", "yes"),
+    ("mcp_instance_policy", "mcpInstPol", "uni/infra/mcpInstP-default", "adminSt", "enabled"),
+]
+
+
+def build_audit_query():
+    return Query.of_mo("uni") \
+        .scope("subtree", [cls for _, cls, _, _, _ in GLOBAL_SETTINGS]) \
+        .where(or_(*(eq(cls, "dn", dn) for _, cls, dn, _, _ in GLOBAL_SETTINGS))) \
+        .props("config-only")
+
+
+# Read all the global policies of a fabric in one request
+@traced_operation
+def audit_global_settings(APIC_URL, token):
+    response = build_audit_query().get(APIC_URL, token)
+    response.raise_for_status()
+    found = {}
+    for item in response.json().get('imdata', []):
+        for cls, mo in item.items():
+            attrs = mo['attributes']
+            found[attrs.get('dn')] = attrs
+    return evaluate_settings(found)
+
+
+# Compare the attributes found for each policy DN ({dn: attributes}) with the expected values
+def evaluate_settings(found):
+    results = []
+    for setting, cls, dn, attribute, expected in GLOBAL_SETTINGS:
+        attrs = found.get(dn)
+        if attrs is None:
+            current, status = None, "MISSING"
+        else:
+            current = attrs.get(attribute)
+            status = "OK" if (current or '').lower() == expected else "FAIL"
+        results.append({"setting": setting, "dn": dn, "attribute": attribute,
+                        "expected": expected, "current": current, "status": status})
+    return results
+
+
+def print_fabric_matrix(APIC_URL, results):
+    print(f"{'Setting':<22}  {'Attribute':<24}  {'Current':<10}  {'Expected':<10}  Status")
+    for r in results:
+        print(f"{r['setting']:<22}  {r['attribute']:<24}  {str(r['current']):<10}  {r['expected']:<10}  {r['status']}")
+
+
+def print_fleet_matrix(fleet_results):
+    if not fleet_results:
+        return
+    settings = [setting for setting, _, _, _, _ in GLOBAL_SETTINGS]
+    width = max(len("Fabric"), max(len(url) for url in fleet_results))
+    print("\nCompliance matrix:")
+    print(f"{'Fabric':<{width}}  " + "  ".join(f"{s:<19}" for s in settings))
+    for url, results in fleet_results.items():
+        if results is None:
+            cells = ["ERROR"] * len(settings)
+        else:
+            cells = [r["status"] for r in results]
+        print(f"{url:<{width}}  " + "  ".join(f"{c:<19}" for c in cells))
+
+
+def main():
+    csv_path = input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    fleet_results = {fabric["APIC_URL"]: None for fabric in fabrics}
+
+    def process_fabric(fabric):
+        APIC_URL = fabric["APIC_URL"]
+        print(f"\n--- Auditing fabric: {APIC_URL} ---")
+        token = login(APIC_URL, fabric["USERNAME"], fabric["PASSWORD"])
+        results = audit_global_settings(APIC_URL, token)
+        fleet_results[APIC_URL] = results
+        print_fabric_matrix(APIC_URL, results)
+
+    run_fleet(fabrics, process_fabric)
+    print_fleet_matrix(fleet_results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+##################
+# APIC login with a persistent token cache shared by all the ACI Vetr fix scripts
+# Flow of the code is as follows:
+# 1. Look up a token for (APIC_URL, USERNAME) in memory, then in the on-disk cache.
+# 2. Reuse it while it is valid, renew it with aaaRefresh when it is close to expiry.
+# 3. Do a full aaaLogin only when there is no usable token or the APIC answers 401/403.
+# 4. Renewals are serialised per fabric/user (threads) and through a file lock (processes),
+#    so parallel workers keep using the same valid token.
+###################
+
+import fcntl
+import json
+import os
+import threading
+import time
+
+from ACI_Client import apic_request, register_auth
+from ACI_Metrics import traced_operation
+
+# On-disk token cache, readable only by the current user
+TOKEN_CACHE_PATH = os.environ.get("ACI_TOKEN_CACHE", os.path.expanduser("~/.aci_token_cache.json"))
+# Renew a token with aaaRefresh when fewer than this many seconds are left
+REFRESH_MARGIN = int(os.environ.get("ACI_TOKEN_REFRESH_MARGIN", "120"))
+
+_memory_cache = {}
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+def _cache_key(APIC_URL, USERNAME):
+    return f"{APIC_URL}|{USERNAME}"
+
+
+def _key_lock(key):
+    with _key_locks_guard:
+        if key not in _key_locks:
+            _key_locks[key] = threading.Lock()
+        return _key_locks[key]
+
+
+# Exclusive lock on the cache file so only one process renews a token at a time
+class _DiskLock:
+    def __enter__(self):
+        self.handle = open(f"{TOKEN_CACHE_PATH}.lock", "a")
+        fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+def _read_disk_cache():
+    try:
+        with open(TOKEN_CACHE_PATH) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_disk_entry(key, entry):
+    cache = _read_disk_cache()
+    now = time.time()
+    # Drop tokens that can no longer be used or refreshed
+    cache = {k: v for k, v in cache.items() if v.get("expires", 0) > now}
+    if entry is None:
+        cache.pop(key, None)
+    else:
+        cache[key] = entry
+    tmp_path = f"{TOKEN_CACHE_PATH}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(tmp_path, TOKEN_CACHE_PATH)
+
+
+def _entry_from_response(response, previous=None):
+    attrs = response.json()['imdata'][0]['aaaLogin']['attributes']
+    now = time.time()
+    entry = {
+        "token": attrs['token'],
+        "expires": now + int(attrs.get('refreshTimeoutSeconds', 600)),
+        "max_expires": now + int(attrs.get('maximumLifetimeSeconds', 86400)),
+    }
+    if previous is not None:
+        # aaaRefresh extends the idle timeout, not the maximum lifetime of the session
+        entry["max_expires"] = previous["max_expires"]
+    return entry
+
+
+def _aaa_login(APIC_URL, USERNAME, PASSWORD):
+    payload = {
+        "aaaUser": {
+            "attributes": {
+                "name": USERNAME,
+                "pwd": PASSWORD
+            }
+        }
+    }
+    response = apic_request("POST", APIC_URL, None, "/api/aaaLogin.json", json=payload, auth=False)
+    response.raise_for_status()
+    return _entry_from_response(response)
+
+
+def _aaa_refresh(APIC_URL, entry):
+    response = apic_request("GET", APIC_URL, entry["token"], "/api/aaaRefresh.json", auth=False)
+    if response.status_code != 200:
+        return None
+    return _entry_from_response(response, entry)
+
+
+def _usable(entry, now):
+    return entry is not None and entry["expires"] - REFRESH_MARGIN > now
+
+
+def _refreshable(entry, now):
+    return entry is not None and entry["expires"] > now and entry["max_expires"] - REFRESH_MARGIN > now
+
+
+# Return a valid token, renewing or re-logging in only when needed
+def _get_token(APIC_URL, USERNAME, PASSWORD, force_login=False):
+    key = _cache_key(APIC_URL, USERNAME)
+    with _key_lock(key):
+        now = time.time()
+        entry = _memory_cache.get(key)
+        if not force_login and _usable(entry, now):
+            return entry["token"]
+        with _DiskLock():
+            disk_entry = _read_disk_cache().get(key)
+            # Another worker may already have renewed the token we were about to renew
+            if disk_entry is not None and (entry is None or disk_entry["token"] != entry["token"]
+                                           or disk_entry["expires"] > entry["expires"]):
+                if _usable(disk_entry, now):
+                    _memory_cache[key] = disk_entry
+                    return disk_entry["token"]
+                if not force_login:
+                    entry = disk_entry
+            new_entry = None
+            if not force_login and _refreshable(entry, now):
+                new_entry = _aaa_refresh(APIC_URL, entry)
+            if new_entry is None:
+                new_entry = _aaa_login(APIC_URL, USERNAME, PASSWORD)
+            _write_disk_entry(key, new_entry)
+        _memory_cache[key] = new_entry
+        return new_entry["token"]
+
+
+@traced_operation
+def login(APIC_URL, USERNAME, PASSWORD):
+    token = _get_token(APIC_URL, USERNAME, PASSWORD)
+    register_auth(
+        APIC_URL,
+        lambda: _get_token(APIC_URL, USERNAME, PASSWORD),
+        lambda: _get_token(APIC_URL, USERNAME, PASSWORD, force_login=True),
+    )
+    return token
@@ -0,0 +1,266 @@
+##################
+# Benchmark of the ACI Vetr remediation flows against simulated fabrics
+# Flow of the code is as follows:
+# 1. For each scenario (number of fabrics x policy groups per fabric) start a fresh ACI_Simulator.
+# 2. Run each flow (DOM, MCP, port tracking, rogue EP, EP learning) over the simulated fleet
+#    in its own Python process, answering every question with "y" and selecting every group.
+# 3. Record wall time, requests per fabric, bytes transferred, peak RSS and p50/p99 request latency.
+# 4. Measure the parser memory of listing the port groups with buffered and with streamed
+#    responses (one page and one response for the whole class) and report the memory saved.
+# 5. Write the results to a JSON file and optionally compare them with an earlier results file.
+###################
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+FLOWS = ["dom", "mcp", "port_tracking", "rogue_ep_control", "remote_ep_learning"]
+# fabrics x policy groups: a fleet-size sweep and an object-count sweep
+DEFAULT_SCENARIOS = "1x10,10x10,100x10,500x10,1x1000,1x10000,1x50000"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# Flow bodies run on an already logged-in fabric, without any question asked
+def _flow_function(flow):
+    if flow == "dom":
+        import ACI_DOM
+
+        def run(APIC_URL, token):
+            groups = ACI_DOM.get_all_group_names(APIC_URL, token)
+            if not ACI_DOM.check_policy_exists(APIC_URL, token, ACI_DOM.policy_name):
+                ACI_DOM.create_fabric_node_control_policy(APIC_URL, token, ACI_DOM.policy_name)
+            ACI_DOM.associate_policy_to_groups(APIC_URL, token, ACI_DOM.policy_name, groups)
+        return run
+    if flow == "mcp":
+        import ACI_MCP
+
+        def run(APIC_URL, token):
+            ACI_MCP.ensure_mcp_instance_policy_enabled(APIC_URL, token)
+            if not ACI_MCP.mcp_interface_policy_exists(APIC_URL, token, ACI_MCP.policy_name):
+                ACI_MCP.create_mcp_interface_policy(APIC_URL, token, ACI_MCP.policy_name)
+            groups = ACI_MCP.get_leaf_access_port_policy_groups(APIC_URL, token)
+            ACI_MCP.associate_mcp_policy_to_port_groups(APIC_URL, token, ACI_MCP.policy_name, groups)
+        return run
+    import ACI_Vetr_Runner
+    return ACI_Vetr_Runner.FIXES[flow]["func"]
+
+
+class _NullOutput:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+# Runs one flow over the fleet of a CSV file; called in a child process so peak RSS is per flow
+def run_flow(flow, csv_path, workers):
+    import ACI_Client
+    import ACI_Fleet
+    from ACI_Auth import login
+
+    ACI_Fleet.AUTO_ANSWER = "y"
+    fix = _flow_function(flow)
+    fabrics = ACI_Fleet.read_fabric_credentials(csv_path)
+    requests_log = []
+    ACI_Client.add_request_hook(requests_log.append)
+
+    def process_fabric(fabric):
+        token = login(fabric["APIC_URL"], fabric["USERNAME"], fabric["PASSWORD"])
+        fix(fabric["APIC_URL"], token)
+
+    real_stdout = sys.stdout
+    sys.stdout = _NullOutput()
+    start = time.perf_counter()
+    try:
+        results = ACI_Fleet.run_fleet(fabrics, process_fabric, workers)
+    finally:
+        wall = time.perf_counter() - start
+        sys.stdout = real_stdout
+    latencies = [r["seconds"] * 1000 for r in requests_log]
+    return {
+        "wall_seconds": round(wall, 4),
+        "fabrics": len(fabrics),
+        "failed_fabrics": sum(1 for r in results if r["status"] != "ok"),
+        "requests": len(requests_log),
+        "requests_per_fabric": round(len(requests_log) / max(1, len(fabrics)), 2),
+        "writes": sum(1 for r in requests_log if r["method"] == "POST"),
+        "bytes_sent": sum(r["bytes_sent"] for r in requests_log),
+        "bytes_received": sum(r["bytes_received"] for r in requests_log),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+    }
+
+
+# Peak Python memory (KB) of listing the port groups of the first fabric, buffered vs streamed
+def run_parse_memory(csv_path):
+    import ACI_Client
+    import ACI_Fleet
+    import ACI_Query
+    from ACI_Auth import login
+
+    fabric = ACI_Fleet.read_fabric_credentials(csv_path)[0]
+    token = login(fabric["APIC_URL"], fabric["USERNAME"], fabric["PASSWORD"])
+    # Unmeasured pass, so the first measured variant does not also pay the one-off allocations
+    # (imports, connection pool, json scanner) of the first read
+    for stream in (False, True):
+        ACI_Client.STREAM_RESPONSES = stream
+        sum(1 for _ in ACI_Query.iter_names(fabric["APIC_URL"], token, "infraAccPortGrp"))
+    results = {}
+    for label, page_size in (("page", ACI_Client.PAGE_SIZE), ("dump", 10 ** 9)):
+        for stream in (False, True):
+            ACI_Client.STREAM_RESPONSES = stream
+            tracemalloc.start()
+            count = sum(1 for _ in ACI_Query.iter_names(fabric["APIC_URL"], token, "infraAccPortGrp", page_size))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[f"{label}_{'streamed' if stream else 'buffered'}_kb"] = peak // 1024
+        results[f"{label}_saved_percent"] = round(
+            100.0 * (1 - results[f"{label}_streamed_kb"] / max(1, results[f"{label}_buffered_kb"])), 1)
+    results["objects"] = count
+    return results
+
+
+def _start_simulator(fabrics, groups, csv_path, args):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ACI_Simulator.py"),
+               "--port", "0", "--fabrics", str(fabrics), "--port-groups", str(groups),
+               "--node-groups", str(groups), "--latency-ms", str(args.latency_ms),
+               "--write-csv", csv_path]
+    simulator = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    for line in simulator.stdout:
+        if line.startswith("Simulator ready"):
+            return simulator
+    simulator.kill()
+    raise RuntimeError("Simulator did not start")
+
+
+def run_scenario(fabrics, groups, flows, args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "fabrics.csv")
+        simulator = _start_simulator(fabrics, groups, csv_path, args)
+        try:
+            for flow in flows:
+                env = dict(os.environ, ACI_TOKEN_CACHE=os.path.join(tmp, "tokens.json"))
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run-flow", flow, "--csv", csv_path,
+                     "--workers", str(args.workers)],
+                    capture_output=True, text=True, env=env)
+                if child.returncode != 0:
+                    raise RuntimeError(f"Flow {flow} failed: {child.stderr[-2000:]}")
+                metrics = json.loads(child.stdout.strip().splitlines()[-1])
+                results.append({"fabrics": fabrics, "groups": groups, "flow": flow, "metrics": metrics})
+                print(f"{fabrics:>5} fabrics {groups:>6} groups  {flow:<20} "
+                      f"{metrics['wall_seconds']:>9.2f}s  {metrics['requests_per_fabric']:>8} req/fabric  "
+                      f"p50 {metrics['p50_ms']:>8.2f}ms  p99 {metrics['p99_ms']:>8.2f}ms  "
+                      f"rss {metrics['peak_rss_kb'] // 1024}MB", flush=True)
+            if args.parse_memory:
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run-parse", "--csv", csv_path],
+                    capture_output=True, text=True, env=dict(os.environ, ACI_TOKEN_CACHE=os.path.join(tmp, "tokens.json")))
+                if child.returncode != 0:
+                    raise RuntimeError(f"Parse memory measurement failed: {child.stderr[-2000:]}")
+                memory = json.loads(child.stdout.strip().splitlines()[-1])
+                results.append({"fabrics": fabrics, "groups": groups, "flow": "parse_memory", "metrics": memory})
+                for label, title in (("page", "one page"), ("dump", "whole class")):
+                    print(f"{fabrics:>5} fabrics {groups:>6} groups  parse memory ({title}) "
+                          f"buffered {memory[f'{label}_buffered_kb']}KB  streamed {memory[f'{label}_streamed_kb']}KB  "
+                          f"saved {memory[f'{label}_saved_percent']}%", flush=True)
+        finally:
+            simulator.kill()
+            simulator.wait()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Print the change of every metric against an earlier results file
+def compare_results(current, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    old = {(r["fabrics"], r["groups"], r["flow"]): r["metrics"] for r in baseline["results"]}
+    print(f"\nComparison with {baseline_path} (commit {baseline.get('commit')}):")
+    for r in current["results"]:
+        before = old.get((r["fabrics"], r["groups"], r["flow"]))
+        if before is None:
+            continue
+        changes = []
+        for key in ("wall_seconds", "requests_per_fabric", "bytes_received", "peak_rss_kb", "p99_ms",
+                    "page_streamed_kb", "dump_streamed_kb"):
+            if before.get(key):
+                changes.append(f"{key} {100.0 * (r['metrics'][key] - before[key]) / before[key]:+.1f}%")
+        print(f"{r['fabrics']:>5}x{r['groups']:<6} {r['flow']:<20} " + "  ".join(changes))
+
+
+def parse_scenarios(text):
+    scenarios = []
+    for item in text.split(","):
+        fabrics, _, groups = item.strip().partition("x")
+        scenarios.append((int(fabrics), int(groups)))
+    return scenarios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ACI Vetr fixes against simulated fabrics")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS,
+                        help="comma separated FABRICSxGROUPS list (default: %(default)s)")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="comma separated flows to run")
+    parser.add_argument("--workers", type=int, default=1, help="fabrics processed in parallel")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency injected by the simulator")
+    parser.add_argument("--output", default="bench_results.json", help="results JSON file")
+    parser.add_argument("--compare", help="earlier results JSON file to compare with")
+    parser.add_argument("--no-parse-memory", dest="parse_memory", action="store_false",
+                        help="skip the buffered vs streamed parser memory measurement")
+    parser.add_argument("--run-flow", help=argparse.SUPPRESS)
+    parser.add_argument("--run-parse", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--csv", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_parse:
+        print(json.dumps(run_parse_memory(args.csv)))
+        return
+    if args.run_flow:
+        print(json.dumps(run_flow(args.run_flow, args.csv, args.workers)))
+        return
+
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "workers": args.workers,
+        "latency_ms": args.latency_ms,
+        "results": [],
+    }
+    for fabrics, groups in parse_scenarios(args.scenarios):
+        report["results"].extend(run_scenario(fabrics, groups, flows, args))
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare_results(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+##################
+# Shared APIC client used by all the ACI Vetr fix scripts
+# Flow of the code is as follows:
+# 1. Keep one keep-alive requests.Session per fabric with a tunable connection pool.
+# 2. Set the APIC-cookie once on the session instead of building the header on every call.
+# 3. Send every GET/POST of the scripts through that session.
+# 4. Keep the token current through the login helpers and re-login once on 401/403.
+# 5. Count how many connections were opened and how many requests reused one.
+# 6. Push many sibling objects in one POST on their parent (bulk mode).
+# 7. Read large classes page by page, fetching the next page while the current one is used.
+# 8. Stream large query responses through ACI_Stream, keeping only the needed attributes.
+# 9. Pace the requests of each fabric (token bucket, adaptive concurrency) and retry throttled
+#    or failed idempotent requests with jittered exponential backoff, honouring Retry-After.
+###################
+
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from ACI_Stream import loads, stream_imdata
+
+# Disable warnings for self-signed certificates
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Keep-alive connections kept open per fabric
+POOL_MAXSIZE = int(os.environ.get("ACI_POOL_MAXSIZE", "4"))
+# Maximum number of child objects sent in one bulk POST
+BULK_CHUNK_SIZE = int(os.environ.get("ACI_BULK_CHUNK_SIZE", "500"))
+# Objects per page for paginated class queries
+PAGE_SIZE = int(os.environ.get("ACI_PAGE_SIZE", "1000"))
+# Parse paged query responses while they arrive instead of loading the whole body ("0" to disable)
+STREAM_RESPONSES = os.environ.get("ACI_STREAM", "1") != "0"
+# Seconds to wait for the APIC before giving up on a request
+REQUEST_TIMEOUT = float(os.environ.get("ACI_REQUEST_TIMEOUT", "60"))
+# Requests per second allowed per fabric (token bucket), 0 = no limit
+RATE_LIMIT = float(os.environ.get("ACI_RATE_LIMIT", "0"))
+# Requests that may be sent at once after an idle period
+RATE_BURST = int(os.environ.get("ACI_RATE_BURST", "10"))
+# Upper bound of the adaptive number of requests in flight per fabric
+MAX_CONCURRENCY = int(os.environ.get("ACI_MAX_CONCURRENCY", str(POOL_MAXSIZE)))
+# Retries of a throttled or failed idempotent request, and the backoff bounds in seconds
+MAX_RETRIES = int(os.environ.get("ACI_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.environ.get("ACI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.environ.get("ACI_BACKOFF_MAX", "30"))
+# Answers that mean the APIC is overloaded or briefly unavailable
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_tokens = {}
+_auth = {}
+_request_hooks = []
+_throttles = {}
+_sessions_lock = threading.Lock()
+
+
+def _new_session():
+    session = requests.Session()
+    session.verify = False
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Return the keep-alive session of a fabric, creating it on first use
+def get_session(APIC_URL):
+    with _sessions_lock:
+        session = _sessions.get(APIC_URL)
+        if session is None:
+            session = _new_session()
+            _sessions[APIC_URL] = session
+        return session
+
+
+# Store the login token on the fabric session so every later call sends it
+def set_token(APIC_URL, token):
+    session = get_session(APIC_URL)
+    with _sessions_lock:
+        if _tokens.get(APIC_URL) != token:
+            session.headers["Cookie"] = f"APIC-cookie={token}"
+            _tokens[APIC_URL] = token
+
+
+# Register how to get the current token of a fabric and how to log in again
+def register_auth(APIC_URL, current_token, relogin):
+    _auth[APIC_URL] = (current_token, relogin)
+
+
+# Register func(info) called after every APIC request with its method, path, status, time and sizes
+def add_request_hook(func):
+    _request_hooks.append(func)
+
+
+def remove_request_hook(func):
+    if func in _request_hooks:
+        _request_hooks.remove(func)
+
+
+# Per-fabric pacing: a token bucket caps the request rate and an AIMD limit caps the requests
+# in flight. The limit grows by one per window of successful requests and is halved when the
+# APIC throttles us; Retry-After pauses every request to the fabric, not only the throttled one.
+class _Throttle:
+    def __init__(self, rate=None, burst=None, max_concurrency=None):
+        self.rate = RATE_LIMIT if rate is None else rate
+        self.burst = max(1, RATE_BURST if burst is None else burst)
+        self.max_limit = max(1, MAX_CONCURRENCY if max_concurrency is None else max_concurrency)
+        self.limit = float(self.max_limit)
+        self.tokens = float(self.burst)
+        self.last_fill = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.stats = {"throttled": 0, "retries": 0, "decreases": 0}
+        self.condition = threading.Condition()
+
+    def _take_token(self, now):
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.last_fill) * self.rate)
+        self.last_fill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    # Wait for a free slot and a rate token; returns the start time of the request
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                    continue
+                if self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                    continue
+                wait = self._take_token(now)
+                if wait == 0:
+                    self.in_flight += 1
+                    return now
+                self.condition.wait(wait)
+
+    def release(self, started, throttled=False, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.stats["throttled"] += 1
+                # Requests already in flight when we backed off do not halve the limit again
+                if started >= self.last_decrease:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+                    self.stats["decreases"] += 1
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+def get_throttle(APIC_URL):
+    with _sessions_lock:
+        throttle = _throttles.get(APIC_URL)
+        if throttle is None:
+            throttle = _Throttle()
+            _throttles[APIC_URL] = throttle
+        return throttle
+
+
+# Seconds asked by a Retry-After header (delay in seconds or an HTTP date), None if absent
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Full-jitter exponential backoff: a random delay up to base * 2^retry, capped
+def backoff_delay(retry):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** retry)))
+
+
+# GETs and modify-POSTs can be sent twice safely; a POST with status "created" fails
+# if the first try reached the APIC, so it is not retried
+def is_idempotent(method, payload):
+    if method != "POST":
+        return True
+    stack = [payload] if payload is not None else []
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if item.get("status") == "created":
+                return False
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return True
+
+
+def _send(session, method, APIC_URL, path, attempt=0, **kwargs):
+    start = time.perf_counter()
+    response = session.request(method, f"{APIC_URL}{path}", **kwargs)
+    if _request_hooks:
+        info = {
+            "APIC_URL": APIC_URL,
+            "method": method,
+            "path": path,
+            "status": response.status_code,
+            "seconds": time.perf_counter() - start,
+            "bytes_sent": len(response.request.body or b""),
+            # A streamed body is not read yet; its Content-Length is all that is known
+            "bytes_received": (int(response.headers.get("Content-Length") or 0) if kwargs.get("stream")
+                               else len(response.content)),
+            "attempt": attempt,
+        }
+        for hook in list(_request_hooks):
+            hook(info)
+    return response
+
+
+# Send one request through the fabric throttle, retrying throttled/failed idempotent requests
+def _send_paced(session, method, APIC_URL, path, attempt, **kwargs):
+    throttle = get_throttle(APIC_URL)
+    retry = 0
+    retryable = is_idempotent(method, kwargs.get("json"))
+    while True:
+        started = throttle.acquire()
+        response = None
+        try:
+            response = _send(session, method, APIC_URL, path, attempt=attempt + retry, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            throttle.release(started, throttled=True)
+            if not retryable or retry >= MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                throttle.release(started)
+                return response
+            retry_after = retry_after_seconds(response)
+            throttle.release(started, throttled=True, retry_after=retry_after)
+            if not retryable or retry >= MAX_RETRIES:
+                return response
+            response.close()
+        delay = backoff_delay(retry)
+        if response is not None and retry_after is not None:
+            delay = max(delay, retry_after)
+        with throttle.condition:
+            throttle.stats["retries"] += 1
+        time.sleep(delay)
+        retry += 1
+
+
+def apic_request(method, APIC_URL, token, path, auth=True, **kwargs):
+    session = get_session(APIC_URL)
+    handlers = _auth.get(APIC_URL) if auth else None
+    if handlers is not None:
+        # The managed token may have been renewed since the caller got theirs
+        token = handlers[0]()
+    if token is not None:
+        set_token(APIC_URL, token)
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    response = _send_paced(session, method, APIC_URL, path, 0, **kwargs)
+    if handlers is not None and response.status_code in (401, 403):
+        response.close()
+        set_token(APIC_URL, handlers[1]())
+        response = _send_paced(session, method, APIC_URL, path, 1, **kwargs)
+    return response
+
+
+def apic_get(APIC_URL, token, path, params=None):
+    return apic_request("GET", APIC_URL, token, path, params=params)
+
+
+def apic_post(APIC_URL, token, path, payload):
+    return apic_request("POST", APIC_URL, token, path, json=payload)
+
+
+# Yield the imdata of a query page by page (page/page-size), as extract(item) values
+# (items for which extract returns None are dropped). Pages are parsed while they arrive.
+# The next page is requested in the background while the caller works on the current one.
+def _iter_pages(APIC_URL, token, path, params, page_size, extract):
+    def fetch(page):
+        page_params = dict(params, page=str(page))
+        if STREAM_RESPONSES:
+            response = apic_request("GET", APIC_URL, token, path, params=page_params, stream=True)
+            if not response.ok:
+                response.close()
+                response.raise_for_status()
+            meta = {}
+            values = [value for value in map(extract, stream_imdata(response, meta)) if value is not None]
+            return values, int(meta.get('totalCount', len(values)))
+        response = apic_get(APIC_URL, token, path, params=page_params)
+        response.raise_for_status()
+        data = loads(response.content)
+        imdata = data.get('imdata', [])
+        values = [value for value in map(extract, imdata) if value is not None]
+        return values, int(data.get('totalCount', len(imdata)))
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        page = 0
+        # The prefetch thread runs in the caller's context (e.g. the traced operation name)
+        future = prefetcher.submit(contextvars.copy_context().run, fetch, page)
+        while future is not None:
+            values, total = future.result()
+            page += 1
+            future = None
+            if page * page_size < total:
+                future = prefetcher.submit(contextvars.copy_context().run, fetch, page)
+            yield values
+
+
+def _class_params(cls, params, page_size):
+    base_params = {"order-by": f"{cls}.dn|asc", "page-size": str(page_size)}
+    base_params.update(params or {})
+    return base_params
+
+
+# Yield the objects of a class page by page (page/page-size/order-by)
+def iter_class_pages(APIC_URL, token, cls, params=None, page_size=None):
+    if page_size is None:
+        page_size = PAGE_SIZE
+    yield from _iter_pages(APIC_URL, token, f"/api/class/{cls}.json", _class_params(cls, params, page_size),
+                           page_size, lambda item: item.get(cls))
+
+
+# Yield page by page {field: value} of the objects of a class; nothing else of the
+# objects is kept
+def iter_class_attributes(APIC_URL, token, cls, fields, params=None, page_size=None):
+    if page_size is None:
+        page_size = PAGE_SIZE
+
+    def extract(item):
+        mo = item.get(cls)
+        if mo is None:
+            return None
+        attributes = mo["attributes"]
+        return {field: attributes.get(field) for field in fields}
+    yield from _iter_pages(APIC_URL, token, f"/api/class/{cls}.json", _class_params(cls, params, page_size),
+                           page_size, extract)
+
+
+# Yield the objects of the given classes (all when none are given) below a DN (one subtree query) page by page,
+# as imdata items {class: object}
+def iter_subtree_pages(APIC_URL, token, dn, classes, params=None, page_size=None):
+    if page_size is None:
+        page_size = PAGE_SIZE
+    base_params = {"query-target": "subtree", "page-size": str(page_size)}
+    if classes:
+        base_params["target-subtree-class"] = ",".join(classes)
+    base_params.update(params or {})
+    yield from _iter_pages(APIC_URL, token, f"/api/mo/{dn}.json", base_params, page_size, lambda item: item)
+
+
+def _child_name(child):
+    return next(iter(child.values()))["attributes"]["name"]
+
+
+# POST many children of one parent in as few requests (APIC transactions) as possible.
+# Returns {child name: None on success or the error}. A failed chunk is retried one
+# child at a time so the report shows exactly which children were rejected.
+def apic_post_bulk(APIC_URL, token, parent_class, parent_dn, children, chunk_size=None):
+    if chunk_size is None:
+        chunk_size = BULK_CHUNK_SIZE
+    chunk_size = max(1, chunk_size)
+    results = {}
+
+    def post(chunk):
+        payload = {
+            parent_class: {
+                "attributes": {"dn": parent_dn, "status": "modified"},
+                "children": chunk
+            }
+        }
+        response = apic_post(APIC_URL, token, f"/api/mo/{parent_dn}.json", payload)
+        response.raise_for_status()
+
+    for start in range(0, len(children), chunk_size):
+        chunk = children[start:start + chunk_size]
+        try:
+            post(chunk)
+            for child in chunk:
+                results[_child_name(child)] = None
+        except Exception as e:
+            if len(chunk) == 1:
+                results[_child_name(chunk[0])] = e
+                continue
+            for child in chunk:
+                try:
+                    post([child])
+                    results[_child_name(child)] = None
+                except Exception as child_error:
+                    results[_child_name(child)] = child_error
+    return results
+
+
+# Connections opened vs requests that reused an already open connection
+def connection_stats(APIC_URL):
+    stats = {"opened": 0, "requests": 0, "reused": 0}
+    session = _sessions.get(APIC_URL)
+    if session is None:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["opened"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+    stats["reused"] = max(0, stats["requests"] - stats["opened"])
+    return stats
+
+
+# Throttled answers, retries and the current adaptive concurrency limit of a fabric
+def throttle_stats(APIC_URL):
+    throttle = _throttles.get(APIC_URL)
+    if throttle is None:
+        return {"throttled": 0, "retries": 0, "decreases": 0, "limit": MAX_CONCURRENCY}
+    with throttle.condition:
+        return dict(throttle.stats, limit=int(throttle.limit))
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _tokens.clear()
+        _throttles.clear()
@@ -4,87 +4,58 @@
 # 1. Login to APIC and get a token.
 # 2. List all policy group names in the fabric and prompt user to choose one or more.
 # 3. Create a fabric node control policy to enable DOM if it doesn't exist.
-# 4. Associate the created policy to the selected policy groups.
-# 5. (Optional) Associate the policy group to a specific leaf switch (example for leaf 103).
+# 4. Associate the created policy to the selected policy groups; after the fleet run the
+#    relations are checked for being formed and free of faults (ACI_Verify.py).
+# 5. (Optional, ACI_DOM_LEAVES) Associate the policy group to leaf switches, coalescing the leaf IDs
+#    into the fewest node block ranges of one leaf selector.
 ###################
 
+import os
+import sys
 
-import requests
-import urllib3
-import csv
-
-# Disable warnings for self-signed certificates
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from ACI_Auth import login
+from ACI_Client import apic_post
+from ACI_Desired_State import DRY_RUN, changes_for, converge, desired_mo, drop_planned, existing_dns, from_payload, raise_for_results
+from ACI_Fixes import FixDeclined, register_fix
+from ACI_Fleet import confirm, read_fabric_credentials, run_fleet, select_groups
+from ACI_Journal import pending_groups, record_groups
+from ACI_Metrics import traced_operation
+from ACI_Query import Query, exists, iter_names
+from ACI_Verify import apic_check, record_rollout, rollout_checks
 
 policy_name = "testingDOM_vishwa"
-leaf_ID = 103  # Example leaf switch ID
-
-def read_fabric_credentials(csv_path):
-    fabrics = []
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            fabrics.append({
-                "APIC_URL": row["APIC_URL"],
-                "USERNAME": row["USERNAME"],
-                "PASSWORD": row["PASSWORD"]
-            })
-    return fabrics
-
-
-def login(APIC_URL, USERNAME, PASSWORD):
-    url = f"{APIC_URL}/api/aaaLogin.json"
-    auth_payload = {
-        "aaaUser": {
-            "attributes": {
-                "name": USERNAME,
-                "pwd": PASSWORD
-            }
-        }
-    }
-    response = requests.post(url, json=auth_payload, verify=False)
-    response.raise_for_status()
-    token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
-    return token
+# Switch profile holding the leaf selectors created by associate_group_to_switch
+switch_profile = "leafSwitchProfile"
+# Leaf IDs (e.g. "101-110,201") the selected node policy group is assigned to; empty to skip
+DOM_LEAVES = os.environ.get("ACI_DOM_LEAVES", "")
 
 
-# Create fabric node control policy to enable DOM
-def create_fabric_node_control_policy(APIC_URL, token, policy_name):
-    url = f"{APIC_URL}/api/mo/uni/fabric/nodecontrol-{policy_name}.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    payload = {
-        "fabricNodeControl": {
-            "attributes": {
-                "dn": f"uni/fabric/nodecontrol-{policy_name}",
-                "name": policy_name,
-                "control": "1",  # Enable DOM
-                "rn": f"nodecontrol-{policy_name}",
-                "status": "created"
-            }
-        }
-    }
-    response = requests.post(url, json=payload, headers=headers, verify=False)
-    response.raise_for_status()
-    print(f"Fabric node control policy '{policy_name}' created/enabled.")
+# Fabric node control policy with DOM enabled
+def node_control_policy(policy_name):
+    return desired_mo("fabricNodeControl", {"dn": f"uni/fabric/nodecontrol-{policy_name}", "name": policy_name, "control": "1"})
+
+
+# DOM enabled in the fabric node control policy (watched for drift by ACI_Watcher.py)
+DOM_NODE_CONTROL = node_control_policy(policy_name)
+
+
+# Create fabric node control policy to enable DOM (a dry run only prints the change)
+@traced_operation
+def create_fabric_node_control_policy(APIC_URL, token, policy_name, planned=None):
+    diff, results = converge(APIC_URL, token, [node_control_policy(policy_name)], planned=planned)
+    raise_for_results(results)
+    if results:
+        print(f"Fabric node control policy '{policy_name}' created/enabled.")
 
 
 # Check if a fabric node control policy exists
+@traced_operation
 def check_policy_exists(APIC_URL, token, policy_name):
-    url = f"{APIC_URL}/api/mo/uni/fabric/nodecontrol-{policy_name}.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    if response.status_code == 200:
-        data = response.json()
-        if data.get('imdata'):
-            return True
-    return False
-
-
-# Associate fabric node control policy to a policy group
-def associate_policy_to_group(APIC_URL, token, policy_name, group_name):
-    url = f"{APIC_URL}/api/mo/uni/fabric/funcprof/lenodepgrp-{group_name}.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    payload = {
+    return exists(APIC_URL, token, "fabricNodeControl", f"uni/fabric/nodecontrol-{policy_name}")
+
+
+def node_policy_group_payload(policy_name, group_name):
+    return {
         "fabricLeNodePGrp": {
             "attributes": {
                 "dn": f"uni/fabric/funcprof/lenodepgrp-{group_name}",
@@ -112,123 +83,294 @@ def associate_policy_to_group(APIC_URL, token, policy_name, group_name):
             ]
         }
     }
-    response = requests.post(url, json=payload, headers=headers, verify=False)
+
+
+# The policy and its relation from every group; the relations are written after the policy
+def association_desired(policy_name, group_names):
+    if not group_names:
+        return []
+    policy = node_control_policy(policy_name)
+    requires = [policy["attributes"]["dn"]]
+    return [policy] + [from_payload(node_policy_group_payload(policy_name, group_name), requires)
+                       for group_name in group_names]
+
+
+# Associate fabric node control policy to many policy groups.
+# Only the groups whose relations differ are pushed, in POSTs on uni/fabric/funcprof that run
+# concurrently once the policy itself is in place. Returns {group name: error or None}.
+@traced_operation
+def associate_policy_to_groups(APIC_URL, token, policy_name, group_names, chunk_size=None, planned=None):
+    group_names = pending_groups(APIC_URL, "dom", group_names)
+    desired = association_desired(policy_name, group_names)
+    diff, results = converge(APIC_URL, token, desired, chunk_size, planned=planned)
+    changed = {entry["dn"] for entry in diff}
+    group_results = {}
+    for group_name in group_names:
+        dn = f"uni/fabric/funcprof/lenodepgrp-{group_name}"
+        if dn not in changed:
+            group_results[group_name] = None
+            print(f"Policy '{policy_name}' is already associated to policy group '{group_name}'.")
+            continue
+        if dn not in results:
+            continue
+        group_results[group_name] = results[dn]
+        if results[dn] is None:
+            print(f"Policy '{policy_name}' associated to policy group '{group_name}'.")
+        else:
+            print(f"Failed to associate policy '{policy_name}' to policy group '{group_name}': {results[dn]}")
+    record_groups(APIC_URL, "dom", group_results)
+    record_rollout(APIC_URL, "dom", policy_name, [name for name in group_results if group_results[name] is None
+                                                  and f"uni/fabric/funcprof/lenodepgrp-{name}" in changed])
+    return group_results
+
+
+# What the fabric must show after the association (ACI_Verify): the policy with DOM enabled and
+# the relations of the groups formed
+@rollout_checks("dom")
+def dom_rollout_checks(APIC_URL, token, policy_name, group_names):
+    policy = node_control_policy(policy_name)
+    checks = [apic_check(policy["class"], policy["attributes"]["dn"], {"control": policy["attributes"]["control"]})]
+    for name in group_names:
+        checks.append(apic_check("fabricRsNodeCtrl", f"uni/fabric/funcprof/lenodepgrp-{name}/rsnodeCtrl",
+                                 {"tnFabricNodeControlName": policy_name, "state": "formed"}))
+    return checks, [f"/nodecontrol-{policy_name}/fault-", "/rsnodeCtrl/fault-"]
+
+
+# Leaf IDs such as "101-110,201" as a set of integers; ValueError names the first bad token
+def parse_node_ids(text):
+    node_ids = set()
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        if not start.isdigit() or not (end or start).isdigit() or int(start) > int(end or start):
+            raise ValueError(f"'{part}' is not a leaf ID or a from-to range of leaf IDs")
+        node_ids.update(range(int(start), int(end or start) + 1))
+    return node_ids
+
+
+# Checked when the module loads, so a typo stops the run before any fabric is touched
+try:
+    DOM_LEAF_IDS = parse_node_ids(DOM_LEAVES)
+except ValueError as e:
+    sys.exit(f"Invalid ACI_DOM_LEAVES '{DOM_LEAVES}': {e}")
+
+
+# Merge (from, to) ranges into the fewest contiguous ranges
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted((min(a, b), max(a, b)) for a, b in ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def coalesce_node_ids(node_ids):
+    return merge_ranges((node_id, node_id) for node_id in node_ids)
+
+
+def node_block_name(start, end):
+    return f"blk{start}-{end}"
+
+
+def format_ranges(ranges):
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in sorted(ranges))
+
+
+def leaf_selector_dn(profile_name, selector_name):
+    return f"uni/fabric/leprof-{profile_name}/leaves-{selector_name}-typ-range"
+
+
+# Node blocks {name: (from, to)} and policy group relation of a leaf selector
+@traced_operation
+def get_leaf_selector(APIC_URL, token, selector_dn):
+    response = Query.of_mo(selector_dn).scope("children", ["fabricNodeBlk", "fabricRsLeNodePGrp"]) \
+        .props("config-only").get(APIC_URL, token)
     response.raise_for_status()
-    print(f"Policy '{policy_name}' associated to policy group '{group_name}'.")
+    blocks, group_dn = {}, None
+    for item in response.json().get("imdata", []):
+        for cls, mo in item.items():
+            attrs = mo["attributes"]
+            if cls == "fabricNodeBlk":
+                blocks[attrs["name"]] = (int(attrs["from_"]), int(attrs["to_"]))
+            elif cls == "fabricRsLeNodePGrp":
+                group_dn = attrs.get("tDn")
+    return blocks, group_dn
 
 
-# Associate policy group to a leaf switch (example for leaf 103)
-'''
-def associate_group_to_switch(token, group_name, leaf_id):
-    url = f"{APIC_URL}/api/mo/uni/fabric/leprof-leafSwitchProfile.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
+# Associate a policy group to a set of leaf switches through a leaf selector of the switch profile.
+# The leaf IDs and the blocks already in the selector are coalesced into the fewest from_/to_ ranges;
+# only the blocks that change are sent, all in one POST.
+@traced_operation
+def associate_group_to_switch(APIC_URL, token, group_name, leaf_ids, profile_name=switch_profile,
+                              selector_name=None):
+    selector_name = selector_name or group_name
+    profile_dn = f"uni/fabric/leprof-{profile_name}"
+    selector_dn = leaf_selector_dn(profile_name, selector_name)
+    group_dn = f"uni/fabric/funcprof/lenodepgrp-{group_name}"
+    existing, current_group = get_leaf_selector(APIC_URL, token, selector_dn)
+    wanted = {node_block_name(start, end): (start, end)
+              for start, end in merge_ranges(list(existing.values()) + coalesce_node_ids(leaf_ids))}
+    removed = [name for name in existing if name not in wanted]
+    changed = [name for name, block in wanted.items() if existing.get(name) != block]
+    if not removed and not changed and current_group == group_dn:
+        print(f"Policy group '{group_name}' is already associated to leaf switches {format_ranges(wanted.values())}.")
+        return
+    children = [{"fabricNodeBlk": {"attributes": {"dn": f"{selector_dn}/nodeblk-{name}", "status": "deleted"}}}
+                for name in removed]
+    children += [
+        {
+            "fabricNodeBlk": {
+                "attributes": {
+                    "dn": f"{selector_dn}/nodeblk-{name}",
+                    "from_": str(wanted[name][0]),
+                    "to_": str(wanted[name][1]),
+                    "name": name,
+                    "rn": f"nodeblk-{name}",
+                    "status": "created,modified"
+                }
+            }
+        }
+        for name in changed
+    ]
+    if current_group != group_dn:
+        children.append({"fabricRsLeNodePGrp": {"attributes": {"tDn": group_dn, "status": "created,modified"}}})
     payload = {
         "fabricLeafP": {
             "attributes": {
-                "dn": "uni/fabric/leprof-leafSwitchProfile",
-                "name": "leafSwitchProfile",
-                "rn": "leprof-leafSwitchProfile",
+                "dn": profile_dn,
+                "name": profile_name,
+                "rn": f"leprof-{profile_name}",
                 "status": "created,modified"
             },
             "children": [
                 {
                     "fabricLeafS": {
                         "attributes": {
-                            "dn": f"uni/fabric/leprof-leafSwitchProfile/leaves-test-typ-range",
+                            "dn": selector_dn,
                             "type": "range",
-                            "name": "test",
-                            "rn": "leaves-test-typ-range",
+                            "name": selector_name,
+                            "rn": f"leaves-{selector_name}-typ-range",
                             "status": "created,modified"
                         },
-                        "children": [
-                            {
-                                "fabricNodeBlk": {
-                                    "attributes": {
-                                        "dn": f"uni/fabric/leprof-leafSwitchProfile/leaves-test-typ-range/nodeblk-{leaf_id:08x}",
-                                        "from_": str(leaf_id),
-                                        "to_": str(leaf_id),
-                                        "name": f"{leaf_id:08x}",
-                                        "rn": f"nodeblk-{leaf_id:08x}",
-                                        "status": "created,modified"
-                                    }
-                                }
-                            },
-                            {
-                                "fabricRsLeNodePGrp": {
-                                    "attributes": {
-                                        "tDn": f"uni/fabric/funcprof/lenodepgrp-{group_name}",
-                                        "status": "created"
-                                    }
-                                }
-                            }
-                        ]
+                        "children": children
                     }
                 }
             ]
         }
     }
-    response = requests.post(url, json=payload, headers=headers, verify=False)
+    if DRY_RUN:
+        print(f"Dry run: policy group '{group_name}' would be associated to leaf switches "
+              f"{format_ranges(wanted.values())} ({len(changed)} block(s) written, {len(removed)} removed), "
+              "nothing pushed.")
+        return
+    response = apic_post(APIC_URL, token, f"/api/mo/{profile_dn}.json", payload)
     response.raise_for_status()
-    print(f"Policy group '{group_name}' associated to leaf switch {leaf_id}.")'''
+    print(f"Policy group '{group_name}' associated to leaf switches {format_ranges(wanted.values())} "
+          f"({len(wanted)} block(s): {len(changed)} written, {len(removed)} removed).")
+
+
+# Yield the policy group names of the fabric page by page
+def iter_group_names(APIC_URL, token):
+    return iter_names(APIC_URL, token, "fabricLeNodePGrp")
 
 
 # List all policy group names in the fabric and prompt user to choose one
+@traced_operation
 def get_all_group_names(APIC_URL, token):
-    url = f"{APIC_URL}/api/class/fabricLeNodePGrp.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    data = response.json()
-    groups = [item['fabricLeNodePGrp']['attributes']['name'] for item in data.get('imdata', [])]
-    return groups
+    return list(iter_group_names(APIC_URL, token))
 
 
-def main():
-    csv_path = input("Enter path to CSV file with fabric credentials: ")
-    fabrics = read_fabric_credentials(csv_path)
-    for fabric in fabrics:
-        APIC_URL = fabric["APIC_URL"]
-        USERNAME = fabric["USERNAME"]
-        PASSWORD = fabric["PASSWORD"]
-        print(f"\n--- Processing fabric: {APIC_URL} ---")
-        try:
-            token = login(APIC_URL, USERNAME, PASSWORD)
-        except Exception as e:
-            print(f"Login failed for {APIC_URL}: {e}")
-            continue
-        groups = get_all_group_names(APIC_URL, token)
+# The policy groups flagged by ACI Vetr that still exist in the fabric
+def flagged_groups(APIC_URL, token, group_names):
+    dns = {f"uni/fabric/funcprof/lenodepgrp-{name}": name for name in group_names}
+    found = existing_dns(APIC_URL, token, "fabricLeNodePGrp", dns)
+    missing = [name for dn, name in dns.items() if dn not in found]
+    if missing:
+        print(f"{len(missing)} flagged policy group(s) no longer exist: {', '.join(missing)}")
+    return [name for dn, name in dns.items() if dn in found]
+
+
+# Full DOM flow on an already logged-in fabric.
+# ACI_Pipeline passes the group names (discovered) and the changes for all of them (planned)
+# it read ahead; otherwise they are read here.
+# ACI_Vetr_Findings passes the flagged groups (groups); they are used instead of a selection.
+@register_fix("dom", "Fabric Policy - Enable DOM and assign it to node policy groups")
+def run_dom_fix(APIC_URL, token, discovered=None, planned=None, groups=None):
+    if groups is not None:
+        selected_groups = flagged_groups(APIC_URL, token, groups)
+        if not selected_groups:
+            print("No flagged policy groups in the fabric. Skipping this fabric.")
+            return
+    else:
+        groups = discovered if discovered is not None else get_all_group_names(APIC_URL, token)
         if not groups:
             print("No policy groups found in the fabric.")
-            continue
-        print("Available policy groups:")
-        for idx, name in enumerate(groups, 1):
-            print(f"{idx}. {name}")
-        choices = input("Enter the numbers of the groups you want to use (comma separated): ")
-        try:
-            selected_indices = [int(x.strip())-1 for x in choices.split(',')]
-            selected_groups = [groups[i] for i in selected_indices if 0 <= i < len(groups)]
-        except (IndexError, ValueError):
-            print("Invalid selection. Skipping this fabric.")
-            continue
+            return
+        selected_groups = select_groups(groups, "Available policy groups:",
+                                        "Enter the numbers of the groups you want to use (comma separated): ")
         if not selected_groups:
             print("No valid groups selected. Skipping this fabric.")
-            continue
-        print(f"Selected groups: {', '.join(selected_groups)}")
-        print("creating policy")
-        if not check_policy_exists(APIC_URL, token, policy_name):
-            create_fabric_node_control_policy(APIC_URL, token, policy_name)
-        else:
-            print(f"Policy '{policy_name}' already exists. Skipping creation.")
-        print("outside creating")
-        proceed = input("Do you want to associate the policy to the selected groups? (y/n): ")
-        if proceed.strip().lower() != 'y':
-            print("Skipping policy-to-group association for this fabric.")
-            continue
-        for group_name in selected_groups:
-            print(f"associating policy to group {group_name}")
-            associate_policy_to_group(APIC_URL, token, policy_name, group_name)
-            print(f"outside associating {group_name}")
-    # You can also repeat associate_group_to_switch for each group if needed
+            raise FixDeclined("No policy groups selected")
+    print(f"Selected groups: {', '.join(selected_groups)}")
+    print("creating policy")
+    if planned is not None:
+        policy_present = not any(entry["action"] == "create"
+                                 for entry in changes_for(APIC_URL, token, [DOM_NODE_CONTROL], planned))
+    else:
+        policy_present = check_policy_exists(APIC_URL, token, policy_name)
+    if not policy_present:
+        create_fabric_node_control_policy(APIC_URL, token, policy_name, planned)
+        drop_planned(planned, DOM_NODE_CONTROL["attributes"]["dn"])
+    else:
+        print(f"Policy '{policy_name}' already exists. Skipping creation.")
+    print("outside creating")
+    if not confirm("Do you want to associate the policy to the selected groups? (y/n): ",
+                   step="dom_association", changes=len(selected_groups)):
+        print("Skipping policy-to-group association for this fabric.")
+        raise FixDeclined("DOM policy not associated to the policy groups")
+    print(f"associating policy to {len(selected_groups)} group(s)")
+    group_results = associate_policy_to_groups(APIC_URL, token, policy_name, selected_groups, planned=planned)
+    failed = [name for name, error in group_results.items() if error is not None]
+    if failed:
+        raise RuntimeError(f"Policy '{policy_name}' not associated to policy group(s): {', '.join(failed)}")
+    print("outside associating")
+    if DOM_LEAF_IDS:
+        associate_leaves(APIC_URL, token, selected_groups, DOM_LEAF_IDS)
+
+
+# A leaf selector points to one node policy group, so the leaves go to a single selected group
+def associate_leaves(APIC_URL, token, selected_groups, leaf_ids):
+    if len(selected_groups) != 1:
+        print("Leaf switches can only be associated when exactly one policy group is selected. Skipping.")
+        raise FixDeclined(f"Leaf switches not associated ({len(selected_groups)} policy groups selected)")
+    if not confirm(f"Do you want to associate policy group '{selected_groups[0]}' to leaf switches "
+                   f"{format_ranges(coalesce_node_ids(leaf_ids))}? (y/n): ",
+                   step="dom_switch_association", changes=len(leaf_ids)):
+        print("Skipping leaf switch association for this fabric.")
+        raise FixDeclined("Leaf switches not associated")
+    associate_group_to_switch(APIC_URL, token, selected_groups[0], leaf_ids)
+
+
+def process_fabric(fabric):
+    APIC_URL = fabric["APIC_URL"]
+    USERNAME = fabric["USERNAME"]
+    PASSWORD = fabric["PASSWORD"]
+    print(f"\n--- Processing fabric: {APIC_URL} ---")
+    try:
+        token = login(APIC_URL, USERNAME, PASSWORD)
+    except Exception as e:
+        print(f"Login failed for {APIC_URL}: {e}")
+        return
+    run_dom_fix(APIC_URL, token)
+
+
+def main():
+    csv_path = input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    run_fleet(fabrics, process_fabric)
 
 
 if __name__ == "__main__":
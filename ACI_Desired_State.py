@@ -0,0 +1,284 @@
+##################
+# Desired-state layer shared by the ACI Vetr fix scripts
+# Flow of the code is as follows:
+# 1. A fix declares the objects it wants (class, attributes, children) instead of POSTing them.
+# 2. The current objects are read once, one class query per class with only their configuration
+#    and only the child classes that are compared (ACI_Query).
+# 3. A minimal diff is computed: only missing objects, changed attributes and changed children.
+# 4. The diff is printed and only the changed objects are pushed (nothing is pushed in dry-run mode).
+#    Independent POSTs run concurrently (ACI_Task_Graph); an object is written after its parent
+#    and after the objects it requires (e.g. the policy a relation points to).
+# Re-running a fix on a compliant fabric therefore sends no write at all.
+###################
+
+import os
+
+from ACI_Client import BULK_CHUNK_SIZE, apic_post, apic_post_bulk
+from ACI_Query import Query, dn_in
+from ACI_Task_Graph import TaskGraph
+
+# ACI_DRY_RUN=1 prints the changes that would be made without pushing them
+DRY_RUN = os.environ.get("ACI_DRY_RUN", "0") == "1"
+# Above this many objects of one class, read the whole class page by page instead of filtering on every DN
+DN_FILTER_LIMIT = 50
+
+# Parents that accept their children in one bulk POST
+BULK_PARENTS = {
+    "uni/fabric/funcprof": "fabricFuncP",
+    "uni/infra/funcprof": "infraFuncP",
+}
+
+_NOT_COMPARED = ("dn", "rn", "status")
+
+
+# Desired object; write_only attributes are sent with a change but never compared.
+# requires: DNs that must be written first when they are part of the same change
+def desired_mo(cls, attributes, children=None, write_only=None, requires=None):
+    return {
+        "class": cls,
+        "attributes": dict(attributes),
+        "children": list(children or []),
+        "write_only": dict(write_only or {}),
+        "requires": list(requires or []),
+    }
+
+
+# Desired object from an APIC POST payload such as the ones built by the fix scripts
+def from_payload(payload, requires=None):
+    cls, mo = next(iter(payload.items()))
+    attributes = {k: v for k, v in mo["attributes"].items() if k != "status"}
+    return desired_mo(cls, attributes, [from_payload(child) for child in mo.get("children", [])],
+                      requires=requires)
+
+
+def _child_key(cls, attributes):
+    return (cls, attributes.get("name") or None)
+
+
+# Read the current objects of every desired object, one query per class. Only the configuration
+# is read, with the children of the classes that are compared (none for objects without children).
+# Large classes are read page by page and only the desired objects are kept.
+def fetch_current(APIC_URL, token, desired):
+    dns_by_class, child_classes = {}, {}
+    for mo in desired:
+        dns_by_class.setdefault(mo["class"], []).append(mo["attributes"]["dn"])
+        child_classes.setdefault(mo["class"], set()).update(child["class"] for child in mo["children"])
+    current = {}
+    for cls, dns in dns_by_class.items():
+        query = Query.of_class(cls).props("config-only")
+        if child_classes[cls]:
+            query.subtree("children", sorted(child_classes[cls]))
+        if len(dns) <= DN_FILTER_LIMIT:
+            response = query.where(dn_in(cls, dns)).get(APIC_URL, token)
+            response.raise_for_status()
+            pages = [[item.get(cls) for item in response.json().get('imdata', [])]]
+        else:
+            pages = query.pages(APIC_URL, token)
+        wanted = set(dns)
+        for mos in pages:
+            for mo in mos:
+                if mo is not None and mo["attributes"]["dn"] in wanted:
+                    current[mo["attributes"]["dn"]] = mo
+    return current
+
+
+# DNs of the class that exist on the fabric, among the given ones (names only are read)
+def existing_dns(APIC_URL, token, cls, dns):
+    dns = list(dict.fromkeys(dns))
+    found = set()
+    for start in range(0, len(dns), DN_FILTER_LIMIT):
+        query = Query.of_class(cls).where(dn_in(cls, dns[start:start + DN_FILTER_LIMIT])).props("naming-only")
+        response = query.get(APIC_URL, token)
+        response.raise_for_status()
+        for item in response.json().get('imdata', []):
+            mo = item.get(cls)
+            if mo is not None:
+                found.add(mo["attributes"]["dn"])
+    return found
+
+
+def _diff_mo(desired, current):
+    attributes = desired["attributes"]
+    if current is None:
+        return {
+            "class": desired["class"],
+            "dn": attributes.get("dn"),
+            "action": "create",
+            "changes": {k: (None, v) for k, v in attributes.items() if k not in _NOT_COMPARED},
+            "children": [_diff_mo(child, None) for child in desired["children"]],
+            "desired": desired,
+        }
+    current_attributes = current.get("attributes", {})
+    changes = {}
+    for key, value in attributes.items():
+        if key in _NOT_COMPARED:
+            continue
+        if str(current_attributes.get(key, "")) != str(value):
+            changes[key] = (current_attributes.get(key), value)
+    current_children = {}
+    for child in current.get("children", []):
+        for child_cls, child_mo in child.items():
+            current_children[_child_key(child_cls, child_mo.get("attributes", {}))] = child_mo
+    children = []
+    for child in desired["children"]:
+        child_diff = _diff_mo(child, current_children.get(_child_key(child["class"], child["attributes"])))
+        if child_diff is not None:
+            children.append(child_diff)
+    if not changes and not children:
+        return None
+    return {
+        "class": desired["class"],
+        "dn": attributes.get("dn"),
+        "action": "modify",
+        "changes": changes,
+        "children": children,
+        "desired": desired,
+    }
+
+
+# Compute the minimal list of changes needed to reach the desired objects
+def plan_changes(APIC_URL, token, desired):
+    current = fetch_current(APIC_URL, token, desired)
+    diff = []
+    for mo in desired:
+        entry = _diff_mo(mo, current.get(mo["attributes"]["dn"]))
+        if entry is not None:
+            diff.append(entry)
+    return diff
+
+
+# Plan the desired objects ahead of the writes (ACI_Pipeline); changes_for() takes its changes
+# from the result instead of reading the APIC again
+def plan_ahead(APIC_URL, token, desired):
+    return {"dns": {mo["attributes"]["dn"] for mo in desired}, "diff": plan_changes(APIC_URL, token, desired)}
+
+
+# Forget the planned change of an object written since (it is now as desired)
+def drop_planned(planned, dn):
+    if planned is not None:
+        planned["diff"] = [entry for entry in planned["diff"] if entry["dn"] != dn]
+
+
+# Changes for the desired objects; those covered by a plan_ahead() result are not read again
+def changes_for(APIC_URL, token, desired, planned=None):
+    if planned is None:
+        return plan_changes(APIC_URL, token, desired)
+    dns = {mo["attributes"]["dn"] for mo in desired}
+    diff = [entry for entry in planned["diff"] if entry["dn"] in dns]
+    not_planned = [mo for mo in desired if mo["attributes"]["dn"] not in planned["dns"]]
+    if not_planned:
+        diff += plan_changes(APIC_URL, token, not_planned)
+    return diff
+
+
+def _entry_payload(entry, is_child=False):
+    desired = entry["desired"]
+    attributes = {}
+    for key in ("dn", "name", "rn"):
+        if key in desired["attributes"] and (key != "dn" or not is_child):
+            attributes[key] = desired["attributes"][key]
+    if entry["action"] == "create":
+        attributes.update({k: v for k, v in desired["attributes"].items() if k != "dn" or not is_child})
+        attributes["status"] = "created,modified"
+    else:
+        attributes.update({k: new for k, (old, new) in entry["changes"].items()})
+        attributes["status"] = "created,modified" if is_child else "modified"
+    if entry["changes"] or entry["action"] == "create":
+        attributes.update(desired["write_only"])
+    mo = {"attributes": attributes}
+    if entry["children"]:
+        mo["children"] = [_entry_payload(child, True) for child in entry["children"]]
+    return {entry["class"]: mo}
+
+
+def _print_entry(entry, indent):
+    marker = "+" if entry["action"] == "create" else "~"
+    label = entry["dn"] or entry["class"]
+    print(f"{indent}{marker} {label} ({entry['class']})")
+    for key, (old, new) in entry["changes"].items():
+        print(f"{indent}    {key}: {old} -> {new}")
+    for child in entry["children"]:
+        _print_entry(child, indent + "    ")
+
+
+def print_diff(diff):
+    if not diff:
+        print("No changes needed.")
+        return
+    for entry in diff:
+        _print_entry(entry, "  ")
+
+
+def _post_entry(APIC_URL, token, entry):
+    response = apic_post(APIC_URL, token, f"/api/mo/{entry['dn']}.json", _entry_payload(entry))
+    response.raise_for_status()
+
+
+# Push only the changed objects; siblings under a bulk parent go in one POST per chunk.
+# The POSTs run concurrently, each after the POSTs of its ancestors and required objects.
+# Returns {dn: None on success or the error}.
+def apply_diff(APIC_URL, token, diff, chunk_size=None):
+    if chunk_size is None:
+        chunk_size = BULK_CHUNK_SIZE
+    chunk_size = max(1, chunk_size)
+    by_parent = {}
+    for entry in diff:
+        by_parent.setdefault(entry["dn"].rsplit("/", 1)[0], []).append(entry)
+    # One task per POST: {task name: (bulk parent DN or None, entries)}
+    tasks = {}
+    for parent_dn, entries in by_parent.items():
+        if parent_dn in BULK_PARENTS and len(entries) > 1:
+            for start in range(0, len(entries), chunk_size):
+                tasks[f"{parent_dn}[{start}]"] = (parent_dn, entries[start:start + chunk_size])
+        else:
+            for entry in entries:
+                tasks[entry["dn"]] = (None, [entry])
+    task_of = {entry["dn"]: name for name, (_, entries) in tasks.items() for entry in entries}
+    graph = TaskGraph()
+    for name, (parent_dn, entries) in tasks.items():
+        after = set()
+        for entry in entries:
+            for required in entry["desired"].get("requires", []) + _ancestors(entry["dn"]):
+                if required in task_of and task_of[required] != name:
+                    after.add(task_of[required])
+        if parent_dn is not None:
+            graph.add(name, apic_post_bulk, APIC_URL, token, BULK_PARENTS[parent_dn], parent_dn,
+                      [_entry_payload(entry) for entry in entries], len(entries), after=sorted(after))
+        else:
+            graph.add(name, _post_entry, APIC_URL, token, entries[0], after=sorted(after))
+    results = {}
+    for name, (result, error) in graph.run().items():
+        parent_dn, entries = tasks[name]
+        if parent_dn is not None and error is None:
+            names = {entry["desired"]["attributes"].get("name"): entry["dn"] for entry in entries}
+            for child_name, child_error in result.items():
+                results[names[child_name]] = child_error
+        else:
+            for entry in entries:
+                results[entry["dn"]] = error
+    return results
+
+
+def _ancestors(dn):
+    parts = dn.split("/")
+    return ["/".join(parts[:index]) for index in range(1, len(parts))]
+
+
+# Raise the first error of apply_diff() results, for fixes that change a single object
+def raise_for_results(results):
+    for error in results.values():
+        if error is not None:
+            raise error
+
+
+# Plan, print and (unless dry-run) apply the desired objects; returns (diff, results)
+def converge(APIC_URL, token, desired, chunk_size=None, dry_run=None, planned=None):
+    if dry_run is None:
+        dry_run = DRY_RUN
+    diff = changes_for(APIC_URL, token, desired, planned)
+    print_diff(diff)
+    if not diff or dry_run:
+        if diff:
+            print(f"Dry run: {len(diff)} object(s) would be changed, nothing pushed.")
+        return diff, {}
+    return diff, apply_diff(APIC_URL, token, diff, chunk_size)
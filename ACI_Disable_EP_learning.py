@@ -1,84 +1,45 @@
-import requests
-import urllib3
-import csv
+from ACI_Auth import login
+from ACI_Desired_State import DRY_RUN, apply_diff, changes_for, desired_mo, print_diff, raise_for_results
+from ACI_Fixes import FixDeclined, register_fix
+from ACI_Fleet import confirm, read_fabric_credentials, run_fleet
+from ACI_Metrics import traced_operation
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+REMOTE_EP_LEARNING = desired_mo("infraSetPol", {"dn": "uni/infra/settings", "unicastXrEpLearnDisable": "yes"})
 
-def read_fabric_credentials(csv_path):
-    fabrics = []
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            fabrics.append({
-                "APIC_URL": row["APIC_URL"],
-                "USERNAME": row["USERNAME"],
-                "PASSWORD": row["PASSWORD"]
-            })
-    return fabrics
-
-def login(APIC_URL, USERNAME, PASSWORD):
-    url = f"{APIC_URL}/api/aaaLogin.json"
-    payload = {
-        "aaaUser": {
-            "attributes": {
-                "name": USERNAME,
-                "pwd": PASSWORD
-            }
-        }
-    }
-    response = requests.post(url, json=payload, verify=False)
-    response.raise_for_status()
-    token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
-    return token
-
-def ensure_disable_remote_ep_learning(APIC_URL, token):
-    url = f"{APIC_URL}/api/mo/uni/infra/settings.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    data = response.json()
-    disabled = False
-    if data.get('imdata'):
-        attrs = data['imdata'][0]['infraSetPol']['attributes']
-        if attrs.get('remoteEpLearn', '').lower() == 'disabled':
-            disabled = True
-    if not disabled:
-        print("Remote EP Learning is not disabled.")
-        choice = input("Do you want to disable Remote EP Learning? (y/n): ")
-        if choice.strip().lower() == 'y':
-            payload = {
-                "infraSetPol": {
-                    "attributes": {
-                        "dn": "uni/infra/settings",
-                        "unicastXrEpLearnDisable": "yes",
-                        "status": "modified"
-                    }
-                }
-            }
-            post_url = f"{APIC_URL}/api/mo/uni/infra/settings.json"
-            post_response = requests.post(post_url, json=payload, headers=headers, verify=False)
-            post_response.raise_for_status()
-            print("Remote EP Learning disabled.")
-        else:
-            print("Remote EP Learning not disabled. Exiting.")
-            exit(1)
-    else:
+@register_fix("remote_ep_learning", "Global - Disable Remote EP Learning")
+@traced_operation
+def ensure_disable_remote_ep_learning(APIC_URL, token, planned=None):
+    diff = changes_for(APIC_URL, token, [REMOTE_EP_LEARNING], planned)
+    if not diff:
         print("Remote EP Learning is already disabled.")
+        return
+    print("Remote EP Learning is not disabled.")
+    print_diff(diff)
+    if DRY_RUN:
+        print("Dry run: no change pushed.")
+        return
+    if not confirm("Do you want to disable Remote EP Learning? (y/n): ", step="remote_ep_learning", changes=len(diff)):
+        print("Remote EP Learning not disabled. Skipping this fabric.")
+        raise FixDeclined("Remote EP Learning not disabled")
+    raise_for_results(apply_diff(APIC_URL, token, diff))
+    print("Remote EP Learning disabled.")
+
+def process_fabric(fabric):
+    APIC_URL = fabric["APIC_URL"]
+    USERNAME = fabric["USERNAME"]
+    PASSWORD = fabric["PASSWORD"]
+    print(f"\n--- Processing fabric: {APIC_URL} ---")
+    try:
+        token = login(APIC_URL, USERNAME, PASSWORD)
+    except Exception as e:
+        print(f"Login failed for {APIC_URL}: {e}")
+        return
+    ensure_disable_remote_ep_learning(APIC_URL, token)
 
 def main():
     csv_path = input("Enter path to CSV file with fabric credentials: ")
     fabrics = read_fabric_credentials(csv_path)
-    for fabric in fabrics:
-        APIC_URL = fabric["APIC_URL"]
-        USERNAME = fabric["USERNAME"]
-        PASSWORD = fabric["PASSWORD"]
-        print(f"\n--- Processing fabric: {APIC_URL} ---")
-        try:
-            token = login(APIC_URL, USERNAME, PASSWORD)
-        except Exception as e:
-            print(f"Login failed for {APIC_URL}: {e}")
-            continue
-        ensure_disable_remote_ep_learning(APIC_URL, token)
+    run_fleet(fabrics, process_fabric)
 
 if __name__ == "__main__":
     main()
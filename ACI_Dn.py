@@ -0,0 +1,21 @@
+##################
+# Distinguished name helpers (standard library only)
+# Flow of the code is as follows:
+# 1. parent_dn walks a DN back to its last "/" outside the [...] naming values, which may
+#    themselves contain "/" (e.g. interface names or relation targets).
+# 2. Shared by ACI_Snapshot (parent index of the store) and ACI_Simulator (object tree).
+###################
+
+
+# Parent of a DN, ignoring "/" inside [...] naming values
+def parent_dn(dn):
+    depth = 0
+    for index in range(len(dn) - 1, -1, -1):
+        char = dn[index]
+        if char == "]":
+            depth += 1
+        elif char == "[":
+            depth -= 1
+        elif char == "/" and depth == 0:
+            return dn[:index]
+    return ""
@@ -0,0 +1,64 @@
+##################
+# Registry of the ACI Vetr fixes that can be applied by ACI_Vetr_Runner.py
+# Each fix is a function fix(APIC_URL, token) registered with @register_fix.
+# With a journal (ACI_JOURNAL) a fix already completed on a fabric is skipped.
+###################
+
+import contextvars
+import functools
+
+from ACI_Desired_State import DRY_RUN
+from ACI_Journal import get_journal
+
+FIXES = {}
+
+# Name of the fix running in the current fabric worker (used by plan approval rules)
+current_fix = contextvars.ContextVar("aci_fix", default=None)
+
+
+# Raised when the operator (or the plan) declines a change; only the current fix stops
+class FixDeclined(Exception):
+    pass
+
+
+# Status of a fabric from the outcome of its fixes ({fix: "done", "declined" or "failed"})
+def fixes_status(outcomes):
+    if "failed" in outcomes.values():
+        return "failed"
+    if "declined" in outcomes.values():
+        return "declined"
+    return "ok"
+
+
+def register_fix(name, description):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(APIC_URL, *args, **kwargs):
+            journal = get_journal()
+            if journal is not None and journal.is_done(APIC_URL, name):
+                print(f"Fix '{name}' already completed on {APIC_URL} (journal). Skipping.")
+                return None
+            # A dry run pushes nothing, so it leaves the journal as it is
+            if DRY_RUN:
+                journal = None
+            if journal is not None:
+                journal.mark(APIC_URL, name, "started")
+            token = current_fix.set(name)
+            try:
+                result = func(APIC_URL, *args, **kwargs)
+            except FixDeclined as e:
+                if journal is not None:
+                    journal.mark(APIC_URL, name, "declined", error=e)
+                raise
+            except BaseException as e:
+                if journal is not None:
+                    journal.mark(APIC_URL, name, "failed", error=repr(e))
+                raise
+            finally:
+                current_fix.reset(token)
+            if journal is not None:
+                journal.finish_fix(APIC_URL, name)
+            return result
+        FIXES[name] = {"name": name, "description": description, "func": wrapper}
+        return wrapper
+    return decorator
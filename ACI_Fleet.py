@@ -0,0 +1,262 @@
+##################
+# Fleet execution helpers shared by the ACI Vetr fix scripts
+# Flow of the code is as follows:
+# 1. Run a per-fabric function for every fabric, up to MAX_PARALLEL_FABRICS at a time.
+# 2. Capture the output of each fabric and print it in inventory order.
+# 3. Serialise interactive prompts so only one fabric asks a question at a time.
+#    y/n questions and group selections can instead be answered by a plan (ACI_Plan.py).
+# 4. Print a summary table with how long each fabric took and how its connections were reused.
+# 5. Verify on all fabrics at once that the leaves took the changes of the fixes (ACI_Verify.py).
+###################
+
+import contextlib
+import contextvars
+import csv
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ACI_Client import connection_stats, throttle_stats
+from ACI_Fixes import FixDeclined, fixes_status
+from ACI_Query import QUERY_SAVINGS, print_savings
+from ACI_Verify import verify_rollouts
+
+# Number of fabrics processed at the same time (1 keeps the old one-by-one behaviour)
+MAX_PARALLEL_FABRICS = int(os.environ.get("ACI_MAX_PARALLEL_FABRICS", "1"))
+# Answer every y/n question with this value instead of asking (e.g. "y" for unattended runs).
+# Group selections are not answered: they need a plan (ACI_Plan) or ACI Vetr findings.
+AUTO_ANSWER = os.environ.get("ACI_AUTO_ANSWER")
+
+# Fabric processed by the current worker
+current_fabric = contextvars.ContextVar("aci_fabric", default=None)
+
+_local = threading.local()
+_decider = None
+_prompt_lock = threading.Lock()
+_print_lock = threading.Lock()
+
+
+# stdout proxy that sends output of fleet worker threads to their own fabric buffer
+class _FabricOutput:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(_local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(_local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def read_fabric_credentials(csv_path):
+    fabrics = []
+    with open(csv_path, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            fabrics.append({
+                "APIC_URL": row["APIC_URL"],
+                "USERNAME": row["USERNAME"],
+                "PASSWORD": row["PASSWORD"]
+            })
+    return fabrics
+
+
+# Route print() of threads that capture their output (capture_output) to their buffer
+@contextlib.contextmanager
+def routed_output():
+    original_stdout = sys.stdout
+    sys.stdout = _FabricOutput(original_stdout)
+    try:
+        yield
+    finally:
+        sys.stdout = original_stdout
+
+
+# Collect what the current thread prints in buffer (a list) while the block runs
+@contextlib.contextmanager
+def capture_output(buffer, fabric_name):
+    _local.buffer = buffer
+    _local.flushed = False
+    _local.fabric = fabric_name
+    try:
+        yield buffer
+    finally:
+        _local.buffer = None
+
+
+def _fabric_name(fabric):
+    return fabric["APIC_URL"]
+
+
+def _write_out(text):
+    with _print_lock:
+        stream = sys.stdout.stream if isinstance(sys.stdout, _FabricOutput) else sys.stdout
+        stream.write(text)
+        stream.flush()
+
+
+# Ask the operator a question; in parallel mode only one fabric can ask at a time
+def prompt(question):
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        return input(question)
+    with _prompt_lock:
+        # Show what this fabric printed so far so the question has its context
+        pending = "".join(buffer)
+        buffer.clear()
+        _local.flushed = True
+        _write_out(pending)
+        _local.buffer = None
+        try:
+            return input(f"[{_local.fabric}] {question}")
+        finally:
+            _local.buffer = buffer
+
+
+# Answer y/n questions and group selections with decider.confirm(step, question, changes) and
+# decider.select(groups) instead of asking the operator; None restores the prompts
+def set_decider(decider):
+    global _decider
+    _decider = decider
+
+
+# Whether a plan answers the questions and picks the groups
+def has_decider():
+    return _decider is not None
+
+
+# Ask a y/n question; step names the change so a plan can approve or deny it
+def confirm(question, step=None, changes=None):
+    if _decider is not None:
+        return _decider.confirm(step, question, changes)
+    if AUTO_ANSWER is not None:
+        print(f"{question}{AUTO_ANSWER}")
+        return AUTO_ANSWER.strip().lower() == 'y'
+    return prompt(question).strip().lower() == 'y'
+
+
+# Let the operator (or the plan) pick policy groups from a list of names
+def select_groups(groups, title, question):
+    if _decider is not None:
+        return _decider.select(groups)
+    if AUTO_ANSWER is not None:
+        raise RuntimeError(f"{len(groups)} policy group(s) to choose from, but ACI_AUTO_ANSWER only answers y/n "
+                           "questions: select the groups with a plan (ACI_Plan.py) or ACI Vetr findings")
+    print(title)
+    for idx, name in enumerate(groups, 1):
+        print(f"{idx}. {name}")
+    choices = prompt(question)
+    try:
+        selected_indices = [int(x.strip())-1 for x in choices.split(',')]
+    except ValueError:
+        print("Invalid selection.")
+        return []
+    return [groups[i] for i in selected_indices if 0 <= i < len(groups)]
+
+
+def _run_one(process_fabric, fabric, capture):
+    result = {"fabric": _fabric_name(fabric), "status": "ok", "error": None, "output": "", "outcomes": {}}
+    if capture:
+        _local.buffer = []
+        _local.flushed = False
+        _local.fabric = result["fabric"]
+    fabric_token = current_fabric.set(result["fabric"])
+    start = time.perf_counter()
+    try:
+        outcomes = process_fabric(fabric)
+        # run_fixes returns the outcome of every fix; a failed or declined fix is the fabric's status
+        if isinstance(outcomes, dict):
+            result["outcomes"] = outcomes
+            result["status"] = fixes_status(outcomes)
+            failed = [name for name, outcome in outcomes.items() if outcome == "failed"]
+            if failed:
+                result["error"] = f"fix(es) failed: {', '.join(failed)}"
+    except FixDeclined as e:
+        result["status"] = "declined"
+        result["error"] = e
+    except SystemExit as e:
+        result["status"] = "aborted"
+        result["error"] = e
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = e
+        print(f"Error while processing {result['fabric']}: {e}")
+    finally:
+        result["seconds"] = time.perf_counter() - start
+        current_fabric.reset(fabric_token)
+        if capture:
+            output = "".join(_local.buffer)
+            if _local.flushed and output:
+                output = f"\n--- {result['fabric']} (continued) ---\n" + output
+            result["output"] = output
+            _local.buffer = None
+    return result
+
+
+def print_fleet_summary(results):
+    if not results:
+        return
+    total_label = "Total (sum of fabrics)"
+    width = max(len(total_label), max(len(r["fabric"]) for r in results))
+    print(f"\n{'Fabric':<{width}}  {'Status':<8}  {'Seconds':>9}  {'Opened':>6}  {'Reused':>6}  {'Retries':>7}")
+    print(f"{'-' * width}  {'-' * 8}  {'-' * 9}  {'-' * 6}  {'-' * 6}  {'-' * 7}")
+    opened = reused = retries = 0
+    for r in results:
+        stats = connection_stats(r["fabric"])
+        fabric_retries = throttle_stats(r["fabric"])["retries"]
+        opened += stats["opened"]
+        reused += stats["reused"]
+        retries += fabric_retries
+        print(f"{r['fabric']:<{width}}  {r['status']:<8}  {r['seconds']:>9.2f}  {stats['opened']:>6}  "
+              f"{stats['reused']:>6}  {fabric_retries:>7}")
+    total = sum(r["seconds"] for r in results)
+    print(f"{total_label:<{width}}  {'':<8}  {total:>9.2f}  {opened:>6}  {reused:>6}  {retries:>7}")
+
+
+# Run process_fabric(fabric) for every fabric and return the per-fabric results
+def run_fleet(fabrics, process_fabric, max_workers=None):
+    if max_workers is None:
+        max_workers = MAX_PARALLEL_FABRICS
+    max_workers = max(1, min(max_workers, len(fabrics) or 1))
+    start = time.perf_counter()
+    results = []
+    aborted = None
+    if max_workers == 1:
+        for fabric in fabrics:
+            result = _run_one(process_fabric, fabric, capture=False)
+            results.append(result)
+            if result["status"] == "aborted":
+                aborted = result["error"]
+                break
+    else:
+        with routed_output(), ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_run_one, process_fabric, fabric, True) for fabric in fabrics]
+            # Print each fabric's output in inventory order as soon as it is finished
+            for future in futures:
+                if future.cancelled():
+                    continue
+                result = future.result()
+                _write_out(result["output"])
+                results.append(result)
+                if result["status"] == "aborted" and aborted is None:
+                    aborted = result["error"]
+                    for pending in futures:
+                        pending.cancel()
+    print_fleet_summary(results)
+    print(f"Fleet wall time: {time.perf_counter() - start:.2f}s with up to {max_workers} fabric(s) in flight")
+    if aborted is not None:
+        raise aborted
+    verify_rollouts(fabrics)
+    if QUERY_SAVINGS:
+        print_savings()
+    return results
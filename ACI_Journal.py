@@ -0,0 +1,155 @@
+##################
+# Checkpoint journal that makes fleet runs resumable
+# Flow of the code is as follows:
+# 1. When ACI_JOURNAL names a SQLite file, every fix records per fabric whether it started,
+#    completed, failed or was declined, and the DOM/MCP flows record each policy group.
+# 2. A rerun with the same journal (and ACI_JOURNAL_RUN name) skips the fabrics and fixes
+#    that completed and the groups that were already associated; only failed, declined or
+#    interrupted work is done again.
+# 3. Every update is committed at once so a crash or Ctrl-C loses nothing.
+# 4. `python ACI_Journal.py` shows the progress of a run, `--reset` starts it over.
+###################
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_PATH = os.environ.get("ACI_JOURNAL")
+# Name of the run in the journal; a new name starts a fresh sweep in the same file
+RUN_NAME = os.environ.get("ACI_JOURNAL_RUN", "default")
+# Item name used for the fix itself (as opposed to one of its policy groups)
+FIX_ITEM = ""
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+class Journal:
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run or RUN_NAME
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                run TEXT, fabric TEXT, fix TEXT, item TEXT,
+                status TEXT, error TEXT, updated REAL,
+                PRIMARY KEY (run, fabric, fix, item))
+        """)
+        self.db.commit()
+
+    def mark(self, fabric, fix, status, item=FIX_ITEM, error=None):
+        self.mark_items(fabric, fix, {item: (status, error)})
+
+    # items: {item: (status, error)}, written in one transaction
+    def mark_items(self, fabric, fix, items):
+        now = time.time()
+        rows = [(self.run, fabric, fix, item, status, None if error is None else str(error), now)
+                for item, (status, error) in items.items()]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    # Record the outcome of each group: {group: None on success or the error}
+    def mark_results(self, fabric, fix, results):
+        self.mark_items(fabric, fix, {item: ("done", None) if error is None else ("failed", error)
+                                      for item, error in results.items()})
+
+    def status(self, fabric, fix, item=FIX_ITEM):
+        with self.lock:
+            row = self.db.execute("SELECT status FROM journal WHERE run=? AND fabric=? AND fix=? AND item=?",
+                                  (self.run, fabric, fix, item)).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, fabric, fix, item=FIX_ITEM):
+        return self.status(fabric, fix, item) == "done"
+
+    def items(self, fabric, fix, status):
+        with self.lock:
+            rows = self.db.execute("SELECT item FROM journal WHERE run=? AND fabric=? AND fix=? AND status=?"
+                                   " AND item<>?", (self.run, fabric, fix, status, FIX_ITEM)).fetchall()
+        return {row[0] for row in rows}
+
+    # A fix that returned is done, unless some of its groups failed (rerun retries those)
+    def finish_fix(self, fabric, fix):
+        failed = self.items(fabric, fix, "failed")
+        status = "partial" if failed else "done"
+        self.mark(fabric, fix, status, error=f"{len(failed)} group(s) failed" if failed else None)
+        return status
+
+    def summary(self):
+        with self.lock:
+            return self.db.execute("SELECT fix, item = ?, status, COUNT(*) FROM journal WHERE run=?"
+                                   " GROUP BY fix, item = ?, status ORDER BY fix",
+                                   (FIX_ITEM, self.run, FIX_ITEM)).fetchall()
+
+    def unfinished(self):
+        with self.lock:
+            return self.db.execute("SELECT fabric, fix, item, status, error FROM journal WHERE run=?"
+                                   " AND status<>'done' ORDER BY fabric, fix, item", (self.run,)).fetchall()
+
+    def reset(self):
+        with self.lock:
+            self.db.execute("DELETE FROM journal WHERE run=?", (self.run,))
+            self.db.commit()
+
+
+# The journal of this process, or None when ACI_JOURNAL is not set
+def get_journal():
+    global _journal
+    if JOURNAL_PATH is None:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal(JOURNAL_PATH)
+        return _journal
+
+
+# Drop the groups an earlier run already associated; returns the groups still to do
+def pending_groups(APIC_URL, fix, group_names):
+    journal = get_journal()
+    if journal is None:
+        return group_names
+    done = journal.items(APIC_URL, fix, "done")
+    pending = [name for name in group_names if name not in done]
+    if len(pending) < len(group_names):
+        print(f"{len(group_names) - len(pending)} group(s) already done in an earlier run (journal). Skipping them.")
+    return pending
+
+
+# Record the outcome of each group: {group: None on success or the error}
+def record_groups(APIC_URL, fix, group_results):
+    journal = get_journal()
+    if journal is not None and group_results:
+        journal.mark_results(APIC_URL, fix, group_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or reset the progress of a resumable ACI Vetr run")
+    parser.add_argument("--journal", default=JOURNAL_PATH, help="journal file (default: $ACI_JOURNAL)")
+    parser.add_argument("--run", default=RUN_NAME, help="run name (default: $ACI_JOURNAL_RUN or 'default')")
+    parser.add_argument("--reset", action="store_true", help="forget the progress of the run")
+    args = parser.parse_args()
+    if not args.journal:
+        parser.error("no journal file given (--journal or ACI_JOURNAL)")
+    journal = Journal(args.journal, args.run)
+    if args.reset:
+        journal.reset()
+        print(f"Run '{args.run}' reset in {args.journal}.")
+        return
+    print(f"Run '{args.run}' in {args.journal}:")
+    print(f"{'Fix':<20}  {'Level':<6}  {'Status':<9}  {'Count':>7}")
+    for fix, is_fix, status, count in journal.summary():
+        print(f"{fix:<20}  {'fabric' if is_fix else 'group':<6}  {status:<9}  {count:>7}")
+    unfinished = journal.unfinished()
+    if unfinished:
+        print("\nNot done yet (retried on the next run):")
+        for fabric, fix, item, status, error in unfinished:
+            print(f"  {fabric}  {fix}{' ' + item if item else ''}  {status}{': ' + error if error else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,113 +5,68 @@
 # 2. Check if MCP Instance Policy 'default' is enabled in Global Fabric Policies.
 # 3. If not enabled, prompt user to enable it.
 # 4. Create an MCP interface policy with a specified name and enable it.
-# 5. Associate the created policy to one or more Leaf access port policy groups.
+# 5. Associate the created policy to the Leaf access port policy groups that are bound to
+#    interfaces and still miss it (usage index from one subtree query), after a per-leaf
+#    coverage report. ACI_MCP_TARGETING=all lists every group for a manual pick instead.
+#    After the fleet run MCP is verified on the interfaces of those groups (ACI_Verify.py).
 # 6. (Optional) Associate the policy group to a specific leaf switch (example for leaf 103).
 ###################
 
+import os
 
-import requests
-import urllib3
-import csv
-
-# Disable warnings for self-signed certificates
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from ACI_Auth import login
+from ACI_Desired_State import DRY_RUN, apply_diff, changes_for, converge, desired_mo, drop_planned, existing_dns, from_payload, print_diff, raise_for_results
+from ACI_Fixes import FixDeclined, register_fix
+from ACI_Fleet import confirm, has_decider, read_fabric_credentials, run_fleet, select_groups
+from ACI_Journal import pending_groups, record_groups
+from ACI_Metrics import traced_operation
+from ACI_Query import Query, exists, iter_names
+from ACI_Verify import apic_check, leaf_check, record_rollout, rollout_checks
 
 policy_name = "MCP-Interface-Policy_Vishwa"
+# "usage": offer the groups bound to interfaces that miss the policy; "all": pick from every group
+MCP_TARGETING = os.environ.get("ACI_MCP_TARGETING", "usage")
+# Classes below uni/infra that tie a port group to its interfaces and leaves
+USAGE_CLASSES = ["infraAccPortGrp", "infraRsMcpIfPol", "infraRsAccBaseGrp", "infraHPortS", "infraPortBlk",
+                 "infraNodeP", "infraLeafS", "infraNodeBlk", "infraRsAccPortP"]
 
-def read_fabric_credentials(csv_path):
-    fabrics = []
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            fabrics.append({
-                "APIC_URL": row["APIC_URL"],
-                "USERNAME": row["USERNAME"],
-                "PASSWORD": row["PASSWORD"]
-            })
-    return fabrics
-
-def login(APIC_URL, USERNAME, PASSWORD):
-    url = f"{APIC_URL}/api/aaaLogin.json"
-    payload = {
-        "aaaUser": {
-            "attributes": {
-                "name": USERNAME,
-                "pwd": PASSWORD
-            }
-        }
-    }
-    response = requests.post(url, json=payload, verify=False)
-    response.raise_for_status()
-    token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
-    return token
-
-def ensure_mcp_instance_policy_enabled(APIC_URL, token):
-    url = f"{APIC_URL}/api/mo/uni/infra/mcpInstP-default.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    data = response.json()
-    enabled = False
-    if data.get('imdata'):
-        attrs = data['imdata'][0]['mcpInstPol']['attributes']
-        if attrs.get('adminSt', '').lower() == 'enabled':
-            enabled = True
-    if not enabled:
-        print("WARNING: MCP Instance Policy 'default' is not enabled in Global Fabric Policies.")
-        choice = input("Do you want to enable MCP Instance Policy 'default'? (y/n): ")
-        if choice.strip().lower() == 'y':
-            payload = {
-                "mcpInstPol": {
-                    "attributes": {
-                        "dn": "uni/fabric/mcpInstPol-default",
-                        "name": "default",
-                        "adminSt": "enabled",
-                        "status": "modified"
-                    }
-                }
-            }
-            post_url = f"{APIC_URL}/api/mo/uni/fabric/mcpInstPol-default.json"
-            post_response = requests.post(post_url, json=payload, headers=headers, verify=False)
-            post_response.raise_for_status()
-            print("MCP Instance Policy 'default' enabled.")
-        else:
-            print("MCP Instance Policy 'default' not enabled. Exiting.")
-            exit(1)
-    else:
+MCP_INSTANCE_POLICY = desired_mo("mcpInstPol", {"dn": "uni/infra/mcpInstP-default", "name": "default", "adminSt": "enabled"})
+
+@traced_operation
+def ensure_mcp_instance_policy_enabled(APIC_URL, token, planned=None):
+    diff = changes_for(APIC_URL, token, [MCP_INSTANCE_POLICY], planned)
+    if not diff:
         print("MCP Instance Policy 'default' is already enabled.")
+        return
+    print("WARNING: MCP Instance Policy 'default' is not enabled in Global Fabric Policies.")
+    print_diff(diff)
+    if DRY_RUN:
+        print("Dry run: no change pushed.")
+        return
+    if not confirm("Do you want to enable MCP Instance Policy 'default'? (y/n): ", step="mcp_instance_policy", changes=len(diff)):
+        print("MCP Instance Policy 'default' not enabled. Skipping this fabric.")
+        raise FixDeclined("MCP Instance Policy 'default' not enabled")
+    raise_for_results(apply_diff(APIC_URL, token, diff))
+    print("MCP Instance Policy 'default' enabled.")
 
-def create_mcp_interface_policy(APIC_URL, token, policy_name):
-    url = f"{APIC_URL}/api/mo/uni/infra/mcpIfP-{policy_name}.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    payload = {
-        "mcpIfPol": {
-            "attributes": {
-                "dn": f"uni/infra/mcpIfP-{policy_name}",
-                "name": policy_name,
-                "adminSt": "enabled",
-                "descr": "MCP Interface Policy",
-                "status": "created"
-            }
-        }
-    }
-    response = requests.post(url, json=payload, headers=headers, verify=False)
-    response.raise_for_status()
-    print(f"MCP interface policy '{policy_name}' created/enabled.")
+# Create the MCP interface policy (a dry run only prints the change)
+@traced_operation
+def create_mcp_interface_policy(APIC_URL, token, policy_name, planned=None):
+    diff, results = converge(APIC_URL, token, [mcp_interface_policy(policy_name)], planned=planned)
+    raise_for_results(results)
+    if results:
+        print(f"MCP interface policy '{policy_name}' created/enabled.")
+
+# Yield the Leaf access port policy group names page by page
+def iter_leaf_access_port_policy_groups(APIC_URL, token):
+    return iter_names(APIC_URL, token, "infraAccPortGrp")
 
+@traced_operation
 def get_leaf_access_port_policy_groups(APIC_URL, token):
-    url = f"{APIC_URL}/api/class/infraAccPortGrp.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    data = response.json()
-    groups = [item['infraAccPortGrp']['attributes']['name'] for item in data.get('imdata', [])]
-    return groups
-
-def associate_mcp_policy_to_port_group(APIC_URL, token, policy_name, group_name):
-    url = f"{APIC_URL}/api/mo/uni/infra/funcprof/accportgrp-{group_name}.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    payload = {
+    return list(iter_leaf_access_port_policy_groups(APIC_URL, token))
+
+def port_group_mcp_payload(policy_name, group_name):
+    return {
         "infraAccPortGrp": {
             "attributes": {
                 "dn": f"uni/infra/funcprof/accportgrp-{group_name}",
@@ -130,67 +85,241 @@ def associate_mcp_policy_to_port_group(APIC_URL, token, policy_name, group_name)
             ]
         }
     }
-    response = requests.post(url, json=payload, headers=headers, verify=False)
-    response.raise_for_status()
-    print(f"MCP interface policy '{policy_name}' associated to Leaf access port policy group '{group_name}'.")
 
-def mcp_interface_policy_exists(APIC_URL, token, policy_name):
-    url = f"{APIC_URL}/api/mo/uni/infra/mcpIfP-{policy_name}.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    if response.status_code == 200:
-        data = response.json()
-        if data.get('imdata'):
-            return True
-    return False
+# MCP interface policy, enabled
+def mcp_interface_policy(policy_name):
+    return desired_mo("mcpIfPol", {"dn": f"uni/infra/mcpIfP-{policy_name}", "name": policy_name, "adminSt": "enabled"},
+                      write_only={"descr": "MCP Interface Policy"})
 
-def main():
-    csv_path = input("Enter path to CSV file with fabric credentials: ")
-    fabrics = read_fabric_credentials(csv_path)
-    for fabric in fabrics:
-        APIC_URL = fabric["APIC_URL"]
-        USERNAME = fabric["USERNAME"]
-        PASSWORD = fabric["PASSWORD"]
-        print(f"\n--- Processing fabric: {APIC_URL} ---")
-        try:
-            token = login(APIC_URL, USERNAME, PASSWORD)
-        except Exception as e:
-            print(f"Login failed for {APIC_URL}: {e}")
+# The policy and its relation from every group; the relations are written after the policy
+def association_desired(policy_name, group_names):
+    if not group_names:
+        return []
+    policy = mcp_interface_policy(policy_name)
+    requires = [policy["attributes"]["dn"]]
+    return [policy] + [from_payload(port_group_mcp_payload(policy_name, group_name), requires)
+                       for group_name in group_names]
+
+# Everything the MCP flow may change, for ACI_Pipeline to plan ahead from the usage index
+def planning_desired(usage):
+    return [MCP_INSTANCE_POLICY] + (association_desired(policy_name, groups_missing_mcp(usage, policy_name))
+                                    or [mcp_interface_policy(policy_name)])
+
+# Associate the MCP interface policy to many port groups.
+# Only the groups whose relation differs are pushed, in POSTs on uni/infra/funcprof that run
+# concurrently once the policy itself is in place. Returns {group name: error or None}.
+@traced_operation
+def associate_mcp_policy_to_port_groups(APIC_URL, token, policy_name, group_names, chunk_size=None, planned=None):
+    group_names = pending_groups(APIC_URL, "mcp", group_names)
+    desired = association_desired(policy_name, group_names)
+    diff, results = converge(APIC_URL, token, desired, chunk_size, planned=planned)
+    changed = {entry["dn"] for entry in diff}
+    group_results = {}
+    for group_name in group_names:
+        dn = f"uni/infra/funcprof/accportgrp-{group_name}"
+        if dn not in changed:
+            group_results[group_name] = None
+            print(f"MCP interface policy '{policy_name}' is already associated to Leaf access port policy group '{group_name}'.")
             continue
-        proceed_mcp = input("Do you want to check/enable MCP Instance Policy 'default'? (y/n): ")
-        if proceed_mcp.strip().lower() != 'y':
-            print("Skipping MCP Instance Policy step for this fabric.")
+        if dn not in results:
+            continue
+        group_results[group_name] = results[dn]
+        if results[dn] is None:
+            print(f"MCP interface policy '{policy_name}' associated to Leaf access port policy group '{group_name}'.")
+        else:
+            print(f"Failed to associate MCP interface policy '{policy_name}' to Leaf access port policy group '{group_name}': {results[dn]}")
+    record_groups(APIC_URL, "mcp", group_results)
+    record_rollout(APIC_URL, "mcp", policy_name, [name for name in group_results if group_results[name] is None
+                                                  and f"uni/infra/funcprof/accportgrp-{name}" in changed])
+    return group_results
+
+# Parent of a DN given the relative name prefix of the child (relation rns may contain '/')
+def _parent(dn, rn_prefix):
+    return dn[:dn.rindex(f"/{rn_prefix}")]
+
+# Reverse index {group name: {"mcp": MCP policy name or None, "interfaces": {(leaf, interface)}}}
+# built from one subtree query on uni/infra: port group -> port selectors -> interface profiles
+# -> switch profiles -> leaf node blocks.
+@traced_operation
+def build_port_group_usage(APIC_URL, token):
+    usage = {}
+    group_by_dn, mcp_by_group = {}, {}
+    selector_group, selector_ports = {}, {}
+    profile_nodes, node_leaves = {}, {}
+    query = Query.of_mo("uni/infra").scope("subtree", USAGE_CLASSES).props("config-only")
+    for imdata in query.pages(APIC_URL, token):
+        for item in imdata:
+            for cls, mo in item.items():
+                attrs = mo["attributes"]
+                dn = attrs["dn"]
+                if cls == "infraAccPortGrp":
+                    group_by_dn[dn] = attrs["name"]
+                elif cls == "infraRsMcpIfPol":
+                    mcp_by_group[_parent(dn, "rsmcpIfPol")] = attrs.get("tnMcpIfPolName") or "default"
+                elif cls == "infraRsAccBaseGrp":
+                    selector_group[_parent(dn, "rsaccBaseGrp")] = attrs.get("tDn")
+                elif cls == "infraPortBlk":
+                    ports = [f"eth{card}/{port}"
+                             for card in range(int(attrs["fromCard"]), int(attrs["toCard"]) + 1)
+                             for port in range(int(attrs["fromPort"]), int(attrs["toPort"]) + 1)]
+                    selector_ports.setdefault(_parent(dn, "portblk-"), []).extend(ports)
+                elif cls == "infraRsAccPortP":
+                    profile_nodes.setdefault(attrs["tDn"], []).append(_parent(dn, "rsaccPortP-"))
+                elif cls == "infraNodeBlk":
+                    node_dn = _parent(_parent(dn, "nodeblk-"), "leaves-")
+                    node_leaves.setdefault(node_dn, set()).update(range(int(attrs["from_"]), int(attrs["to_"]) + 1))
+    for group_dn, name in group_by_dn.items():
+        usage[name] = {"mcp": mcp_by_group.get(group_dn), "interfaces": set()}
+    for selector_dn, group_dn in selector_group.items():
+        name = group_by_dn.get(group_dn)
+        if name is None:
+            continue  # bundle (PC/vPC) groups are not access port groups
+        profile_dn = _parent(selector_dn, "hports-")
+        for node_dn in profile_nodes.get(profile_dn, []):
+            for leaf in node_leaves.get(node_dn, ()):
+                usage[name]["interfaces"].update((leaf, port) for port in selector_ports.get(selector_dn, []))
+    return usage
+
+# What the leaves must show after the association (ACI_Verify): MCP and the policy enabled, the
+# relations of the groups formed and MCP enabled on every interface of the groups
+@rollout_checks("mcp")
+def mcp_rollout_checks(APIC_URL, token, policy_name, group_names):
+    usage = build_port_group_usage(APIC_URL, token)
+    checks = [apic_check("mcpInstPol", MCP_INSTANCE_POLICY["attributes"]["dn"], {"adminSt": "enabled"}),
+              apic_check("mcpIfPol", f"uni/infra/mcpIfP-{policy_name}", {"adminSt": "enabled"})]
+    for name in group_names:
+        checks.append(apic_check("infraRsMcpIfPol", f"uni/infra/funcprof/accportgrp-{name}/rsmcpIfPol",
+                                 {"tnMcpIfPolName": policy_name, "state": "formed"}))
+        for leaf, interface in sorted(usage.get(name, {}).get("interfaces", ())):
+            checks.append(leaf_check("mcpIf", leaf, f"sys/mcp/inst/if-[{interface}]", {"adminSt": "enabled"}))
+    return checks, [f"/mcpIfP-{policy_name}/fault-", "/rsmcpIfPol/fault-", "/sys/mcp/inst/if-"]
+
+# Groups bound to at least one interface that are not associated to the policy
+def groups_missing_mcp(usage, policy_name):
+    return sorted(name for name, entry in usage.items() if entry["interfaces"] and entry["mcp"] != policy_name)
+
+def print_leaf_coverage(usage, policy_name):
+    leaves = {}
+    for entry in usage.values():
+        for leaf, _ in entry["interfaces"]:
+            counts = leaves.setdefault(leaf, [0, 0])
+            counts[0] += 1
+            counts[1] += entry["mcp"] == policy_name
+    in_use = sum(1 for entry in usage.values() if entry["interfaces"])
+    print(f"{in_use} of {len(usage)} Leaf access port policy group(s) are bound to interfaces.")
+    print(f"{'Leaf':>6}  {'Interfaces':>10}  {'With MCP':>8}  {'Coverage':>8}")
+    for leaf, (total, covered) in sorted(leaves.items()):
+        print(f"{leaf:>6}  {total:>10}  {covered:>8}  {100 * covered / total:>7.1f}%")
+
+# Groups to associate: the in-use groups that miss the policy, or a manual pick from all groups.
+# An empty list means there is nothing to associate; an empty pick raises FixDeclined.
+def select_port_groups(APIC_URL, token, usage=None):
+    if MCP_TARGETING == "all":
+        groups = get_leaf_access_port_policy_groups(APIC_URL, token)
+        if not groups:
+            print("No Leaf access port policy groups found in the fabric.")
+            return []
+        return _pick_port_groups(groups, "Available Leaf access port policy groups:")
+    if usage is None:
+        usage = build_port_group_usage(APIC_URL, token)
+    print_leaf_coverage(usage, policy_name)
+    candidates = groups_missing_mcp(usage, policy_name)
+    if not candidates:
+        print(f"Every Leaf access port policy group bound to an interface already uses '{policy_name}'.")
+        return []
+    # A plan picks the groups through its include/exclude rules, never all candidates at once
+    if not has_decider() and confirm(f"Associate the MCP interface policy to all {len(candidates)} in-use group(s) missing it? (y/n): ",
+               step="mcp_auto_select", changes=len(candidates)):
+        return candidates
+    return _pick_port_groups(candidates, "In-use Leaf access port policy groups missing the MCP policy:")
+
+
+def _pick_port_groups(groups, title):
+    selected = select_groups(groups, title,
+                             "Enter the numbers of the groups you want to associate with the MCP policy (comma separated): ")
+    if not selected:
+        print("No groups selected. Skipping association for this fabric.")
+        raise FixDeclined("No port groups selected")
+    return selected
+
+# The port groups flagged by ACI Vetr that still exist in the fabric
+def flagged_port_groups(APIC_URL, token, group_names):
+    dns = {f"uni/infra/funcprof/accportgrp-{name}": name for name in group_names}
+    found = existing_dns(APIC_URL, token, "infraAccPortGrp", dns)
+    missing = [name for dn, name in dns.items() if dn not in found]
+    if missing:
+        print(f"{len(missing)} flagged Leaf access port policy group(s) no longer exist: {', '.join(missing)}")
+    return [name for dn, name in dns.items() if dn in found]
+
+@traced_operation
+def mcp_interface_policy_exists(APIC_URL, token, policy_name):
+    return exists(APIC_URL, token, "mcpIfPol", f"uni/infra/mcpIfP-{policy_name}")
+
+# Full MCP flow on an already logged-in fabric.
+# ACI_Pipeline passes the usage index (discovered) and the changes of planning_desired()
+# (planned) it read ahead; otherwise they are read here.
+# ACI_Vetr_Findings passes the flagged port groups (groups); they are used instead of a selection.
+@register_fix("mcp", "Access Policy - Enable MCP and assign it to leaf access port policy groups")
+def run_mcp_fix(APIC_URL, token, discovered=None, planned=None, groups=None):
+    declined = []
+    if not confirm("Do you want to check/enable MCP Instance Policy 'default'? (y/n): ", step="mcp_instance_policy_check"):
+        print("Skipping MCP Instance Policy step for this fabric.")
+        declined.append("MCP Instance Policy check")
+    else:
+        ensure_mcp_instance_policy_enabled(APIC_URL, token, planned)
+    if not confirm("Do you want to create MCP Interface Policy? (y/n): ", step="mcp_interface_policy"):
+        print("Skipping MCP Interface Policy creation for this fabric.")
+        declined.append("MCP Interface Policy")
+    else:
+        if planned is not None:
+            policy_present = not any(entry["action"] == "create"
+                                     for entry in changes_for(APIC_URL, token, [mcp_interface_policy(policy_name)], planned))
         else:
-            ensure_mcp_instance_policy_enabled(APIC_URL, token)
-        proceed_ifpol = input("Do you want to create MCP Interface Policy? (y/n): ")
-        if proceed_ifpol.strip().lower() != 'y':
-            print("Skipping MCP Interface Policy creation for this fabric.")
+            policy_present = mcp_interface_policy_exists(APIC_URL, token, policy_name)
+        if policy_present:
+            print(f"MCP interface policy '{policy_name}' already exists. Skipping creation.")
         else:
-            if mcp_interface_policy_exists(APIC_URL, token, policy_name):
-                print(f"MCP interface policy '{policy_name}' already exists. Skipping creation.")
+            create_mcp_interface_policy(APIC_URL, token, policy_name, planned)
+            drop_planned(planned, f"uni/infra/mcpIfP-{policy_name}")
+        if confirm("Do you want to associate the new MCP Interface Policy to a Leaf access port policy group? (y/n): ",
+                   step="mcp_association"):
+            if groups is not None:
+                selected_groups = flagged_port_groups(APIC_URL, token, groups)
             else:
-                create_mcp_interface_policy(APIC_URL, token, policy_name)
-            proceed_assoc = input("Do you want to associate the new MCP Interface Policy to a Leaf access port policy group? (y/n): ")
-            if proceed_assoc.strip().lower() == 'y':
-                groups = get_leaf_access_port_policy_groups(APIC_URL, token)
-                if not groups:
-                    print("No Leaf access port policy groups found in the fabric.")
-                    continue
-                print("Available Leaf access port policy groups:")
-                for idx, name in enumerate(groups, 1):
-                    print(f"{idx}. {name}")
-                choices = input("Enter the numbers of the groups you want to associate with the MCP policy (comma separated): ")
-                try:
-                    selected_indices = [int(x.strip())-1 for x in choices.split(',')]
-                    selected_groups = [groups[i] for i in selected_indices if 0 <= i < len(groups)]
-                except (IndexError, ValueError):
-                    print("Invalid selection. Skipping association for this fabric.")
-                    continue
-                if not selected_groups:
-                    print("No valid groups selected. Skipping association for this fabric.")
-                    continue
-                for group_name in selected_groups:
-                    associate_mcp_policy_to_port_group(APIC_URL, token, policy_name, group_name)
+                selected_groups = select_port_groups(APIC_URL, token, discovered)
+            if not selected_groups:
+                print("No port groups to associate in this fabric.")
+            else:
+                group_results = associate_mcp_policy_to_port_groups(APIC_URL, token, policy_name, selected_groups,
+                                                                    planned=planned)
+                failed = [name for name, error in group_results.items() if error is not None]
+                if failed:
+                    raise RuntimeError(f"MCP interface policy '{policy_name}' not associated to Leaf access port "
+                                       f"policy group(s): {', '.join(failed)}")
+        else:
+            print("Skipping MCP association for this fabric.")
+            declined.append("MCP association")
+    # A declined step is not journaled as done, so a later run asks again
+    if declined:
+        raise FixDeclined(f"Declined: {', '.join(declined)}")
+
+def process_fabric(fabric):
+    APIC_URL = fabric["APIC_URL"]
+    USERNAME = fabric["USERNAME"]
+    PASSWORD = fabric["PASSWORD"]
+    print(f"\n--- Processing fabric: {APIC_URL} ---")
+    try:
+        token = login(APIC_URL, USERNAME, PASSWORD)
+    except Exception as e:
+        print(f"Login failed for {APIC_URL}: {e}")
+        return
+    run_mcp_fix(APIC_URL, token)
+
+def main():
+    csv_path = input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    run_fleet(fabrics, process_fabric)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+##################
+# Per-request instrumentation of the APIC calls made by the ACI Vetr fix scripts
+# Flow of the code is as follows:
+# 1. Functions that talk to the APIC are decorated with @traced_operation, which names the
+#    operation (login, check_policy_exists, ensure_port_tracking_enabled, ...) of every request.
+# 2. Each HTTP request is recorded with fabric, operation, DN or class, method, status, latency,
+#    payload sizes and retry attempt.
+# 3. Records are appended to a JSON-lines trace file (ACI_TRACE_FILE).
+# 4. At exit a Prometheus textfile (ACI_PROM_FILE) is written with latency histograms and counters
+#    per fabric and per operation.
+# Nothing is recorded unless one of the two environment variables is set.
+###################
+
+import atexit
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from ACI_Client import add_request_hook
+
+TRACE_FILE = os.environ.get("ACI_TRACE_FILE")
+PROM_FILE = os.environ.get("ACI_PROM_FILE")
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_operation = contextvars.ContextVar("aci_operation", default="other")
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_trace_handle = None
+_enabled = False
+
+
+# Name the APIC requests made inside the decorated function after it
+def traced_operation(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _operation.set(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _operation.reset(token)
+    return wrapper
+
+
+def current_operation():
+    return _operation.get()
+
+
+# DN for /api/mo calls, class for /api/class calls, the API name otherwise
+def request_target(path):
+    match = re.match(r"^/api/(mo|class)/(.+)\.json", path)
+    if match:
+        return match.group(1), match.group(2)
+    return "api", path.split("?")[0].rsplit("/", 1)[-1].replace(".json", "")
+
+
+def record_request(info):
+    kind, target = request_target(info["path"])
+    record = {
+        "ts": round(time.time(), 6),
+        "fabric": info["APIC_URL"],
+        "operation": current_operation(),
+        "method": info["method"],
+        "kind": kind,
+        "target": target,
+        "status": info["status"],
+        "latency_ms": round(info["seconds"] * 1000, 3),
+        "bytes_sent": info["bytes_sent"],
+        "bytes_received": info["bytes_received"],
+        "retry": info.get("attempt", 0),
+    }
+    with _lock:
+        if _trace_handle is not None:
+            _trace_handle.write(json.dumps(record) + "\n")
+            _trace_handle.flush()
+        key = (record["fabric"], record["operation"], record["method"])
+        histogram = _histograms.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if info["seconds"] <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += info["seconds"]
+        histogram["count"] += 1
+        counter_key = (record["fabric"], record["operation"], record["method"], str(record["status"]))
+        counter = _counters.setdefault(counter_key, {"requests": 0, "retries": 0, "bytes_sent": 0, "bytes_received": 0})
+        counter["requests"] += 1
+        counter["retries"] += 1 if record["retry"] else 0
+        counter["bytes_sent"] += record["bytes_sent"]
+        counter["bytes_received"] += record["bytes_received"]
+    return record
+
+
+def _labels(**labels):
+    escaped = {k: str(v).replace("\\", "\\\\").replace('"', '\\"') for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+
+def prometheus_text():
+    lines = [
+        "# HELP aci_apic_request_duration_seconds APIC request latency per fabric and operation.",
+        "# TYPE aci_apic_request_duration_seconds histogram",
+    ]
+    with _lock:
+        for (fabric, operation, method), histogram in sorted(_histograms.items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append("aci_apic_request_duration_seconds_bucket"
+                             f"{_labels(fabric=fabric, operation=operation, method=method, le=bound)} {count}")
+            lines.append("aci_apic_request_duration_seconds_bucket"
+                         f"{_labels(fabric=fabric, operation=operation, method=method, le='+Inf')} {histogram['count']}")
+            lines.append("aci_apic_request_duration_seconds_sum"
+                         f"{_labels(fabric=fabric, operation=operation, method=method)} {histogram['sum']:.6f}")
+            lines.append("aci_apic_request_duration_seconds_count"
+                         f"{_labels(fabric=fabric, operation=operation, method=method)} {histogram['count']}")
+        for name, field, help_text in (
+            ("aci_apic_requests_total", "requests", "APIC requests per fabric, operation and status."),
+            ("aci_apic_request_retries_total", "retries", "APIC requests that were retries."),
+            ("aci_apic_request_sent_bytes_total", "bytes_sent", "Request payload bytes sent to the APIC."),
+            ("aci_apic_response_bytes_total", "bytes_received", "Response bytes received from the APIC."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (fabric, operation, method, status), counter in sorted(_counters.items()):
+                lines.append(f"{name}{_labels(fabric=fabric, operation=operation, method=method, status=status)} "
+                             f"{counter[field]}")
+    return "\n".join(lines) + "\n"
+
+
+# Write the Prometheus textfile atomically so a node_exporter never reads half a file
+def write_prometheus_file(path=None):
+    path = path or PROM_FILE
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as prom_file:
+        prom_file.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def enable(trace_file=None, prom_file=None):
+    global _trace_handle, _enabled, TRACE_FILE, PROM_FILE
+    TRACE_FILE = trace_file or TRACE_FILE
+    PROM_FILE = prom_file or PROM_FILE
+    if TRACE_FILE and _trace_handle is None:
+        _trace_handle = open(TRACE_FILE, "a")
+    if not _enabled:
+        add_request_hook(record_request)
+        atexit.register(write_prometheus_file)
+        _enabled = True
+
+
+if TRACE_FILE or PROM_FILE:
+    enable()
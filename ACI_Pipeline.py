@@ -0,0 +1,238 @@
+##################
+# Pipelined run of the ACI Vetr fixes over the fleet
+# Flow of the code is as follows:
+# 1. Credentials are loaded from the CSV file and each fabric goes through the stages
+#    authenticate -> discover -> plan -> apply -> verify, connected by bounded queues.
+# 2. The read-only stages (login, group listings and usage index, reading the current objects)
+#    run in their own threads up to ACI_PIPELINE_DEPTH fabrics ahead of the apply stage.
+# 3. The apply stage runs in the main thread, one fabric after the other in CSV order, so the
+#    questions and the writes happen exactly as in ACI_Vetr_Runner; it uses the plan read ahead.
+# 4. The verify stage reads the planned objects again after the writes and reports how many
+#    changes are still pending (declined, not selected or failed); at the end the leaves are
+#    checked for the DOM/MCP changes on all fabrics at once (ACI_Verify.py).
+###################
+
+import os
+import queue
+import threading
+import time
+
+from ACI_Auth import login
+from ACI_DOM import association_desired, get_all_group_names, policy_name as dom_policy_name
+from ACI_Desired_State import plan_ahead, plan_changes
+from ACI_Disable_EP_learning import REMOTE_EP_LEARNING
+from ACI_Fixes import fixes_status
+from ACI_Fleet import capture_output, current_fabric, print_fleet_summary, read_fabric_credentials, routed_output
+from ACI_Journal import get_journal
+from ACI_MCP import build_port_group_usage, planning_desired
+from ACI_Query import QUERY_SAVINGS, print_savings
+from ACI_Verify import verify_rollouts
+from ACI_Port_Tracking import PORT_TRACKING
+from ACI_Rogue_EP_Control import ROGUE_EP_CONTROL
+from ACI_Vetr_Runner import choose_fixes, run_fix
+
+# Fabrics a read-only stage may run ahead of the apply stage
+PIPELINE_DEPTH = int(os.environ.get("ACI_PIPELINE_DEPTH", "2"))
+
+# How each fix is read ahead: discover(APIC_URL, token) -> discovered, plan(discovered) -> desired objects
+PIPELINE_FIXES = {
+    "rogue_ep_control": {"plan": lambda discovered: [ROGUE_EP_CONTROL]},
+    "port_tracking": {"plan": lambda discovered: [PORT_TRACKING]},
+    "remote_ep_learning": {"plan": lambda discovered: [REMOTE_EP_LEARNING]},
+    "mcp": {"discover": build_port_group_usage, "plan": planning_desired},
+    "dom": {"discover": get_all_group_names, "plan": lambda groups: association_desired(dom_policy_name, groups)},
+}
+
+STAGES = ("authenticate", "discover", "plan", "apply", "verify")
+
+
+def _new_job(index, fabric, fixes):
+    return {"index": index, "fabric": fabric, "APIC_URL": fabric["APIC_URL"], "fixes": fixes, "token": None,
+            "discovered": {}, "desired": {}, "planned": {}, "pending": {}, "status": "ok", "error": None,
+            "outcomes": {}, "output": [], "verify_output": [], "seconds": 0.0}
+
+
+def authenticate(job):
+    journal = get_journal()
+    if journal is not None and all(journal.is_done(job["APIC_URL"], name) for name in job["fixes"]):
+        print(f"All selected fixes already completed on {job['APIC_URL']} (journal). Skipping.")
+        job["status"] = "skipped"
+        return
+    fabric = job["fabric"]
+    job["token"] = login(fabric["APIC_URL"], fabric["USERNAME"], fabric["PASSWORD"])
+
+
+def discover(job):
+    for name in job["fixes"]:
+        spec = PIPELINE_FIXES.get(name, {})
+        if "discover" in spec:
+            job["discovered"][name] = spec["discover"](job["APIC_URL"], job["token"])
+
+
+def plan(job):
+    for name in job["fixes"]:
+        spec = PIPELINE_FIXES.get(name)
+        if spec is None:
+            continue
+        desired = spec["plan"](job["discovered"].get(name))
+        job["desired"][name] = desired
+        job["planned"][name] = plan_ahead(job["APIC_URL"], job["token"], desired)
+
+
+# Same as ACI_Vetr_Runner.run_fixes, with the discovery and plan read ahead
+def apply(job):
+    for name in job["fixes"]:
+        kwargs = {}
+        if name in job["planned"]:
+            kwargs["planned"] = job["planned"][name]
+        if name in job["discovered"]:
+            kwargs["discovered"] = job["discovered"][name]
+        job["outcomes"][name] = run_fix(job["APIC_URL"], job["token"], name, kwargs)
+
+
+def verify(job):
+    for name, desired in job["desired"].items():
+        planned = len(job["planned"][name]["diff"])
+        if not planned:
+            continue
+        pending = len(plan_changes(job["APIC_URL"], job["token"], desired))
+        job["pending"][name] = pending
+        print(f"Verify {job['APIC_URL']} {name}: {planned - pending} of {planned} planned change(s) in place"
+              + (f", {pending} still pending" if pending else "") + ".")
+
+
+STAGE_FUNCS = {"authenticate": authenticate, "discover": discover, "plan": plan, "apply": apply, "verify": verify}
+
+
+class Pipeline:
+    def __init__(self, fabrics, fixes, depth=None):
+        self.fabrics = fabrics
+        self.fixes = fixes
+        self.depth = max(1, depth or PIPELINE_DEPTH)
+        self.stop = threading.Event()
+        self.busy = {stage: 0.0 for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def _put(self, out_queue, item):
+        while not self.stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, in_queue):
+        while not self.stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    # Run one stage on a job; its output goes to the job's buffer when capture is set
+    def _run_stage(self, stage, job, capture=None):
+        if job["status"] != "ok":
+            return
+        fabric_token = current_fabric.set(job["APIC_URL"])
+        start = time.perf_counter()
+        try:
+            if capture is None:
+                STAGE_FUNCS[stage](job)
+            else:
+                with capture_output(capture, job["APIC_URL"]):
+                    STAGE_FUNCS[stage](job)
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = e
+            message = f"{stage} failed for {job['APIC_URL']}: {e}\n"
+            if capture is None:
+                print(message, end="")
+            else:
+                capture.append(message)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_fabric.reset(fabric_token)
+            job["seconds"] += elapsed
+            with self.lock:
+                self.busy[stage] += elapsed
+
+    def _worker(self, stage, in_queue, out_queue, output_key="output"):
+        while True:
+            job = self._get(in_queue)
+            if job is None:
+                self._put(out_queue, None)
+                return
+            self._run_stage(stage, job, job[output_key])
+            self._put(out_queue, job)
+
+    def _load(self, out_queue):
+        for index, fabric in enumerate(self.fabrics):
+            if self.stop.is_set():
+                return
+            self._put(out_queue, _new_job(index, fabric, self.fixes))
+        self._put(out_queue, None)
+
+    def run(self):
+        start = time.perf_counter()
+        queues = {stage: queue.Queue(maxsize=self.depth) for stage in STAGES}
+        threads = [threading.Thread(target=self._load, args=(queues["authenticate"],), daemon=True)]
+        for stage, next_stage in (("authenticate", "discover"), ("discover", "plan"), ("plan", "apply")):
+            threads.append(threading.Thread(target=self._worker, args=(stage, queues[stage], queues[next_stage]),
+                                            daemon=True))
+        done = queue.Queue()
+        threads.append(threading.Thread(target=self._worker, args=("verify", queues["verify"], done, "verify_output"),
+                                        daemon=True))
+        jobs = []
+        with routed_output():
+            for thread in threads:
+                thread.start()
+            try:
+                while True:
+                    job = self._get(queues["apply"])
+                    if job is None:
+                        break
+                    print(f"\n--- Processing fabric: {job['APIC_URL']} ---")
+                    print("".join(job["output"]), end="")
+                    self._run_stage("apply", job)
+                    jobs.append(job)
+                    self._put(queues["verify"], job)
+                self._put(queues["verify"], None)
+                while done.get() is not None:
+                    pass
+            finally:
+                self.stop.set()
+                for thread in threads:
+                    thread.join()
+        for job in jobs:
+            print("".join(job["verify_output"]), end="")
+        # A fabric whose stages all ran takes the status of its fixes (failed, declined or ok)
+        results = [{"fabric": job["APIC_URL"],
+                    "status": fixes_status(job["outcomes"]) if job["status"] == "ok" else job["status"],
+                    "error": job["error"], "outcomes": job["outcomes"], "seconds": job["seconds"]} for job in jobs]
+        print_fleet_summary(results)
+        wall = time.perf_counter() - start
+        print("Stage busy time: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.busy.items()))
+        print(f"Pipeline wall time: {wall:.2f}s (sum of stages {sum(self.busy.values()):.2f}s)")
+        verify_rollouts(self.fabrics)
+        if QUERY_SAVINGS:
+            print_savings()
+        return jobs
+
+
+def run_pipeline(fabrics, fixes, depth=None):
+    return Pipeline(fabrics, fixes, depth).run()
+
+
+def main():
+    csv_path = input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    selected_fixes = choose_fixes()
+    if not selected_fixes:
+        print("No valid fixes selected. Exiting.")
+        return
+    print(f"Selected fixes: {', '.join(selected_fixes)}")
+    run_pipeline(fabrics, selected_fixes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+##################
+# Unattended plan/apply run of the ACI Vetr fixes driven by a YAML or JSON plan file
+# Flow of the code is as follows:
+# 1. Read the plan: fabrics (CSV file or inline list), fixes, group selectors and approval rules.
+# 2. Answer every y/n question of the fixes with the first matching approval rule.
+# 3. Select the policy groups (infraAccPortGrp / fabricLeNodePGrp names) with the globs or
+#    regexes ("re:" prefix) of the fix instead of asking for numbers.
+# 4. Run the fixes on all fabrics in parallel, a declined change only skips that fix.
+# 5. Exit with status 1 when a fix failed on any fabric (login or APIC error), so a scheduler
+#    notices; declined changes do not change the exit status.
+#
+# Example plan (YAML needs PyYAML, JSON works without it):
+#   fabrics:
+#     csv: fabrics.csv
+#     include: ["https://apic-lab*"]
+#   parallel: 8
+#   fixes:
+#     - port_tracking
+#     - name: mcp
+#       groups: {include: ["leaf-*", "re:^vpc-"], exclude: ["*-test"]}
+#   approvals:
+#     default: deny
+#     rules:
+#       - {fix: "*", fabric: "https://apic-lab*", approve: true, max_changes: 200}
+###################
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sys
+
+from ACI_Fixes import FIXES, current_fix
+from ACI_Fleet import current_fabric, read_fabric_credentials, run_fleet, set_decider
+from ACI_Vetr_Runner import run_fixes
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# Glob by default, regular expression (re.search) with a "re:" prefix
+def name_matches(name, pattern):
+    if pattern.startswith("re:"):
+        return re.search(pattern[3:], name) is not None
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+def select_names(names, selector):
+    include = selector.get("include", ["*"])
+    exclude = selector.get("exclude", [])
+    return [name for name in names
+            if any(name_matches(name, p) for p in include) and not any(name_matches(name, p) for p in exclude)]
+
+
+def load_plan(path):
+    with open(path) as plan_file:
+        text = plan_file.read()
+    if path.endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise ValueError("PyYAML is needed for YAML plans (pip install pyyaml), or write the plan as JSON")
+        try:
+            plan = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(str(e))
+    else:
+        plan = json.loads(text)
+    return validate_plan(plan or {}, os.path.dirname(os.path.abspath(path)))
+
+
+# Normalise the plan and reject unknown fixes or malformed entries before anything is changed
+def validate_plan(plan, base_dir="."):
+    fabrics = plan.get("fabrics")
+    if isinstance(fabrics, str):
+        fabrics = {"csv": fabrics}
+    if not isinstance(fabrics, dict) or not ("csv" in fabrics or "list" in fabrics):
+        raise ValueError("'fabrics' must give a 'csv' file or a 'list' of fabrics")
+    fixes = []
+    for entry in plan.get("fixes") or []:
+        if isinstance(entry, str):
+            entry = {"name": entry}
+        if entry.get("name") not in FIXES:
+            raise ValueError(f"Unknown fix {entry.get('name')!r}, known fixes: {', '.join(FIXES)}")
+        fixes.append(entry)
+    if not fixes:
+        raise ValueError("The plan does not list any fix")
+    approvals = plan.get("approvals") or {}
+    if approvals.get("default", "deny") not in ("approve", "deny"):
+        raise ValueError("'approvals.default' must be 'approve' or 'deny'")
+    return {
+        "fabrics": fabrics,
+        "fixes": fixes,
+        "parallel": int(plan.get("parallel", 1)),
+        "approvals": {"default": approvals.get("default", "deny"), "rules": approvals.get("rules") or []},
+        "base_dir": base_dir,
+    }
+
+
+def plan_fabrics(plan):
+    spec = plan["fabrics"]
+    if "csv" in spec:
+        fabrics = read_fabric_credentials(os.path.join(plan["base_dir"], spec["csv"]))
+    else:
+        fabrics = []
+        for item in spec["list"]:
+            password = item.get("PASSWORD")
+            if password is None and item.get("PASSWORD_ENV"):
+                password = os.environ.get(item["PASSWORD_ENV"])
+            if password is None:
+                raise ValueError(f"No PASSWORD or PASSWORD_ENV for {item.get('APIC_URL')}")
+            fabrics.append({"APIC_URL": item["APIC_URL"], "USERNAME": item["USERNAME"], "PASSWORD": password})
+    urls = set(select_names([f["APIC_URL"] for f in fabrics], spec))
+    return [fabric for fabric in fabrics if fabric["APIC_URL"] in urls]
+
+
+# Answers the questions of the fixes from the plan (installed with ACI_Fleet.set_decider)
+class PlanDecider:
+    def __init__(self, plan):
+        self.plan = plan
+        self.fixes = {entry["name"]: entry for entry in plan["fixes"]}
+
+    def _rule_for(self, fix, fabric, step):
+        for rule in self.plan["approvals"]["rules"]:
+            if (name_matches(fix or "", rule.get("fix", "*"))
+                    and name_matches(fabric or "", rule.get("fabric", "*"))
+                    and name_matches(step or "", rule.get("step", "*"))):
+                return rule
+        return None
+
+    def confirm(self, step, question, changes=None):
+        fix, fabric = current_fix.get(), current_fabric.get()
+        rule = self._rule_for(fix, fabric, step)
+        if rule is None:
+            approved, reason = self.plan["approvals"]["default"] == "approve", "default"
+        else:
+            approved, reason = bool(rule.get("approve", False)), "rule"
+            max_changes = rule.get("max_changes")
+            if approved and max_changes is not None and changes is not None and changes > max_changes:
+                approved, reason = False, f"{changes} changes over max_changes {max_changes}"
+        print(f"{question}{'y' if approved else 'n'}  (plan: {'approved' if approved else 'denied'}, {reason})")
+        return approved
+
+    def select(self, groups):
+        fix = current_fix.get()
+        selector = self.fixes.get(fix, {}).get("groups")
+        if selector is None:
+            print(f"Plan: no group selector for fix '{fix}', no group selected.")
+            return []
+        selected = select_names(groups, selector)
+        print(f"Plan: {len(selected)} of {len(groups)} group(s) selected for fix '{fix}'.")
+        return selected
+
+
+def run_plan(plan):
+    fabrics = plan_fabrics(plan)
+    fix_names = [entry["name"] for entry in plan["fixes"]]
+    print(f"Plan: {len(fabrics)} fabric(s), fixes: {', '.join(fix_names)}")
+    set_decider(PlanDecider(plan))
+    try:
+        return run_fleet(fabrics, lambda fabric: run_fixes(fabric, fix_names), plan["parallel"])
+    finally:
+        set_decider(None)
+
+
+# Fabrics where a fix failed, from the outcome of every fix
+def failed_fabrics(results):
+    return [r["fabric"] for r in results if r["status"] == "failed" or "failed" in r["outcomes"].values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ACI Vetr fixes unattended from a plan file")
+    parser.add_argument("plan", help="YAML or JSON plan file")
+    args = parser.parse_args()
+    try:
+        plan = load_plan(args.plan)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Invalid plan {args.plan}: {e}")
+    failed = failed_fabrics(run_plan(plan))
+    if failed:
+        print(f"Fixes failed on {len(failed)} fabric(s): {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
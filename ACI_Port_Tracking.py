@@ -5,87 +5,48 @@
 #2. If not enabled, prompt the user to enable it
 ##############
 
-import requests
-import urllib3
-import csv
+from ACI_Auth import login
+from ACI_Desired_State import DRY_RUN, apply_diff, changes_for, desired_mo, print_diff, raise_for_results
+from ACI_Fixes import FixDeclined, register_fix
+from ACI_Fleet import confirm, read_fabric_credentials, run_fleet
+from ACI_Metrics import traced_operation
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+PORT_TRACKING = desired_mo("infraPortTrackPol", {"dn": "uni/infra/trackEqptFabP-default", "adminSt": "on"})
 
-def read_fabric_credentials(csv_path):
-    fabrics = []
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            fabrics.append({
-                "APIC_URL": row["APIC_URL"],
-                "USERNAME": row["USERNAME"],
-                "PASSWORD": row["PASSWORD"]
-            })
-    return fabrics
-
-def login(APIC_URL, USERNAME, PASSWORD):
-    url = f"{APIC_URL}/api/aaaLogin.json"
-    payload = {
-        "aaaUser": {
-            "attributes": {
-                "name": USERNAME,
-                "pwd": PASSWORD
-            }
-        }
-    }
-    response = requests.post(url, json=payload, verify=False)
-    response.raise_for_status()
-    token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
-    return token
-
-def ensure_port_tracking_enabled(APIC_URL, token):
-    url = f"{APIC_URL}/api/mo/uni/infra/trackEqptFabP-default.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    data = response.json()
-    enabled = False
-    if data.get('imdata'):
-        attrs = data['imdata'][0]['infraPortTrackPol']['attributes']
-        if attrs.get('portTracking', '').lower() == 'enabled':
-            enabled = True
-    if not enabled:
-        print("Port Tracking is not enabled.")
-        choice = input("Do you want to enable Port Tracking? (y/n): ")
-        if choice.strip().lower() == 'y':
-            payload = {
-                "infraPortTrackPol": {
-                    "attributes": {
-                        "dn": "uni/infra/trackEqptFabP-default",
-                        "adminSt": "on",
-                        "status": "modified"
-                    }
-                }
-            }
-            post_url = f"{APIC_URL}/api/mo/uni/infra/trackEqptFabP-default.json"
-            post_response = requests.post(post_url, json=payload, headers=headers, verify=False)
-            post_response.raise_for_status()
-            print("Port Tracking enabled.")
-        else:
-            print("Port Tracking not enabled. Exiting.")
-            exit(1)
-    else:
+@register_fix("port_tracking", "Global - Enable Port Tracking")
+@traced_operation
+def ensure_port_tracking_enabled(APIC_URL, token, planned=None):
+    diff = changes_for(APIC_URL, token, [PORT_TRACKING], planned)
+    if not diff:
         print("Port Tracking is already enabled.")
+        return
+    print("Port Tracking is not enabled.")
+    print_diff(diff)
+    if DRY_RUN:
+        print("Dry run: no change pushed.")
+        return
+    if not confirm("Do you want to enable Port Tracking? (y/n): ", step="port_tracking", changes=len(diff)):
+        print("Port Tracking not enabled. Skipping this fabric.")
+        raise FixDeclined("Port Tracking not enabled")
+    raise_for_results(apply_diff(APIC_URL, token, diff))
+    print("Port Tracking enabled.")
+
+def process_fabric(fabric):
+    APIC_URL = fabric["APIC_URL"]
+    USERNAME = fabric["USERNAME"]
+    PASSWORD = fabric["PASSWORD"]
+    print(f"\n--- Processing fabric: {APIC_URL} ---")
+    try:
+        token = login(APIC_URL, USERNAME, PASSWORD)
+    except Exception as e:
+        print(f"Login failed for {APIC_URL}: {e}")
+        return
+    ensure_port_tracking_enabled(APIC_URL, token)
 
 def main():
     csv_path = input("Enter path to CSV file with fabric credentials: ")
     fabrics = read_fabric_credentials(csv_path)
-    for fabric in fabrics:
-        APIC_URL = fabric["APIC_URL"]
-        USERNAME = fabric["USERNAME"]
-        PASSWORD = fabric["PASSWORD"]
-        print(f"\n--- Processing fabric: {APIC_URL} ---")
-        try:
-            token = login(APIC_URL, USERNAME, PASSWORD)
-        except Exception as e:
-            print(f"Login failed for {APIC_URL}: {e}")
-            continue
-        ensure_port_tracking_enabled(APIC_URL, token)
+    run_fleet(fabrics, process_fabric)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,203 @@
+##################
+# Query builder for the APIC reads of the ACI Vetr scripts
+# Flow of the code is as follows:
+# 1. A Query names its target (/api/mo/<dn> or /api/class/<class>) and asks only for what the
+#    caller uses: the scope (query-target, target-subtree-class), a server-side filter
+#    (query-target-filter built with eq/ne/ge/wcard/and_/or_/dn_in), the properties
+#    (rsp-prop-include naming-only or config-only), the child classes that are compared
+#    (rsp-subtree, rsp-subtree-class) and count-only answers for existence checks.
+# 2. get() sends it once, pages() reads it page by page through ACI_Client (streamed).
+# 3. With ACI_QUERY_SAVINGS=1 every query is also sent without its projection (all properties,
+#    all child classes, whole objects instead of a count) and the bytes saved are printed per
+#    query at the end of the fleet run. This sends the reads twice, so it is for measuring only.
+###################
+
+import os
+import re
+import threading
+
+from ACI_Client import PAGE_SIZE, apic_get, iter_class_attributes, iter_class_pages, iter_subtree_pages
+from ACI_Metrics import current_operation
+
+QUERY_SAVINGS = os.environ.get("ACI_QUERY_SAVINGS", "0") == "1"
+# Parameters that only trim the answer; the baseline of the savings report leaves them out
+PROJECTION_PARAMS = ("rsp-prop-include", "rsp-subtree-class", "rsp-subtree-include")
+
+_savings = {}
+_savings_lock = threading.Lock()
+
+
+def eq(cls, prop, value):
+    return f'eq({cls}.{prop},"{value}")'
+
+
+def ne(cls, prop, value):
+    return f'ne({cls}.{prop},"{value}")'
+
+
+def ge(cls, prop, value):
+    return f'ge({cls}.{prop},"{value}")'
+
+
+def wcard(cls, prop, pattern):
+    return f'wcard({cls}.{prop},"{pattern}")'
+
+
+def and_(*exprs):
+    exprs = [expr for expr in exprs if expr]
+    return exprs[0] if len(exprs) == 1 else f"and({','.join(exprs)})"
+
+
+def or_(*exprs):
+    exprs = [expr for expr in exprs if expr]
+    return exprs[0] if len(exprs) == 1 else f"or({','.join(exprs)})"
+
+
+# Objects of the class with one of the DNs
+def dn_in(cls, dns):
+    return or_(*(eq(cls, "dn", dn) for dn in dns))
+
+
+class Query:
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target_name = target
+        self.path = f"/api/{kind}/{target}.json"
+        self._params = {}
+
+    @classmethod
+    def of_class(cls, class_name):
+        return cls("class", class_name)
+
+    @classmethod
+    def of_mo(cls, dn):
+        return cls("mo", dn)
+
+    # query-target (self, children, subtree) and the classes to return from it
+    def scope(self, target, classes=()):
+        self._params["query-target"] = target
+        if classes:
+            self._params["target-subtree-class"] = ",".join(classes)
+        return self
+
+    # Server-side filter; several calls are and-ed
+    def where(self, expr):
+        current = self._params.get("query-target-filter")
+        self._params["query-target-filter"] = and_(current, expr) if current else expr
+        return self
+
+    def props(self, include):
+        self._params["rsp-prop-include"] = include
+        return self
+
+    # Return the children (or the full subtree) of the objects, only of the given classes
+    def subtree(self, mode="children", classes=()):
+        self._params["rsp-subtree"] = mode
+        if classes:
+            self._params["rsp-subtree-class"] = ",".join(classes)
+        return self
+
+    # Only the number of matching objects (moCount)
+    def count(self):
+        self._params["rsp-subtree-include"] = "count"
+        return self
+
+    def param(self, key, value):
+        self._params[key] = value
+        return self
+
+    def params(self):
+        return dict(self._params)
+
+    # The same query without its projection; never a subscription, so measuring opens none
+    def baseline_params(self):
+        return {key: value for key, value in self._params.items()
+                if key not in PROJECTION_PARAMS and key != "subscription"}
+
+    # Name of the query in the savings report: the operation and the class or DN shape
+    def label(self):
+        target = self.target_name if self.kind == "class" else re.sub(r"-[^/]*", "", self.target_name)
+        return f"{current_operation()} {target}"
+
+    def get(self, APIC_URL, token):
+        response = apic_get(APIC_URL, token, self.path, self.params())
+        if QUERY_SAVINGS and response.ok:
+            baseline = apic_get(APIC_URL, token, self.path, self.baseline_params())
+            if baseline.ok:
+                record_savings(self.label(), len(response.content), len(baseline.content))
+        return response
+
+    # Pages of a class query ({field: value} dicts when fields are given, else objects), or of a
+    # subtree query on a DN (imdata items)
+    def pages(self, APIC_URL, token, fields=None, page_size=None):
+        page_size = page_size or PAGE_SIZE
+        if QUERY_SAVINGS:
+            self._measure_page(APIC_URL, token, page_size)
+        if self.kind == "mo":
+            classes = self._params["target-subtree-class"].split(",") if "target-subtree-class" in self._params else []
+            return iter_subtree_pages(APIC_URL, token, self.target_name, classes, self.params(), page_size)
+        if fields is not None:
+            return iter_class_attributes(APIC_URL, token, self.target_name, fields, self.params(), page_size)
+        return iter_class_pages(APIC_URL, token, self.target_name, self.params(), page_size)
+
+    # Savings of a paged query, measured on its first page
+    def _measure_page(self, APIC_URL, token, page_size):
+        paging = {"page": "0", "page-size": str(page_size)}
+        if self.kind == "class":
+            paging["order-by"] = f"{self.target_name}.dn|asc"
+        response = apic_get(APIC_URL, token, self.path, dict(paging, **self.params()))
+        baseline = apic_get(APIC_URL, token, self.path, dict(paging, **self.baseline_params()))
+        if response.ok and baseline.ok:
+            record_savings(self.label() + " (page 1)", len(response.content), len(baseline.content))
+
+
+# Whether an object exists, from a count-only query
+def exists(APIC_URL, token, cls, dn):
+    return count(APIC_URL, token, cls, eq(cls, "dn", dn)) > 0
+
+
+# Number of objects of the class matching the filter
+def count(APIC_URL, token, cls, expr=None):
+    query = Query.of_class(cls).count()
+    if expr:
+        query.where(expr)
+    response = query.get(APIC_URL, token)
+    response.raise_for_status()
+    imdata = response.json().get('imdata', [])
+    return int(imdata[0]["moCount"]["attributes"]["count"]) if imdata else 0
+
+
+# Names of the objects of a class as the pages arrive (names only are read)
+def iter_names(APIC_URL, token, cls, page_size=None):
+    for page in Query.of_class(cls).props("naming-only").pages(APIC_URL, token, ("name",), page_size):
+        for attributes in page:
+            yield attributes["name"]
+
+
+def record_savings(label, received, baseline):
+    with _savings_lock:
+        entry = _savings.setdefault(label, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += received
+        entry[2] += baseline
+
+
+def print_savings():
+    with _savings_lock:
+        rows = sorted(_savings.items(), key=lambda item: item[1][1] - item[1][2])
+        _savings.clear()
+    if not rows:
+        return
+    width = max(len("Query"), max(len(label) for label, _ in rows))
+    print(f"\n{'Query':<{width}}  {'Reads':>6}  {'Bytes':>11}  {'Unprojected':>11}  {'Saved':>11}  {'Saved %':>7}")
+    print(f"{'-' * width}  {'-' * 6}  {'-' * 11}  {'-' * 11}  {'-' * 11}  {'-' * 7}")
+    total_received = total_baseline = 0
+    for label, (reads, received, baseline) in rows:
+        total_received += received
+        total_baseline += baseline
+        saved = baseline - received
+        print(f"{label:<{width}}  {reads:>6}  {received:>11}  {baseline:>11}  {saved:>11}  "
+              f"{100 * saved / baseline if baseline else 0:>6.1f}%")
+    saved = total_baseline - total_received
+    print(f"{'Total':<{width}}  {'':>6}  {total_received:>11}  {total_baseline:>11}  {saved:>11}  "
+          f"{100 * saved / total_baseline if total_baseline else 0:>6.1f}%")
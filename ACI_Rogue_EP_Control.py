@@ -8,90 +8,52 @@
 # 5. Enables Rogue Endpoint Control if the user agrees.
 ###########################
 
-import requests
-import urllib3
-import csv
+from ACI_Auth import login
+from ACI_Desired_State import DRY_RUN, apply_diff, changes_for, desired_mo, print_diff, raise_for_results
+from ACI_Fixes import FixDeclined, register_fix
+from ACI_Fleet import confirm, read_fabric_credentials, run_fleet
+from ACI_Metrics import traced_operation
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+ROGUE_EP_CONTROL = desired_mo(
+    "epControlP",
+    {"dn": "uni/infra/epCtrlP-default", "adminSt": "enabled"},
+    write_only={"holdIntvl": "1800", "rogueEpDetectIntvl": "60", "rogueEpDetectMult": "4"}
+)
 
-def read_fabric_credentials(csv_path):
-    fabrics = []
-    with open(csv_path, newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            fabrics.append({
-                "APIC_URL": row["APIC_URL"],
-                "USERNAME": row["USERNAME"],
-                "PASSWORD": row["PASSWORD"]
-            })
-    return fabrics
-
-def login(APIC_URL, USERNAME, PASSWORD):
-    url = f"{APIC_URL}/api/aaaLogin.json"
-    payload = {
-        "aaaUser": {
-            "attributes": {
-                "name": USERNAME,
-                "pwd": PASSWORD
-            }
-        }
-    }
-    response = requests.post(url, json=payload, verify=False)
-    response.raise_for_status()
-    token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
-    return token
-
-def ensure_rogue_ep_control_enabled(APIC_URL, token):
-    url = f"{APIC_URL}/api/mo/uni/infra/epCtrlP-default.json"
-    headers = {"Cookie": f"APIC-cookie={token}"}
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    data = response.json()
-    enabled = False
-    if data.get('imdata'):
-        attrs = data['imdata'][0]['epControlP']['attributes']
-        if attrs.get('adminSt', '').lower() == 'enabled':
-            enabled = True
-    if not enabled:
-        print("Rogue EP Control is not enabled.")
-        choice = input("Do you want to enable Rogue EP Control? (y/n): ")
-        if choice.strip().lower() == 'y':
-            payload = {
-                "epControlP": {
-                    "attributes": {
-                        "dn": "uni/infra/epCtrlP-default",
-                        "adminSt": "enabled",
-                        "status": "modified",
-                        "holdIntvl": "1800",
-                        "rogueEpDetectIntvl": "60",
-                        "rogueEpDetectMult": "4"
-                    }
-                }
-            }
-            post_url = f"{APIC_URL}/api/mo/uni/infra/epCtrlP-default.json"
-            post_response = requests.post(post_url, json=payload, headers=headers, verify=False)
-            post_response.raise_for_status()
-            print("Rogue EP Control enabled.")
-        else:
-            print("Rogue EP Control not enabled. Exiting.")
-            exit(1)
-    else:
+@register_fix("rogue_ep_control", "Global - Enable Rogue Endpoint Control")
+@traced_operation
+def ensure_rogue_ep_control_enabled(APIC_URL, token, planned=None):
+    diff = changes_for(APIC_URL, token, [ROGUE_EP_CONTROL], planned)
+    if not diff:
         print("Rogue EP Control is already enabled.")
+        return
+    print("Rogue EP Control is not enabled.")
+    print_diff(diff)
+    if DRY_RUN:
+        print("Dry run: no change pushed.")
+        return
+    if not confirm("Do you want to enable Rogue EP Control? (y/n): ", step="rogue_ep_control", changes=len(diff)):
+        print("Rogue EP Control not enabled. Skipping this fabric.")
+        raise FixDeclined("Rogue EP Control not enabled")
+    raise_for_results(apply_diff(APIC_URL, token, diff))
+    print("Rogue EP Control enabled.")
+
+def process_fabric(fabric):
+    APIC_URL = fabric["APIC_URL"]
+    USERNAME = fabric["USERNAME"]
+    PASSWORD = fabric["PASSWORD"]
+    print(f"\n--- Processing fabric: {APIC_URL} ---")
+    try:
+        token = login(APIC_URL, USERNAME, PASSWORD)
+    except Exception as e:
+        print(f"Login failed for {APIC_URL}: {e}")
+        return
+    ensure_rogue_ep_control_enabled(APIC_URL, token)
 
 def main():
     csv_path = input("Enter path to CSV file with fabric credentials: ")
     fabrics = read_fabric_credentials(csv_path)
-    for fabric in fabrics:
-        APIC_URL = fabric["APIC_URL"]
-        USERNAME = fabric["USERNAME"]
-        PASSWORD = fabric["PASSWORD"]
-        print(f"\n--- Processing fabric: {APIC_URL} ---")
-        try:
-            token = login(APIC_URL, USERNAME, PASSWORD)
-        except Exception as e:
-            print(f"Login failed for {APIC_URL}: {e}")
-            continue
-        ensure_rogue_ep_control_enabled(APIC_URL, token)
+    run_fleet(fabrics, process_fabric)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,850 @@
+##################
+# Local APIC simulator for offline testing and benchmarking of the ACI Vetr fix scripts
+# Flow of the code is as follows:
+# 1. Build an in-memory object tree (MIT) per simulated fabric with the global policies,
+#    funcprof containers and a configurable number of policy groups; every other access port
+#    group is bound to a leaf interface through interface and switch profiles.
+# 2. Serve the APIC REST calls used by the scripts: aaaLogin/aaaRefresh, /api/mo/<dn>.json
+#    and /api/class/<class>.json GET (filters, subtree, paging, count) and POST (nested objects).
+# 3. Inject latency, errors (503) and throttling (429 with Retry-After) when asked to.
+# 4. Push change events of subscribed DNs/classes (subscription=yes) over the APIC websocket
+#    (/socket<token>), with subscriptionRefresh keeping subscriptions alive.
+# 5. Resolve the MCP state of every bound interface on its leaf (mcpIf under topology/), after
+#    --resolve-delay-ms, so a rollout can be verified on the leaves.
+# Every fabric is served under its own path prefix, e.g. http://127.0.0.1:8443/fabric1,
+# so one simulator can stand in for a whole fleet.
+###################
+
+import argparse
+import csv
+import json
+import queue
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from ACI_Dn import parent_dn
+from ACI_Websocket import (OP_CLOSE, OP_PING, OP_PONG, OP_TEXT, ConnectionClosed, WebSocketError, accept_key,
+                           encode_frame, read_frame_sync)
+
+SIM_USERNAME = "admin"
+SIM_PASSWORD = "password"
+# Seconds a subscription lives without subscriptionRefresh
+SUBSCRIPTION_TIMEOUT = 90
+# Interfaces (port selectors) per seeded leaf interface profile
+PORTS_PER_LEAF = 24
+
+# How the relative name (rn) of an object is built from its attributes
+RN_FORMATS = {
+    "infraInfra": "infra",
+    "fabricInst": "fabric",
+    "infraFuncP": "funcprof",
+    "fabricFuncP": "funcprof",
+    "epControlP": "epCtrlP-{name}",
+    "infraPortTrackPol": "trackEqptFabP-{name}",
+    "infraSetPol": "settings",
+    "mcpInstPol": "mcpInstP-{name}",
+    "mcpIfPol": "mcpIfP-{name}",
+    "infraAccPortGrp": "accportgrp-{name}",
+    "infraRsMcpIfPol": "rsmcpIfPol",
+    "fabricNodeControl": "nodecontrol-{name}",
+    "fabricLeNodePGrp": "lenodepgrp-{name}",
+    "fabricRsMonInstFabricPol": "rsmonInstFabricPol",
+    "fabricRsNodeCtrl": "rsnodeCtrl",
+    "fabricLeafP": "leprof-{name}",
+    "fabricLeafS": "leaves-{name}-typ-{type}",
+    "fabricNodeBlk": "nodeblk-{name}",
+    "fabricRsLeNodePGrp": "rsleNodePGrp",
+    "infraAccPortP": "accportprof-{name}",
+    "infraHPortS": "hports-{name}-typ-{type}",
+    "infraPortBlk": "portblk-{name}",
+    "infraRsAccBaseGrp": "rsaccBaseGrp",
+    "infraNodeP": "nodeprof-{name}",
+    "infraLeafS": "leaves-{name}-typ-{type}",
+    "infraNodeBlk": "nodeblk-{name}",
+    "infraRsAccPortP": "rsaccPortP-[{tDn}]",
+}
+
+# Relations: class -> (target name attribute, target DN format)
+RELATIONS = {
+    "infraRsMcpIfPol": ("tnMcpIfPolName", "uni/infra/mcpIfP-{}"),
+    "fabricRsNodeCtrl": ("tnFabricNodeControlName", "uni/fabric/nodecontrol-{}"),
+    "fabricRsMonInstFabricPol": ("tnMonFabricPolName", "uni/fabric/monfab-{}"),
+}
+
+# Default values of attributes that a real APIC always returns
+CLASS_DEFAULTS = {
+    "epControlP": {"adminSt": "disabled", "holdIntvl": "1800", "rogueEpDetectIntvl": "60", "rogueEpDetectMult": "4"},
+    "infraPortTrackPol": {"adminSt": "off", "delay": "120"},
+    "infraSetPol": {"unicastXrEpLearnDisable": "no", "domainValidation": "no"},
+    "mcpInstPol": {"adminSt": "disabled", "ctrl": ""},
+    "mcpIfPol": {"adminSt": "enabled", "descr": ""},
+    "fabricNodeControl": {"control": "", "descr": ""},
+    "fabricNodeBlk": {"from_": "0", "to_": "0"},
+    "fabricLeafS": {"type": "range"},
+}
+
+# Classes whose changes move the MCP state of the interfaces on the leaves (mcpIf)
+RESOLVE_CLASSES = {"mcpInstPol", "mcpIfPol", "infraRsMcpIfPol", "infraRsAccBaseGrp", "infraPortBlk",
+                   "infraNodeBlk", "infraRsAccPortP"}
+
+OPERATIONAL_PROPS = {"modTs", "lcOwn", "uid", "childAction", "status", "state", "tCl"}
+# tDn is resolved by the APIC only for relations by name; relations by DN are configured with it
+
+
+class ApicError(Exception):
+    def __init__(self, status, text):
+        super().__init__(text)
+        self.status = status
+        self.text = text
+
+
+def rn_of(cls, attributes):
+    if attributes.get("rn"):
+        return attributes["rn"]
+    rn_format = RN_FORMATS.get(cls)
+    if rn_format is None:
+        raise ApicError(400, f"Unknown class {cls} without rn")
+    try:
+        return rn_format.format(**attributes)
+    except KeyError as e:
+        raise ApicError(400, f"Missing naming property {e} for class {cls}")
+
+
+# query-target-filter parser: eq/ne/lt/gt/le/ge/wcard/bw/and/or/not
+def parse_filter(text):
+    tokens = re.findall(r'"(?:[^"\\]|\\.)*"|[(),]|[^(),"\s]+', text)
+    position = 0
+
+    def parse():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+        if token.startswith('"'):
+            return ("value", token[1:-1])
+        if position < len(tokens) and tokens[position] == "(":
+            position += 1
+            args = []
+            while tokens[position] != ")":
+                args.append(parse())
+                if tokens[position] == ",":
+                    position += 1
+            position += 1
+            return (token, args)
+        return ("prop", token)
+
+    try:
+        return parse()
+    except IndexError:
+        raise ApicError(400, f"Invalid query-target-filter {text}")
+
+
+def _prop_value(mo, node):
+    if node[0] == "value":
+        return node[1]
+    cls, _, prop = node[1].partition(".")
+    if cls != mo["class"]:
+        return None
+    return mo["attributes"].get(prop)
+
+
+def match_filter(node, mo):
+    op, args = node
+    if op == "and":
+        return all(match_filter(arg, mo) for arg in args)
+    if op == "or":
+        return any(match_filter(arg, mo) for arg in args)
+    if op == "not":
+        return not match_filter(args[0], mo)
+    values = [_prop_value(mo, arg) for arg in args]
+    if values[0] is None:
+        return False
+    if op == "eq":
+        return values[0] == values[1]
+    if op == "ne":
+        return values[0] != values[1]
+    if op == "wcard":
+        return re.search(values[1], values[0]) is not None
+    if op in ("lt", "gt", "le", "ge", "bw"):
+        def key(value):
+            try:
+                return (0, float(value), "")
+            except (TypeError, ValueError):
+                return (1, 0.0, str(value))
+        left = key(values[0])
+        if op == "bw":
+            return key(values[1]) <= left <= key(values[2])
+        right = key(values[1])
+        return {"lt": left < right, "gt": left > right, "le": left <= right, "ge": left >= right}[op]
+    raise ApicError(400, f"Unsupported filter operator {op}")
+
+
+def _payload_classes(payload):
+    classes = set()
+    for cls, body in payload.items():
+        classes.add(cls)
+        for child in body.get("children", []):
+            classes |= _payload_classes(child)
+    return classes
+
+
+def _now_ts():
+    now = time.time()
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}+00:00"
+
+
+# One simulated APIC (one fabric) with its own object tree, tokens and counters
+class SimulatedFabric:
+    def __init__(self, name, port_groups=10, node_groups=10, token_timeout=600):
+        self.name = name
+        self.token_timeout = token_timeout
+        self.lock = threading.RLock()
+        self.mos = {}
+        self.children = {}
+        self.by_class = {}
+        self.tokens = {}
+        self.stats = {"requests": 0, "gets": 0, "posts": 0, "logins": 0, "refreshes": 0,
+                      "errors": 0, "throttled": 0, "bytes_in": 0, "bytes_out": 0, "events": 0}
+        self.bucket = None
+        self.subscription_timeout = SUBSCRIPTION_TIMEOUT
+        self.subscriptions = {}
+        self.websockets = {}
+        # Seconds before a change reaches the leaves (the concrete objects are resolved again)
+        self.resolve_delay = 0.0
+        self._seed(port_groups, node_groups)
+        self.resolve_concrete()
+
+    def _seed(self, port_groups, node_groups):
+        self.insert("polUni", "uni", {})
+        self.insert("infraInfra", "uni/infra", {})
+        self.insert("fabricInst", "uni/fabric", {})
+        self.insert("infraFuncP", "uni/infra/funcprof", {})
+        self.insert("fabricFuncP", "uni/fabric/funcprof", {})
+        self.insert("epControlP", "uni/infra/epCtrlP-default", {"name": "default"})
+        self.insert("infraPortTrackPol", "uni/infra/trackEqptFabP-default", {"name": "default"})
+        self.insert("infraSetPol", "uni/infra/settings", {"name": ""})
+        self.insert("mcpInstPol", "uni/infra/mcpInstP-default", {"name": "default"})
+        self.insert("mcpIfPol", "uni/infra/mcpIfP-default", {"name": "default"})
+        for index in range(port_groups):
+            name = f"port-pgrp-{index:05d}"
+            self.insert("infraAccPortGrp", f"uni/infra/funcprof/accportgrp-{name}", {"name": name})
+        # Every other port group is bound to one interface of a leaf (interface and switch profiles)
+        for used, index in enumerate(range(0, port_groups, 2)):
+            leaf = 101 + used // PORTS_PER_LEAF
+            port = used % PORTS_PER_LEAF + 1
+            profile_dn = f"uni/infra/accportprof-leaf{leaf}"
+            if port == 1:
+                node_dn = f"uni/infra/nodeprof-leaf{leaf}"
+                self.insert("infraAccPortP", profile_dn, {"name": f"leaf{leaf}"})
+                self.insert("infraNodeP", node_dn, {"name": f"leaf{leaf}"})
+                self.insert("infraLeafS", f"{node_dn}/leaves-leaf{leaf}-typ-range", {"name": f"leaf{leaf}", "type": "range"})
+                self.insert("infraNodeBlk", f"{node_dn}/leaves-leaf{leaf}-typ-range/nodeblk-blk1",
+                            {"name": "blk1", "from_": str(leaf), "to_": str(leaf)})
+                self.insert("infraRsAccPortP", f"{node_dn}/rsaccPortP-[{profile_dn}]", {"tDn": profile_dn})
+            selector_dn = f"{profile_dn}/hports-port{port}-typ-range"
+            self.insert("infraHPortS", selector_dn, {"name": f"port{port}", "type": "range"})
+            self.insert("infraPortBlk", f"{selector_dn}/portblk-block1",
+                        {"name": "block1", "fromCard": "1", "toCard": "1", "fromPort": str(port), "toPort": str(port)})
+            self.insert("infraRsAccBaseGrp", f"{selector_dn}/rsaccBaseGrp",
+                        {"tDn": f"uni/infra/funcprof/accportgrp-port-pgrp-{index:05d}"})
+        for index in range(node_groups):
+            name = f"node-pgrp-{index:05d}"
+            dn = f"uni/fabric/funcprof/lenodepgrp-{name}"
+            self.insert("fabricLeNodePGrp", dn, {"name": name})
+            self.insert("fabricRsMonInstFabricPol", f"{dn}/rsmonInstFabricPol", {"tnMonFabricPolName": "default"})
+
+    # Concrete MCP state of every bound interface, as the leaves would report it:
+    # enabled when the MCP instance policy and the interface policy of its group are enabled
+    def resolve_concrete(self):
+        with self.lock:
+            instance = self.mos.get("uni/infra/mcpInstP-default", {"attributes": {}})["attributes"].get("adminSt")
+            profile_leaves = {}
+            for dn, mo in self.by_class.get("infraRsAccPortP", {}).items():
+                leaves = profile_leaves.setdefault(mo["attributes"]["tDn"], set())
+                for node_mo in self.descendants(parent_dn(dn)):
+                    if node_mo["class"] == "infraNodeBlk":
+                        attrs = node_mo["attributes"]
+                        leaves.update(range(int(attrs["from_"]), int(attrs["to_"]) + 1))
+            for dn, mo in list(self.by_class.get("infraRsAccBaseGrp", {}).items()):
+                selector_dn = parent_dn(dn)
+                group_dn = mo["attributes"].get("tDn", "")
+                relation = self.mos.get(f"{group_dn}/rsmcpIfPol")
+                policy_name = (relation["attributes"].get("tnMcpIfPolName") if relation else None) or "default"
+                policy = self.mos.get(f"uni/infra/mcpIfP-{policy_name}")
+                enabled = instance == "enabled" and policy is not None and policy["attributes"].get("adminSt") == "enabled"
+                ports = []
+                for child_dn in self.children.get(selector_dn, []):
+                    child = self.mos[child_dn]
+                    if child["class"] == "infraPortBlk":
+                        attrs = child["attributes"]
+                        ports += [f"eth{card}/{port}"
+                                  for card in range(int(attrs["fromCard"]), int(attrs["toCard"]) + 1)
+                                  for port in range(int(attrs["fromPort"]), int(attrs["toPort"]) + 1)]
+                for leaf in profile_leaves.get(parent_dn(selector_dn), ()):
+                    for port in ports:
+                        self.insert("mcpIf", f"topology/pod-1/node-{leaf}/sys/mcp/inst/if-[{port}]",
+                                    {"id": port, "adminSt": "enabled" if enabled else "disabled"})
+
+    def _schedule_resolve(self):
+        if self.resolve_delay > 0:
+            timer = threading.Timer(self.resolve_delay, self.resolve_concrete)
+            timer.daemon = True
+            timer.start()
+        else:
+            self.resolve_concrete()
+
+    # Low level object tree operations (caller holds the lock)
+    def insert(self, cls, dn, attributes):
+        with self.lock:
+            existing = self.mos.get(dn)
+            if existing is None:
+                attrs = dict(CLASS_DEFAULTS.get(cls, {}))
+                attrs.update(attributes)
+                attrs["dn"] = dn
+                mo = {"class": cls, "attributes": attrs, "parent": parent_dn(dn)}
+                self.mos[dn] = mo
+                self.children.setdefault(mo["parent"], []).append(dn)
+                self.by_class.setdefault(cls, {})[dn] = mo
+                changed = None
+            else:
+                mo = existing
+                changed = {k: v for k, v in attributes.items() if mo["attributes"].get(k) != v}
+                mo["attributes"].update(attributes)
+            mo["attributes"]["modTs"] = _now_ts()
+            if self.subscriptions and (changed is None or changed):
+                self._notify(mo, "created" if changed is None else "modified", changed)
+            return mo
+
+    def delete(self, dn):
+        with self.lock:
+            for child_dn in list(self.children.get(dn, [])):
+                self.delete(child_dn)
+            mo = self.mos.pop(dn, None)
+            if mo is None:
+                return
+            if self.subscriptions:
+                self._notify(mo, "deleted", {})
+            self.children.pop(dn, None)
+            siblings = self.children.get(mo["parent"], [])
+            if dn in siblings:
+                siblings.remove(dn)
+            self.by_class.get(mo["class"], {}).pop(dn, None)
+
+    def descendants(self, dn):
+        for child_dn in self.children.get(dn, []):
+            yield self.mos[child_dn]
+            yield from self.descendants(child_dn)
+
+    # Authentication
+    def login(self, username, password):
+        if username != SIM_USERNAME or password != SIM_PASSWORD:
+            raise ApicError(401, "Username or password is incorrect")
+        token = f"{self.name}-{random.getrandbits(64):016x}"
+        self.tokens[token] = time.time() + self.token_timeout
+        self.stats["logins"] += 1
+        return token
+
+    def check_token(self, token):
+        expires = self.tokens.get(token)
+        if expires is None or expires < time.time():
+            raise ApicError(403, "Token was invalid (Error: Token timeout)")
+
+    def refresh(self, token):
+        self.check_token(token)
+        self.tokens[token] = time.time() + self.token_timeout
+        self.stats["refreshes"] += 1
+        return token
+
+    # Event subscriptions, delivered over the websocket opened with the same token
+    def add_websocket(self, token, websocket):
+        with self.lock:
+            self.websockets.setdefault(token, []).append(websocket)
+
+    def remove_websocket(self, token, websocket):
+        with self.lock:
+            sockets = self.websockets.get(token, [])
+            if websocket in sockets:
+                sockets.remove(websocket)
+            if not sockets:
+                self.websockets.pop(token, None)
+                for sid in [sid for sid, sub in self.subscriptions.items() if sub["token"] == token]:
+                    del self.subscriptions[sid]
+
+    def subscribe(self, token, kind, target, subtree=False):
+        if not self.websockets.get(token):
+            raise ApicError(400, "Subscription requires an open websocket for this token")
+        sid = str(random.getrandbits(62))
+        self.subscriptions[sid] = {"token": token, "kind": kind, "target": target, "subtree": subtree,
+                                   "expires": time.time() + self.subscription_timeout}
+        return sid
+
+    def refresh_subscription(self, sid):
+        sub = self.subscriptions.get(sid)
+        if sub is None or sub["expires"] < time.time():
+            self.subscriptions.pop(sid, None)
+            raise ApicError(400, f"Subscription {sid} does not exist or has expired")
+        sub["expires"] = time.time() + self.subscription_timeout
+
+    def _matches(self, sub, mo):
+        if sub["kind"] == "class":
+            return mo["class"] == sub["target"]
+        dn = mo["attributes"]["dn"]
+        return dn == sub["target"] or (sub["subtree"] and dn.startswith(sub["target"] + "/"))
+
+    def _notify(self, mo, status, changed):
+        now = time.time()
+        by_token = {}
+        for sid, sub in list(self.subscriptions.items()):
+            if sub["expires"] < now:
+                del self.subscriptions[sid]
+            elif self._matches(sub, mo):
+                by_token.setdefault(sub["token"], []).append(sid)
+        if not by_token:
+            return
+        rendered = self.render(mo)[mo["class"]]["attributes"]
+        if status == "created":
+            attrs = rendered
+        elif status == "deleted":
+            attrs = {"dn": rendered["dn"]}
+        else:
+            attrs = {k: v for k, v in rendered.items() if k in changed or k in ("dn", "modTs", "tDn", "state")}
+        attrs = dict(attrs, status=status)
+        for token, sids in by_token.items():
+            message = json.dumps({"subscriptionId": sids, "imdata": [{mo["class"]: {"attributes": attrs}}]})
+            for websocket in self.websockets.get(token, []):
+                websocket.send(message)
+                self.stats["events"] += 1
+
+    # Rendering of query results
+    def render(self, mo, prop_include="all", subtree="no", subtree_classes=None):
+        attrs = dict(mo["attributes"])
+        relation = RELATIONS.get(mo["class"])
+        if relation is not None:
+            target_name = attrs.get(relation[0]) or "default"
+            attrs["tDn"] = relation[1].format(target_name)
+            attrs["state"] = "formed" if attrs["tDn"] in self.mos else "missing-target"
+        if prop_include == "naming-only":
+            attrs = {k: v for k, v in attrs.items() if k in ("dn", "name")}
+        elif prop_include == "config-only":
+            attrs = {k: v for k, v in attrs.items()
+                     if k == "dn" or (k not in OPERATIONAL_PROPS and not (k == "tDn" and relation is not None))}
+        body = {"attributes": attrs}
+        if subtree in ("children", "full"):
+            children = []
+            for child_dn in self.children.get(mo["attributes"]["dn"], []):
+                child = self.mos[child_dn]
+                if subtree_classes and child["class"] not in subtree_classes:
+                    continue
+                children.append(self.render(child, prop_include, "full" if subtree == "full" else "no", subtree_classes))
+            if children:
+                body["children"] = children
+        return {mo["class"]: body}
+
+    def query(self, candidates, params):
+        filter_text = params.get("query-target-filter")
+        if filter_text:
+            node = parse_filter(filter_text)
+            candidates = [mo for mo in candidates if match_filter(node, mo)]
+        order_by = params.get("order-by")
+        if order_by:
+            prop, _, direction = order_by.partition("|")
+            prop = prop.partition(".")[2] or prop
+            candidates = sorted(candidates, key=lambda mo: str(mo["attributes"].get(prop, "")),
+                                reverse=direction == "desc")
+        total = len(candidates)
+        if params.get("rsp-subtree-include") == "count":
+            return total, [{"moCount": {"attributes": {"count": str(total), "dn": ""}}}]
+        if "page-size" in params:
+            page_size = int(params["page-size"])
+            page = int(params.get("page", "0"))
+            candidates = candidates[page * page_size:(page + 1) * page_size]
+        subtree_classes = set(filter(None, params.get("rsp-subtree-class", "").split(",")))
+        imdata = [self.render(mo, params.get("rsp-prop-include", "all"), params.get("rsp-subtree", "no"),
+                              subtree_classes) for mo in candidates]
+        return total, imdata
+
+    def query_mo(self, dn, params):
+        with self.lock:
+            mo = self.mos.get(dn)
+            if mo is None:
+                return 0, []
+            target = params.get("query-target", "self")
+            if target == "self":
+                candidates = [mo]
+            elif target == "children":
+                candidates = [self.mos[child_dn] for child_dn in self.children.get(dn, [])]
+            else:
+                candidates = [mo] + list(self.descendants(dn))
+            classes = set(filter(None, params.get("target-subtree-class", "").split(",")))
+            if classes:
+                candidates = [c for c in candidates if c["class"] in classes]
+            return self.query(candidates, params)
+
+    def query_class(self, cls, params):
+        with self.lock:
+            return self.query(list(self.by_class.get(cls, {}).values()), params)
+
+    # Configuration (POST), applied atomically: validate the whole tree, then commit
+    def post(self, url_dn, payload):
+        if not isinstance(payload, dict) or len(payload) != 1:
+            raise ApicError(400, "Payload must contain exactly one root object")
+        cls, body = next(iter(payload.items()))
+        dn = body.get("attributes", {}).get("dn") or url_dn
+        with self.lock:
+            self._apply(cls, dn, body, commit=False, pending={})
+            self._apply(cls, dn, body, commit=True, pending={})
+        if _payload_classes(payload) & RESOLVE_CLASSES:
+            self._schedule_resolve()
+
+    def _exists(self, dn, pending):
+        if dn in pending:
+            return pending[dn]
+        return dn in self.mos
+
+    def _apply(self, cls, dn, body, commit, pending):
+        attributes = dict(body.get("attributes", {}))
+        status = attributes.pop("status", "created,modified") or "created,modified"
+        attributes.pop("rn", None)
+        attributes.pop("dn", None)
+        if "deleted" in status:
+            if commit:
+                self.delete(dn)
+            pending[dn] = False
+            return
+        exists = self._exists(dn, pending)
+        if exists and "modified" not in status:
+            raise ApicError(400, f"Object {dn} already exists")
+        if not exists and "created" not in status:
+            raise ApicError(400, f"Object {dn} does not exist")
+        if not exists and not self._exists(parent_dn(dn), pending):
+            raise ApicError(400, f"Parent of {dn} does not exist")
+        if exists and dn in self.mos and self.mos[dn]["class"] != cls:
+            raise ApicError(400, f"Object {dn} is not of class {cls}")
+        if commit:
+            self.insert(cls, dn, attributes)
+        pending[dn] = True
+        for child in body.get("children", []):
+            child_cls, child_body = next(iter(child.items()))
+            child_attrs = child_body.get("attributes", {})
+            child_dn = child_attrs.get("dn") or f"{dn}/{rn_of(child_cls, child_attrs)}"
+            self._apply(child_cls, child_dn, child_body, commit, pending)
+
+    # Throttling: simple token bucket in requests per second
+    def take_token(self, rate):
+        now = time.monotonic()
+        with self.lock:
+            if self.bucket is None:
+                self.bucket = [rate, now]
+            tokens, last = self.bucket
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens < 1:
+                self.bucket = [tokens, now]
+                return (1 - tokens) / rate
+            self.bucket = [tokens - 1, now]
+            return 0
+
+
+# Server side of one websocket; frames are written by a sender thread so a slow client
+# never blocks the fabric while events are queued
+class _SimWebSocket:
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            try:
+                self.wfile.write(frame)
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def put(self, frame):
+        self.queue.put(frame)
+
+    def send(self, text):
+        self.put(encode_frame(OP_TEXT, text.encode()))
+
+    def close(self):
+        self.queue.put(None)
+
+
+# HTTP front end of the simulator; serves all fabrics of one ApicSimulator
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    simulator = None
+
+    def log_message(self, *args):
+        if self.simulator.verbose:
+            super().log_message(*args)
+
+    def _reply(self, fabric, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        if fabric is not None:
+            with fabric.lock:
+                fabric.stats["bytes_out"] += len(data)
+
+    def _error(self, fabric, status, text, headers=None):
+        body = {"totalCount": "1", "imdata": [{"error": {"attributes": {"code": str(status), "text": text}}}]}
+        self._reply(fabric, status, body, headers)
+
+    def _token(self):
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            key, _, value = part.strip().partition("=")
+            if key == "APIC-cookie":
+                return value
+        return None
+
+    def _handle(self, method):
+        simulator = self.simulator
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        fabric, path = simulator.route(unquote(parsed.path))
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        if fabric is None:
+            return self._error(None, 404, f"Unknown fabric for {parsed.path}")
+        if (self.headers.get("Upgrade") or "").lower() == "websocket" and path.startswith("/socket"):
+            return self._websocket(fabric, path[len("/socket"):])
+        with fabric.lock:
+            fabric.stats["requests"] += 1
+            fabric.stats["gets" if method == "GET" else "posts"] += 1
+            fabric.stats["bytes_in"] += len(raw_body)
+        simulator.delay()
+        if simulator.rate_limit:
+            wait = fabric.take_token(simulator.rate_limit)
+            if wait > 0:
+                with fabric.lock:
+                    fabric.stats["throttled"] += 1
+                return self._error(fabric, 429, "Too many requests", {"Retry-After": f"{max(1, round(wait))}"})
+        if simulator.error_rate and random.random() < simulator.error_rate:
+            with fabric.lock:
+                fabric.stats["errors"] += 1
+            return self._error(fabric, 503, "Service unavailable (injected)", {"Retry-After": "1"})
+        try:
+            body = json.loads(raw_body) if raw_body else None
+            self._dispatch(fabric, method, path, params, body)
+        except ApicError as e:
+            self._error(fabric, e.status, e.text)
+        except (ValueError, KeyError, TypeError) as e:
+            self._error(fabric, 400, f"Malformed request: {e}")
+
+    # APIC event channel: upgrade to a websocket and keep it open until the client closes it
+    def _websocket(self, fabric, token):
+        try:
+            with fabric.lock:
+                fabric.check_token(token)
+        except ApicError as e:
+            return self._error(fabric, e.status, e.text)
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key:
+            return self._error(fabric, 400, "Missing Sec-WebSocket-Key")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        websocket = _SimWebSocket(self.wfile)
+        fabric.add_websocket(token, websocket)
+        try:
+            while True:
+                fin, opcode, payload = read_frame_sync(self.rfile)
+                if opcode == OP_PING:
+                    websocket.put(encode_frame(OP_PONG, payload))
+                elif opcode == OP_CLOSE:
+                    websocket.put(encode_frame(OP_CLOSE, payload[:2]))
+                    break
+        except (ConnectionClosed, WebSocketError, OSError):
+            pass
+        finally:
+            fabric.remove_websocket(token, websocket)
+            websocket.close()
+            self.close_connection = True
+
+    def _dispatch(self, fabric, method, path, params, body):
+        if path == "/api/aaaLogin.json" and method == "POST":
+            attrs = body["aaaUser"]["attributes"]
+            with fabric.lock:
+                token = fabric.login(attrs.get("name"), attrs.get("pwd"))
+            return self._reply(fabric, 200, self._login_body(fabric, token),
+                               {"Set-Cookie": f"APIC-cookie={token}; path=/"})
+        if path == "/api/aaaRefresh.json":
+            with fabric.lock:
+                token = fabric.refresh(self._token())
+            return self._reply(fabric, 200, self._login_body(fabric, token))
+        with fabric.lock:
+            fabric.check_token(self._token())
+        if path == "/api/subscriptionRefresh.json":
+            with fabric.lock:
+                fabric.refresh_subscription(params.get("id", ""))
+            return self._reply(fabric, 200, {"totalCount": "0", "imdata": []})
+        match = re.match(r"^/api/(mo|class)/(.+)\.json$", path)
+        if match is None:
+            raise ApicError(400, f"Unsupported URL {path}")
+        kind, target = match.groups()
+        if method == "POST":
+            if kind != "mo":
+                raise ApicError(400, "POST is only supported on /api/mo")
+            fabric.post(target, body)
+            return self._reply(fabric, 200, {"totalCount": "0", "imdata": []})
+        if kind == "mo":
+            total, imdata = fabric.query_mo(target, params)
+        else:
+            total, imdata = fabric.query_class(target, params)
+        body = {"totalCount": str(total), "imdata": imdata}
+        if params.get("subscription") == "yes":
+            with fabric.lock:
+                body["subscriptionId"] = fabric.subscribe(self._token(), kind, target,
+                                                          params.get("query-target") == "subtree")
+        self._reply(fabric, 200, body)
+
+    def _login_body(self, fabric, token):
+        return {"totalCount": "1", "imdata": [{"aaaLogin": {"attributes": {
+            "token": token,
+            "refreshTimeoutSeconds": str(fabric.token_timeout),
+            "maximumLifetimeSeconds": "86400",
+            "creationTime": str(int(time.time())),
+        }}}]}
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class ApicSimulator:
+    def __init__(self, fabrics=1, port_groups=10, node_groups=10, latency_ms=0.0, jitter_ms=0.0,
+                 error_rate=0.0, rate_limit=0.0, token_timeout=600, host="127.0.0.1", port=0,
+                 certfile=None, keyfile=None, verbose=False, subscription_timeout=SUBSCRIPTION_TIMEOUT,
+                 resolve_delay_ms=0.0):
+        self.fabrics = {f"fabric{index}": SimulatedFabric(f"fabric{index}", port_groups, node_groups, token_timeout)
+                        for index in range(1, fabrics + 1)}
+        for fabric in self.fabrics.values():
+            fabric.subscription_timeout = subscription_timeout
+            fabric.resolve_delay = resolve_delay_ms / 1000
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.verbose = verbose
+        handler = type("SimulatorHandler", (_Handler,), {"simulator": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.scheme = "https"
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"{self.scheme}://{host}:{port}"
+
+    def url(self, name):
+        return f"{self.base_url}/{name}"
+
+    def urls(self):
+        return [self.url(name) for name in self.fabrics]
+
+    def route(self, path):
+        name, _, rest = path.lstrip("/").partition("/")
+        fabric = self.fabrics.get(name)
+        if fabric is None and len(self.fabrics) == 1 and path.startswith("/api/"):
+            return next(iter(self.fabrics.values())), path
+        return fabric, "/" + rest
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def credentials(self):
+        return [{"APIC_URL": url, "USERNAME": SIM_USERNAME, "PASSWORD": SIM_PASSWORD} for url in self.urls()]
+
+    def write_credentials_csv(self, csv_path):
+        with open(csv_path, "w", newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=["APIC_URL", "USERNAME", "PASSWORD"])
+            writer.writeheader()
+            writer.writerows(self.credentials())
+
+    def stats(self):
+        return {name: dict(fabric.stats) for name, fabric in self.fabrics.items()}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local APIC simulator for the ACI Vetr fix scripts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--fabrics", type=int, default=1, help="number of simulated fabrics")
+    parser.add_argument("--port-groups", type=int, default=10, help="infraAccPortGrp objects per fabric")
+    parser.add_argument("--node-groups", type=int, default=10, help="fabricLeNodePGrp objects per fabric")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random +/- jitter on the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests/s per fabric before 429 (0 = off)")
+    parser.add_argument("--token-timeout", type=int, default=600, help="token refresh timeout in seconds")
+    parser.add_argument("--subscription-timeout", type=int, default=SUBSCRIPTION_TIMEOUT,
+                        help="seconds a subscription lives without subscriptionRefresh")
+    parser.add_argument("--resolve-delay-ms", type=float, default=0.0,
+                        help="delay before an MCP change shows on the leaves (mcpIf)")
+    parser.add_argument("--certfile", help="serve HTTPS with this certificate")
+    parser.add_argument("--keyfile", help="private key of --certfile")
+    parser.add_argument("--write-csv", help="write a credentials CSV for the simulated fabrics")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+    simulator = ApicSimulator(args.fabrics, args.port_groups, args.node_groups, args.latency_ms, args.jitter_ms,
+                              args.error_rate, args.rate_limit, args.token_timeout, args.host, args.port,
+                              args.certfile, args.keyfile, args.verbose, args.subscription_timeout,
+                              args.resolve_delay_ms)
+    if args.write_csv:
+        simulator.write_credentials_csv(args.write_csv)
+        print(f"Credentials written to {args.write_csv}")
+    for url in simulator.urls():
+        print(f"Simulated fabric: {url}")
+    print("Simulator ready", flush=True)
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
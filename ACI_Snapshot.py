@@ -0,0 +1,263 @@
+##################
+# Local snapshot of the policy objects of each fabric, queried offline
+# Flow of the code is as follows:
+# 1. Pull the classes the fixes and the audit look at (uni/infra and uni/fabric/funcprof subtrees)
+#    into a SQLite store indexed by class, DN, parent DN and relation target.
+# 2. Later refreshes only ask for objects whose modTs moved since the last one, and compare
+#    object counts to find deletions, so an unchanged fabric costs two small queries per class.
+#    When new objects showed up (a rename keeps the count) the DNs are compared instead.
+# 3. Answer the audit and "which groups lack the DOM/MCP relation" locally, without the APIC.
+# Usage:
+#   python ACI_Snapshot.py refresh --csv aci_fabric_credentials.csv
+#   python ACI_Snapshot.py audit
+#   python ACI_Snapshot.py targets mcp      (or dom)
+###################
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ACI_Audit import GLOBAL_SETTINGS, evaluate_settings, print_fabric_matrix, print_fleet_matrix
+from ACI_Auth import login
+from ACI_Dn import parent_dn
+from ACI_Fleet import read_fabric_credentials, run_fleet
+from ACI_Metrics import traced_operation
+from ACI_Query import Query, and_, count, ge, wcard
+
+SNAPSHOT_PATH = os.environ.get("ACI_SNAPSHOT", "aci_snapshot.db")
+
+# Classes kept in the snapshot and the subtree they are read from
+SNAPSHOT_CLASSES = {
+    "epControlP": "uni/infra",
+    "infraPortTrackPol": "uni/infra",
+    "infraSetPol": "uni/infra",
+    "mcpInstPol": "uni/infra",
+    "mcpIfPol": "uni/infra",
+    "infraAccPortGrp": "uni/infra/funcprof",
+    "infraRsMcpIfPol": "uni/infra/funcprof",
+    "fabricNodeControl": "uni/fabric",
+    "fabricLeNodePGrp": "uni/fabric/funcprof",
+    "fabricRsNodeCtrl": "uni/fabric/funcprof",
+    "fabricRsMonInstFabricPol": "uni/fabric/funcprof",
+}
+
+# DOM/MCP targets: group class, relation class and the DN format of the policy it must point to
+TARGETS = {
+    "mcp": ("infraAccPortGrp", "infraRsMcpIfPol", "uni/infra/mcpIfP-{}"),
+    "dom": ("fabricLeNodePGrp", "fabricRsNodeCtrl", "uni/fabric/nodecontrol-{}"),
+}
+
+
+class SnapshotStore:
+    def __init__(self, path=None):
+        self.path = path or SNAPSHOT_PATH
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS mo (
+                fabric TEXT, dn TEXT, class TEXT, parent TEXT, modts TEXT, attrs TEXT,
+                PRIMARY KEY (fabric, dn));
+            CREATE INDEX IF NOT EXISTS mo_class ON mo (fabric, class);
+            CREATE INDEX IF NOT EXISTS mo_parent ON mo (fabric, parent);
+            CREATE TABLE IF NOT EXISTS rel (
+                fabric TEXT, dn TEXT, class TEXT, parent TEXT, target TEXT,
+                PRIMARY KEY (fabric, dn));
+            CREATE INDEX IF NOT EXISTS rel_target ON rel (fabric, target);
+            CREATE INDEX IF NOT EXISTS rel_parent ON rel (fabric, parent, class);
+            CREATE TABLE IF NOT EXISTS refresh (
+                fabric TEXT, class TEXT, modts TEXT, refreshed REAL,
+                PRIMARY KEY (fabric, class));
+        """)
+        self.db.commit()
+
+    # Store (or replace) objects of one class: mos are APIC attribute dicts
+    def upsert(self, fabric, cls, mos):
+        mo_rows, rel_rows = [], []
+        for attrs in mos:
+            dn = attrs["dn"]
+            parent = parent_dn(dn)
+            mo_rows.append((fabric, dn, cls, parent, attrs.get("modTs"), json.dumps(attrs)))
+            if attrs.get("tDn"):
+                rel_rows.append((fabric, dn, cls, parent, attrs["tDn"]))
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO mo VALUES (?, ?, ?, ?, ?, ?)", mo_rows)
+            self.db.executemany("INSERT OR REPLACE INTO rel VALUES (?, ?, ?, ?, ?)", rel_rows)
+            self.db.commit()
+
+    def delete(self, fabric, dns):
+        rows = [(fabric, dn) for dn in dns]
+        with self.lock:
+            self.db.executemany("DELETE FROM mo WHERE fabric=? AND dn=?", rows)
+            self.db.executemany("DELETE FROM rel WHERE fabric=? AND dn=?", rows)
+            self.db.commit()
+
+    def last_refresh(self, fabric, cls):
+        with self.lock:
+            row = self.db.execute("SELECT modts FROM refresh WHERE fabric=? AND class=?", (fabric, cls)).fetchone()
+        return row[0] if row else None
+
+    def set_refresh(self, fabric, cls):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO refresh SELECT ?, ?, MAX(modts), ? FROM mo"
+                            " WHERE fabric=? AND class=?", (fabric, cls, time.time(), fabric, cls))
+            self.db.commit()
+
+    def fabrics(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT fabric FROM refresh ORDER BY fabric")]
+
+    def count(self, fabric, cls):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM mo WHERE fabric=? AND class=?", (fabric, cls)).fetchone()[0]
+
+    def dns(self, fabric, cls):
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT dn FROM mo WHERE fabric=? AND class=?", (fabric, cls))}
+
+    # Offline queries
+    def get(self, fabric, dn):
+        with self.lock:
+            row = self.db.execute("SELECT attrs FROM mo WHERE fabric=? AND dn=?", (fabric, dn)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, fabric, cls):
+        with self.lock:
+            rows = self.db.execute("SELECT attrs FROM mo WHERE fabric=? AND class=? ORDER BY dn", (fabric, cls)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def children(self, fabric, dn, cls=None):
+        query = "SELECT attrs FROM mo WHERE fabric=? AND parent=?"
+        args = [fabric, dn]
+        if cls is not None:
+            query += " AND class=?"
+            args.append(cls)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY dn", args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # Relation objects pointing at a DN (e.g. which groups use an MCP interface policy)
+    def referencing(self, fabric, target_dn, cls=None):
+        query = "SELECT dn FROM rel WHERE fabric=? AND target=?"
+        args = [fabric, target_dn]
+        if cls is not None:
+            query += " AND class=?"
+            args.append(cls)
+        with self.lock:
+            return [row[0] for row in self.db.execute(query + " ORDER BY dn", args)]
+
+    # Names of the groups of group_cls without a rel_cls child pointing at target_dn
+    def groups_missing_relation(self, fabric, group_cls, rel_cls, target_dn):
+        with self.lock:
+            rows = self.db.execute("""
+                SELECT mo.attrs FROM mo
+                WHERE mo.fabric=? AND mo.class=? AND NOT EXISTS (
+                    SELECT 1 FROM rel WHERE rel.fabric=mo.fabric AND rel.parent=mo.dn
+                                        AND rel.class=? AND rel.target=?)
+                ORDER BY mo.dn
+            """, (fabric, group_cls, rel_cls, target_dn)).fetchall()
+        return [json.loads(row[0])["name"] for row in rows]
+
+
+# Bring one class of a fabric up to date: changed objects by modTs, deletions by count
+def refresh_class(store, APIC_URL, token, cls, full=False):
+    dn_filter = wcard(cls, "dn", f"^{SNAPSHOT_CLASSES[cls]}/")
+    since = None if full else store.last_refresh(APIC_URL, cls)
+    query_filter = dn_filter if since is None else and_(dn_filter, ge(cls, "modTs", since))
+    known = store.dns(APIC_URL, cls)
+    changed = 0
+    fetched = set()
+    for mos in Query.of_class(cls).where(query_filter).pages(APIC_URL, token):
+        attrs = [mo["attributes"] for mo in mos]
+        fetched.update(a["dn"] for a in attrs)
+        store.upsert(APIC_URL, cls, attrs)
+        changed += len(attrs)
+    deleted = 0
+    if since is None:
+        stale = known - fetched
+    elif fetched - known or count(APIC_URL, token, cls, dn_filter) != store.count(APIC_URL, cls):
+        # Something was deleted, or created (a rename or a delete plus a create keeps the count):
+        # list the DNs that still exist (names only) and drop the rest
+        remaining = set()
+        for mos in Query.of_class(cls).where(dn_filter).props("naming-only").pages(APIC_URL, token):
+            remaining.update(mo["attributes"]["dn"] for mo in mos)
+        stale = known - remaining
+    else:
+        stale = set()
+    if stale:
+        store.delete(APIC_URL, stale)
+        deleted = len(stale)
+    store.set_refresh(APIC_URL, cls)
+    return changed, deleted
+
+
+@traced_operation
+def refresh_fabric(store, APIC_URL, token, full=False):
+    changed = deleted = 0
+    for cls in SNAPSHOT_CLASSES:
+        class_changed, class_deleted = refresh_class(store, APIC_URL, token, cls, full)
+        changed += class_changed
+        deleted += class_deleted
+    print(f"Snapshot of {APIC_URL}: {changed} object(s) updated, {deleted} removed.")
+    return changed, deleted
+
+
+def audit_from_snapshot(store, APIC_URL):
+    found = {}
+    for _, cls, dn, _, _ in GLOBAL_SETTINGS:
+        attrs = store.get(APIC_URL, dn)
+        if attrs is not None:
+            found[dn] = attrs
+    return evaluate_settings(found)
+
+
+def missing_targets(store, APIC_URL, fix, policy_name):
+    group_cls, rel_cls, target_format = TARGETS[fix]
+    return store.groups_missing_relation(APIC_URL, group_cls, rel_cls, target_format.format(policy_name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local snapshot of the ACI policies, queried offline")
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="snapshot file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    refresh = commands.add_parser("refresh", help="pull the changes of every fabric into the snapshot")
+    refresh.add_argument("--csv", required=True, help="CSV file with fabric credentials")
+    refresh.add_argument("--full", action="store_true", help="re-read every object instead of the changes")
+    commands.add_parser("audit", help="global settings audit from the snapshot")
+    targets = commands.add_parser("targets", help="policy groups that lack the DOM or MCP relation")
+    targets.add_argument("fix", choices=sorted(TARGETS))
+    targets.add_argument("--policy", help="policy the groups must point to (default: the one of the fix)")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.snapshot)
+    if args.command == "refresh":
+        def process_fabric(fabric):
+            token = login(fabric["APIC_URL"], fabric["USERNAME"], fabric["PASSWORD"])
+            refresh_fabric(store, fabric["APIC_URL"], token, args.full)
+        run_fleet(read_fabric_credentials(args.csv), process_fabric)
+    elif args.command == "audit":
+        fleet_results = {}
+        for APIC_URL in store.fabrics():
+            print(f"\n--- Snapshot audit: {APIC_URL} ---")
+            fleet_results[APIC_URL] = audit_from_snapshot(store, APIC_URL)
+            print_fabric_matrix(APIC_URL, fleet_results[APIC_URL])
+        print_fleet_matrix(fleet_results)
+    else:
+        if args.policy is None:
+            if args.fix == "mcp":
+                from ACI_MCP import policy_name
+            else:
+                from ACI_DOM import policy_name
+            args.policy = policy_name
+        for APIC_URL in store.fabrics():
+            groups = missing_targets(store, APIC_URL, args.fix, args.policy)
+            print(f"{APIC_URL}: {len(groups)} group(s) without {TARGETS[args.fix][1]} to '{args.policy}'")
+            for name in groups:
+                print(f"  {name}")
+
+
+if __name__ == "__main__":
+    main()
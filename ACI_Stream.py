@@ -0,0 +1,104 @@
+##################
+# Streaming parser for large APIC responses
+# Flow of the code is as follows:
+# 1. Read the body of a streamed requests response chunk by chunk (ACI_STREAM_CHUNK_SIZE).
+# 2. Skip to the top-level "imdata" array and decode one object at a time with the C scanner
+#    of the json module (raw_decode), picking up "totalCount" on the way.
+# 3. ACI_Client keeps only the attributes the caller asks for from each object, so memory stays at
+#    about one chunk plus one object whatever the number of objects in the response.
+# 4. Whole (non-streamed) bodies are decoded with orjson when it is installed
+#    (ACI_JSON_BACKEND=json forces the standard library).
+###################
+
+import codecs
+import contextlib
+import itertools
+import json
+import os
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bytes read from the socket at a time
+CHUNK_SIZE = int(os.environ.get("ACI_STREAM_CHUNK_SIZE", str(64 * 1024)))
+JSON_BACKEND = os.environ.get("ACI_JSON_BACKEND", "orjson" if orjson is not None else "json")
+
+_raw_decode = json.JSONDecoder().raw_decode
+_SEPARATORS = re.compile(r"[\s,]*")
+_IMDATA = re.compile(r'"imdata"\s*:\s*\[')
+_TOTAL_COUNT = re.compile(r'"totalCount"\s*:\s*"?(\d+)')
+
+
+# Decode a whole JSON body (bytes or str)
+def loads(data):
+    if JSON_BACKEND == "orjson" and orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Yield the decoded items of the top-level "imdata" array from an iterable of byte chunks.
+# meta (a dict) receives "totalCount" when the response has one.
+def iter_imdata_chunks(chunks, meta=None):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = None     # next item in buffer, None until the imdata array is found
+    retry_at = 0        # an object cut by the end of the buffer is decoded again from this length
+    done = False
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            # End of the body: whatever is left must decode now
+            buffer += decoder.decode(b"", final=True)
+            retry_at = 0
+        else:
+            buffer += decoder.decode(chunk)
+        if done:
+            continue
+        if position is None:
+            match = _IMDATA.search(buffer)
+            if match is None:
+                continue
+            _read_total_count(buffer[:match.start()], meta)
+            position = match.end()
+        while len(buffer) >= retry_at:
+            position = _SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                done = True
+                position += 1
+                break
+            try:
+                item, position = _raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if chunk is None:
+                    raise
+                # Wait for twice the data before trying again, so a huge object stays linear
+                retry_at = 2 * len(buffer) - position
+                break
+            yield item
+        buffer = buffer[position:]
+        retry_at = max(0, retry_at - position)
+        position = 0
+    if not done:
+        if position is None:
+            # No imdata: an error page or an empty body
+            raise ValueError(f"APIC response without imdata: {buffer[:200]!r}")
+        raise ValueError("APIC response ended inside imdata")
+    _read_total_count(buffer, meta)
+
+
+def _read_total_count(text, meta):
+    if meta is not None and "totalCount" not in meta:
+        match = _TOTAL_COUNT.search(text)
+        if match is not None:
+            meta["totalCount"] = match.group(1)
+
+
+# Yield the imdata items of a response sent with stream=True, then release the connection
+def stream_imdata(response, meta=None):
+    with contextlib.closing(response):
+        yield from iter_imdata_chunks(response.iter_content(CHUNK_SIZE), meta)
+
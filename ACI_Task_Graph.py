@@ -0,0 +1,90 @@
+##################
+# Small dependency-ordered task executor for the writes made on one fabric
+# Flow of the code is as follows:
+# 1. Tasks are added with the names of the tasks they must run after (e.g. policy before relation).
+# 2. run() starts every task whose dependencies are done, up to ACI_FABRIC_CONCURRENCY at a time
+#    (default ACI_MAX_CONCURRENCY), and starts the next ones as tasks finish.
+# 3. A task may add more tasks while the graph runs (e.g. the writes found by a read).
+# 4. The tasks that depend on a failed task are not run; they fail with TaskSkipped.
+###################
+
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ACI_Client import MAX_CONCURRENCY
+
+# Writes run at the same time on one fabric
+FABRIC_CONCURRENCY = int(os.environ.get("ACI_FABRIC_CONCURRENCY", str(MAX_CONCURRENCY)))
+
+
+class TaskSkipped(Exception):
+    pass
+
+
+class TaskGraph:
+    def __init__(self, max_workers=None):
+        self.max_workers = max(1, max_workers or FABRIC_CONCURRENCY)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.pending = []
+        self.results = {}
+
+    # Add a task; returns its name. after: names of the tasks that must succeed first
+    def add(self, name, func, *args, after=(), **kwargs):
+        with self.lock:
+            if name in self.tasks:
+                raise ValueError(f"Task '{name}' already exists")
+            self.tasks[name] = {"func": func, "args": args, "kwargs": kwargs, "after": tuple(after)}
+            self.pending.append(name)
+        return name
+
+    def _ready(self):
+        ready, skipped = [], []
+        with self.lock:
+            for name in list(self.pending):
+                after = self.tasks[name]["after"]
+                failed = [dep for dep in after if dep in self.results and self.results[dep][1] is not None]
+                if failed:
+                    skipped.append((name, failed[0]))
+                elif all(dep in self.results for dep in after):
+                    ready.append(name)
+                else:
+                    continue
+                self.pending.remove(name)
+            for name, dep in skipped:
+                self.results[name] = (None, TaskSkipped(f"'{dep}' failed"))
+        return ready, bool(skipped)
+
+    def _call(self, name):
+        task = self.tasks[name]
+        return task["func"](*task["args"], **task["kwargs"])
+
+    # Run every task; returns {name: (result, None) or (None, error)}
+    def run(self):
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                ready, skipped = self._ready()
+                while skipped:
+                    more, skipped = self._ready()
+                    ready += more
+                for name in ready:
+                    # Tasks run in the caller's context (traced operation, current fix)
+                    running[pool.submit(contextvars.copy_context().run, self._call, name)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    with self.lock:
+                        self.results[name] = (None, error) if error is not None else (future.result(), None)
+        with self.lock:
+            # Left over: unknown dependencies or a cycle
+            for name in self.pending:
+                missing = [dep for dep in self.tasks[name]["after"] if dep not in self.results]
+                self.results[name] = (None, TaskSkipped(f"'{missing[0]}' never ran"))
+            self.pending = []
+            return dict(self.results)
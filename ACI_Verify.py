@@ -0,0 +1,199 @@
+##################
+# Verification that the leaves took the configuration pushed by the DOM and MCP fixes
+# Flow of the code is as follows:
+# 1. The fixes record what they changed (policy and policy groups) with record_rollout().
+# 2. After the fleet run the checks of every fabric are built by the fix (rollout_checks):
+#    the relations of the groups must be formed and, for MCP, the interfaces of those groups
+#    must report MCP enabled on their leaf (mcpIf).
+# 3. Every poll reads the objects still pending with one query per class (query-target-filter
+#    on their DNs, or on their leaves for objects under topology/) and the active faults
+#    (faultInst) of the affected objects, instead of one query per leaf or per object.
+# 4. All fabrics are polled at the same time every ACI_VERIFY_INTERVAL seconds until everything
+#    is in place without faults or ACI_VERIFY_TIMEOUT is reached, and the time each fabric took
+#    to converge is reported. The verification is opt-in (ACI_VERIFY=1), as it can hold a run
+#    for up to ACI_VERIFY_TIMEOUT seconds after the work is done.
+###################
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ACI_Auth import login
+from ACI_Desired_State import DN_FILTER_LIMIT
+from ACI_Metrics import traced_operation
+from ACI_Query import Query, and_, eq, ne, or_, wcard
+
+# ACI_VERIFY=1 verifies the rollouts on the leaves after the fleet run
+VERIFY = os.environ.get("ACI_VERIFY", "0") == "1"
+# Seconds to wait for a fabric to converge, and between two polls
+VERIFY_TIMEOUT = float(os.environ.get("ACI_VERIFY_TIMEOUT", "300"))
+VERIFY_INTERVAL = float(os.environ.get("ACI_VERIFY_INTERVAL", "5"))
+# Fabrics verified at the same time
+VERIFY_PARALLEL = int(os.environ.get("ACI_VERIFY_PARALLEL", "32"))
+
+# Builders of the checks of a rollout: {kind: func(APIC_URL, token, policy_name, group_names)}
+ROLLOUT_CHECKS = {}
+
+_rollouts = {}
+_lock = threading.Lock()
+_LEAF_DN = re.compile(r"^topology/pod-\d+/node-(\d+)/(.+)$")
+_FAULT_FIELDS = ["dn", "code", "severity", "descr"]
+
+
+# Register the function that builds (checks, fault DN patterns) for a kind of rollout
+def rollout_checks(kind):
+    def decorator(func):
+        ROLLOUT_CHECKS[kind] = func
+        return func
+    return decorator
+
+
+# Remember the groups a fix associated to a policy on a fabric, for verify_rollouts()
+def record_rollout(APIC_URL, kind, policy_name, group_names):
+    if not VERIFY or not group_names:
+        return
+    with _lock:
+        _rollouts.setdefault(APIC_URL, []).append((kind, policy_name, list(group_names)))
+
+
+# An object of the APIC (policy, relation) that must have these attribute values
+def apic_check(cls, dn, attributes):
+    return {"class": cls, "dn": dn, "node": None, "rn": None, "attributes": dict(attributes)}
+
+
+# An object on a leaf (topology/pod-N/node-<node>/<rn>) that must have these attribute values
+def leaf_check(cls, node, rn, attributes):
+    return {"class": cls, "dn": None, "node": int(node), "rn": rn, "attributes": dict(attributes)}
+
+
+def check_key(check):
+    return check["dn"] if check["dn"] is not None else (check["node"], check["rn"])
+
+
+# Key of a DN as in check_key(); leaf objects are matched whatever their pod
+def dn_key(dn):
+    match = _LEAF_DN.match(dn)
+    return (int(match.group(1)), match.group(2)) if match else dn
+
+
+def _read(APIC_URL, token, cls, filters, fields, extra=None):
+    for start in range(0, len(filters), DN_FILTER_LIMIT):
+        query = Query.of_class(cls).where(and_(extra, or_(*filters[start:start + DN_FILTER_LIMIT])))
+        for page in query.pages(APIC_URL, token, fields):
+            yield from page
+
+
+# Remove from pending the checks whose object is now as expected; one query per class
+@traced_operation
+def _poll_objects(APIC_URL, token, pending):
+    by_class = {}
+    for check in pending.values():
+        by_class.setdefault(check["class"], []).append(check)
+    for cls, checks in by_class.items():
+        dns = sorted({check["dn"] for check in checks if check["dn"] is not None})
+        nodes = sorted({check["node"] for check in checks if check["node"] is not None})
+        filters = [eq(cls, "dn", dn) for dn in dns] + [wcard(cls, "dn", f"/node-{node}/") for node in nodes]
+        fields = ["dn"] + sorted({key for check in checks for key in check["attributes"]})
+        for attrs in _read(APIC_URL, token, cls, filters, fields):
+            key = dn_key(attrs["dn"])
+            check = pending.get(key)
+            if check is not None and all(str(attrs.get(k)) == str(v) for k, v in check["attributes"].items()):
+                del pending[key]
+
+
+# Active faults raised on the checked objects
+@traced_operation
+def _poll_faults(APIC_URL, token, fault_patterns, keys):
+    if not fault_patterns:
+        return []
+    faults = []
+    filters = [wcard("faultInst", "dn", pattern) for pattern in fault_patterns]
+    for attrs in _read(APIC_URL, token, "faultInst", filters, _FAULT_FIELDS, ne("faultInst", "severity", "cleared")):
+        if dn_key(attrs["dn"].rsplit("/fault-", 1)[0]) in keys:
+            faults.append(attrs)
+    return faults
+
+
+# Poll one fabric until the checked objects are as expected without faults, or the timeout
+def verify_fabric(APIC_URL, token, checks, fault_patterns=(), timeout=None, interval=None):
+    timeout = VERIFY_TIMEOUT if timeout is None else timeout
+    interval = VERIFY_INTERVAL if interval is None else interval
+    keys = {check_key(check) for check in checks}
+    pending = {check_key(check): check for check in checks}
+    start = time.perf_counter()
+    polls = 0
+    while True:
+        polls += 1
+        _poll_objects(APIC_URL, token, pending)
+        faults = _poll_faults(APIC_URL, token, list(fault_patterns), keys)
+        elapsed = time.perf_counter() - start
+        converged = not pending and not faults
+        if converged or elapsed + interval > timeout:
+            break
+        time.sleep(interval)
+    return {"fabric": APIC_URL, "status": "converged" if converged else "timeout", "objects": len(keys),
+            "leaves": len({check["node"] for check in checks if check["node"] is not None}),
+            "seconds": elapsed, "polls": polls, "pending": list(pending.values()), "faults": faults, "error": None}
+
+
+def _verify_one(fabric, rollouts, timeout, interval):
+    APIC_URL = fabric["APIC_URL"]
+    try:
+        token = login(APIC_URL, fabric["USERNAME"], fabric["PASSWORD"])
+        checks, fault_patterns = {}, []
+        for kind, policy_name, group_names in rollouts:
+            kind_checks, kind_patterns = ROLLOUT_CHECKS[kind](APIC_URL, token, policy_name, group_names)
+            checks.update((check_key(check), check) for check in kind_checks)
+            fault_patterns += [pattern for pattern in kind_patterns if pattern not in fault_patterns]
+        return verify_fabric(APIC_URL, token, list(checks.values()), fault_patterns, timeout, interval)
+    except Exception as e:
+        return {"fabric": APIC_URL, "status": "failed", "objects": 0, "leaves": 0, "seconds": 0.0, "polls": 0,
+                "pending": [], "faults": [], "error": e}
+
+
+def _describe(check):
+    where = check["dn"] if check["dn"] is not None else f"node-{check['node']}/{check['rn']}"
+    expected = ", ".join(f"{k}={v}" for k, v in check["attributes"].items())
+    return f"{where} ({check['class']} {expected})"
+
+
+def print_verify_summary(results):
+    if not results:
+        return
+    width = max(len("Fabric"), max(len(r["fabric"]) for r in results))
+    print(f"\n{'Fabric':<{width}}  {'Status':<9}  {'Objects':>7}  {'Leaves':>6}  {'Polls':>5}  {'Faults':>6}  "
+          f"{'Converged in':>12}")
+    print(f"{'-' * width}  {'-' * 9}  {'-' * 7}  {'-' * 6}  {'-' * 5}  {'-' * 6}  {'-' * 12}")
+    for r in results:
+        seconds = f"{r['seconds']:.2f}s" if r["status"] == "converged" else "-"
+        print(f"{r['fabric']:<{width}}  {r['status']:<9}  {r['objects']:>7}  {r['leaves']:>6}  {r['polls']:>5}  "
+              f"{len(r['faults']):>6}  {seconds:>12}")
+    for r in results:
+        if r["error"] is not None:
+            print(f"{r['fabric']}: verification failed: {r['error']}")
+            continue
+        if r["pending"]:
+            print(f"{r['fabric']}: {len(r['pending'])} object(s) not as expected after {r['seconds']:.0f}s, e.g.:")
+            for check in r["pending"][:5]:
+                print(f"    {_describe(check)}")
+        for fault in r["faults"][:5]:
+            print(f"{r['fabric']}: fault {fault['code']} ({fault['severity']}) on {fault['dn']}: {fault['descr']}")
+
+
+# Verify every rollout recorded since the last call on all its fabrics at the same time
+def verify_rollouts(fabrics, timeout=None, interval=None):
+    with _lock:
+        rollouts = dict(_rollouts)
+        _rollouts.clear()
+    jobs = [fabric for fabric in fabrics if fabric["APIC_URL"] in rollouts]
+    if not jobs:
+        return []
+    timeout = VERIFY_TIMEOUT if timeout is None else timeout
+    print(f"\nVerifying the rollout on the leaves of {len(jobs)} fabric(s) (up to {timeout:.0f}s)...")
+    with ThreadPoolExecutor(max_workers=max(1, min(VERIFY_PARALLEL, len(jobs)))) as pool:
+        results = list(pool.map(lambda fabric: _verify_one(fabric, rollouts[fabric["APIC_URL"]], timeout, interval),
+                                jobs))
+    print_verify_summary(results)
+    return results
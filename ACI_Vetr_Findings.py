@@ -0,0 +1,206 @@
+##################
+# Run the ACI Vetr fixes only where ACI Vetr found a problem
+# Flow of the code is as follows:
+# 1. Read a findings export of ACI Vetr (CSV, or JSON: a list of findings or {"findings": [...]}).
+#    Findings marked as passed/compliant are ignored.
+# 2. Index the findings by fabric, fix and object DN. The fix of a finding comes from its rule
+#    (e.g. "MCP not enabled on port groups") or, when the rule is not known, from its DN.
+# 3. Build one work item per flagged fabric with only its flagged fixes and, for MCP and DOM,
+#    only the flagged Leaf access port / node policy groups (no group selection is asked).
+# 4. Run the work items over the fleet like ACI_Vetr_Runner; fabrics without findings are not
+#    logged into. --list only prints the work items.
+###################
+
+import argparse
+import csv
+import json
+import re
+import sys
+
+from ACI_Fixes import FIXES
+from ACI_Fleet import read_fabric_credentials, run_fleet
+from ACI_Vetr_Runner import run_fixes
+
+# Column (or JSON key) names accepted for each field of a finding, compared case-insensitively
+FIELD_ALIASES = {
+    "fabric": ("fabric", "apic_url", "apic", "fabric_url", "fabric_name", "site"),
+    "rule": ("rule", "rule_id", "rule_name", "check", "finding", "title"),
+    "dn": ("dn", "object_dn", "object", "affected_object", "affected_dn"),
+    "status": ("status", "result", "compliance", "state"),
+}
+# Status values of findings that need no fix
+PASSED = {"pass", "passed", "ok", "compliant", "success", "resolved"}
+
+# Rule name patterns (re.search, case-insensitive) and the fix they are solved by
+RULE_FIXES = [
+    (r"rogue", "rogue_ep_control"),
+    (r"port.?track", "port_tracking"),
+    (r"remote.?(ep|end.?point)|(ep|end.?point).?learn", "remote_ep_learning"),
+    (r"\bmcp\b|mis.?cabling", "mcp"),
+    (r"\bdom\b|digital.?optical|node.?control", "dom"),
+]
+# Object DNs and the fix they belong to, for rules that are not known
+DN_FIXES = [
+    (r"^uni/infra/epCtrlP-", "rogue_ep_control"),
+    (r"^uni/infra/trackEqptFabP-", "port_tracking"),
+    (r"^uni/infra/settings$", "remote_ep_learning"),
+    (r"^uni/infra/(mcpInstP-|mcpIfP-|funcprof/accportgrp-)", "mcp"),
+    (r"^uni/fabric/(nodecontrol-|funcprof/lenodepgrp-)", "dom"),
+]
+# Policy groups a fix is limited to: {fix: DN pattern whose group holds the name}
+GROUP_DNS = {
+    "mcp": re.compile(r"^uni/infra/funcprof/accportgrp-(.+?)(/|$)"),
+    "dom": re.compile(r"^uni/fabric/funcprof/lenodepgrp-(.+?)(/|$)"),
+}
+
+
+# Fabrics are matched on the APIC host, so "https://apic1.lab/" and "apic1.lab" are the same
+def fabric_key(name):
+    name = name.strip().lower()
+    name = re.sub(r"^[a-z]+://", "", name)
+    return name.rstrip("/")
+
+
+def fix_for(rule, dn):
+    rule = (rule or "").strip()
+    if rule in FIXES:
+        return rule
+    for pattern, fix in RULE_FIXES:
+        if re.search(pattern, rule, re.IGNORECASE):
+            return fix
+    for pattern, fix in DN_FIXES:
+        if re.search(pattern, dn or ""):
+            return fix
+    return None
+
+
+def _field(row, field):
+    lowered = {str(key).strip().lower(): value for key, value in row.items()}
+    for alias in FIELD_ALIASES[field]:
+        value = lowered.get(alias)
+        if value not in (None, ""):
+            return str(value).strip()
+    return None
+
+
+def read_findings(path):
+    with open(path, newline='') as findings_file:
+        if path.endswith(".json"):
+            data = json.load(findings_file)
+            rows = data.get("findings", []) if isinstance(data, dict) else data
+        else:
+            rows = list(csv.DictReader(findings_file))
+    findings = []
+    for row in rows:
+        status = _field(row, "status")
+        if status is not None and status.lower() in PASSED:
+            continue
+        findings.append({"fabric": _field(row, "fabric"), "rule": _field(row, "rule"), "dn": _field(row, "dn")})
+    return findings
+
+
+# Findings indexed by fabric, fix and object DN
+class FindingsIndex:
+    def __init__(self, findings):
+        self.by_fabric = {}
+        self.rules = {}
+        self.unknown = []
+        for finding in findings:
+            fix = fix_for(finding["rule"], finding["dn"])
+            if fix is None or not finding["fabric"]:
+                self.unknown.append(finding)
+                continue
+            dns = self.by_fabric.setdefault(fabric_key(finding["fabric"]), {}).setdefault(fix, set())
+            if finding["dn"]:
+                dns.add(finding["dn"])
+            self.rules.setdefault(fix, set()).add(finding["rule"])
+
+    def fixes(self, APIC_URL):
+        flagged = self.by_fabric.get(fabric_key(APIC_URL), {})
+        return [name for name in FIXES if name in flagged]
+
+    def dns(self, APIC_URL, fix):
+        return self.by_fabric.get(fabric_key(APIC_URL), {}).get(fix, set())
+
+    # Flagged group names of a fix, or None when the fix is not limited to groups
+    def groups(self, APIC_URL, fix):
+        if fix not in GROUP_DNS:
+            return None
+        names = set()
+        for dn in self.dns(APIC_URL, fix):
+            match = GROUP_DNS[fix].match(dn)
+            if match:
+                names.add(match.group(1))
+        return sorted(names)
+
+
+# One work item per flagged fabric: its fixes and the keyword arguments of each fix
+def work_items(fabrics, index, only_fixes=None):
+    items = []
+    for fabric in fabrics:
+        fixes = [name for name in index.fixes(fabric["APIC_URL"]) if only_fixes is None or name in only_fixes]
+        if not fixes:
+            continue
+        kwargs = {}
+        for name in fixes:
+            groups = index.groups(fabric["APIC_URL"], name)
+            if groups is not None:
+                kwargs[name] = {"groups": groups}
+        items.append({"fabric": fabric, "fixes": fixes, "kwargs": kwargs})
+    return items
+
+
+def print_work_items(items, fabrics, index):
+    known = {fabric_key(fabric["APIC_URL"]) for fabric in fabrics}
+    for item in items:
+        parts = []
+        for name in item["fixes"]:
+            groups = item["kwargs"].get(name, {}).get("groups")
+            parts.append(name if groups is None else f"{name} ({len(groups)} group(s))")
+        print(f"{item['fabric']['APIC_URL']}: {', '.join(parts)}")
+    print(f"{len(items)} of {len(fabrics)} fabric(s) flagged, "
+          f"{sum(len(item['fixes']) for item in items)} fix(es) to run.")
+    outside = sorted(set(index.by_fabric) - known)
+    if outside:
+        print(f"Findings for {len(outside)} fabric(s) not in the credentials file: {', '.join(outside)}")
+    if index.unknown:
+        rules = sorted({finding["rule"] or finding["dn"] or "?" for finding in index.unknown})
+        print(f"{len(index.unknown)} finding(s) without a matching fix were ignored: {', '.join(rules)}")
+
+
+def run_work_items(items, max_workers=None):
+    by_url = {item["fabric"]["APIC_URL"]: item for item in items}
+    return run_fleet([item["fabric"] for item in items],
+                     lambda fabric: run_fixes(fabric, by_url[fabric["APIC_URL"]]["fixes"],
+                                              by_url[fabric["APIC_URL"]]["kwargs"]),
+                     max_workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ACI Vetr fixes on the fabrics and objects flagged by ACI Vetr")
+    parser.add_argument("findings", help="ACI Vetr findings export (CSV or JSON)")
+    parser.add_argument("--csv", help="CSV file with fabric credentials")
+    parser.add_argument("--fixes", help="comma separated fixes to consider (default: all)")
+    parser.add_argument("--list", action="store_true", help="only print the work items")
+    args = parser.parse_args()
+    only_fixes = None
+    if args.fixes:
+        only_fixes = [name.strip() for name in args.fixes.split(",")]
+        unknown = [name for name in only_fixes if name not in FIXES]
+        if unknown:
+            sys.exit(f"Unknown fix(es) {', '.join(unknown)}, known fixes: {', '.join(FIXES)}")
+    try:
+        index = FindingsIndex(read_findings(args.findings))
+    except (OSError, ValueError) as e:
+        sys.exit(f"Invalid findings export {args.findings}: {e}")
+    csv_path = args.csv or input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    items = work_items(fabrics, index, only_fixes)
+    print_work_items(items, fabrics, index)
+    if args.list or not items:
+        return
+    run_work_items(items)
+
+
+if __name__ == "__main__":
+    main()
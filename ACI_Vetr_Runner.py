@@ -0,0 +1,85 @@
+##################
+# Run several ACI Vetr fixes in one pass over the fleet
+# Flow of the code is as follows:
+# 1. Read the CSV file with the fabric credentials once.
+# 2. Prompt the user to choose the fixes to apply (registered in ACI_Fixes.py).
+# 3. Log into each fabric once.
+# 4. Run all the selected fixes on that login, one after another.
+#    With a journal (ACI_JOURNAL) fabrics whose fixes all completed are skipped without a login.
+###################
+
+from ACI_Auth import login
+from ACI_Fixes import FIXES, FixDeclined
+from ACI_Fleet import prompt, read_fabric_credentials, run_fleet
+from ACI_Journal import get_journal
+
+# Importing the fix scripts registers their fixes
+import ACI_Rogue_EP_Control
+import ACI_Port_Tracking
+import ACI_Disable_EP_learning
+import ACI_MCP
+import ACI_DOM
+
+
+def choose_fixes():
+    names = list(FIXES)
+    print("Available fixes:")
+    for idx, name in enumerate(names, 1):
+        print(f"{idx}. {name} - {FIXES[name]['description']}")
+    choices = prompt("Enter the numbers of the fixes to apply (comma separated, or 'all'): ")
+    if choices.strip().lower() == 'all':
+        return names
+    try:
+        selected_indices = [int(x.strip())-1 for x in choices.split(',')]
+    except ValueError:
+        return []
+    return [names[i] for i in selected_indices if 0 <= i < len(names)]
+
+
+# Run one fix on a logged-in fabric and return its outcome: "done", "declined" or "failed"
+def run_fix(APIC_URL, token, name, kwargs=None):
+    print(f"\n>>> {name}: {FIXES[name]['description']}")
+    try:
+        FIXES[name]["func"](APIC_URL, token, **(kwargs or {}))
+    except FixDeclined:
+        print(f"Fix '{name}' declined on {APIC_URL}.")
+        return "declined"
+    except Exception as e:
+        print(f"Fix '{name}' failed on {APIC_URL}: {e}")
+        return "failed"
+    return "done"
+
+
+# Log in once and run every selected fix on that login.
+# fix_kwargs: {fix name: extra keyword arguments} (e.g. the groups flagged by ACI Vetr)
+# Returns {fix name: outcome}; when the login fails every fix is failed.
+def run_fixes(fabric, selected_fixes, fix_kwargs=None):
+    APIC_URL = fabric["APIC_URL"]
+    USERNAME = fabric["USERNAME"]
+    PASSWORD = fabric["PASSWORD"]
+    print(f"\n--- Processing fabric: {APIC_URL} ---")
+    journal = get_journal()
+    if journal is not None and all(journal.is_done(APIC_URL, name) for name in selected_fixes):
+        print(f"All selected fixes already completed on {APIC_URL} (journal). Skipping.")
+        return {name: "done" for name in selected_fixes}
+    try:
+        token = login(APIC_URL, USERNAME, PASSWORD)
+    except Exception as e:
+        print(f"Login failed for {APIC_URL}: {e}")
+        return {name: "failed" for name in selected_fixes}
+    return {name: run_fix(APIC_URL, token, name, (fix_kwargs or {}).get(name)) for name in selected_fixes}
+
+
+def main():
+    csv_path = input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    selected_fixes = choose_fixes()
+    if not selected_fixes:
+        print("No valid fixes selected. Exiting.")
+        return
+    print(f"Selected fixes: {', '.join(selected_fixes)}")
+    run_fleet(fabrics, lambda fabric: run_fixes(fabric, selected_fixes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+##################
+# Event-driven drift detection for the settings enforced by the ACI Vetr fixes
+# Flow of the code is as follows:
+# 1. For every fabric of the CSV file, log in and open the APIC websocket (/socket<token>).
+# 2. Subscribe (subscription=yes) to the DNs of Rogue EP Control, Port Tracking, Remote EP
+#    Learning, MCP Instance Policy and the DOM node control policy, and to the MCP/DOM
+#    relation classes of the policy groups.
+# 3. Report every change that moves a setting away from its desired value (and relations that
+#    are removed or repointed) as soon as the APIC pushes it; with --remediate re-apply it.
+# 4. Keep the subscriptions alive with subscriptionRefresh and reconnect with backoff.
+# All fabrics are watched from one asyncio event loop.
+###################
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from ACI_Auth import login
+from ACI_Client import apic_get
+from ACI_DOM import DOM_NODE_CONTROL
+from ACI_Desired_State import converge
+from ACI_Disable_EP_learning import REMOTE_EP_LEARNING
+from ACI_Fleet import read_fabric_credentials
+from ACI_MCP import MCP_INSTANCE_POLICY
+from ACI_Port_Tracking import PORT_TRACKING
+from ACI_Query import Query
+from ACI_Rogue_EP_Control import ROGUE_EP_CONTROL
+from ACI_Websocket import WebSocketClient
+
+# Seconds between subscriptionRefresh calls (the APIC drops a subscription after about 90s)
+REFRESH_INTERVAL = float(os.environ.get("ACI_SUBSCRIPTION_REFRESH", "30"))
+# Upper bound of the delay between reconnection attempts
+RECONNECT_MAX = 60
+
+WATCHED_SETTINGS = {
+    "rogue_ep_control": ROGUE_EP_CONTROL,
+    "port_tracking": PORT_TRACKING,
+    "remote_ep_learning": REMOTE_EP_LEARNING,
+    "mcp_instance_policy": MCP_INSTANCE_POLICY,
+    "dom_node_control": DOM_NODE_CONTROL,
+}
+# Relation classes of the policy groups; removing one undoes an MCP/DOM association
+WATCHED_RELATIONS = {
+    "infraRsMcpIfPol": "MCP interface policy",
+    "fabricRsNodeCtrl": "DOM node control policy",
+}
+
+
+class _Resubscribe(Exception):
+    pass
+
+
+def socket_url(APIC_URL, token):
+    if APIC_URL.startswith("https://"):
+        return "wss://" + APIC_URL[len("https://"):] + f"/socket{token}"
+    return "ws://" + APIC_URL[len("http://"):] + f"/socket{token}"
+
+
+# Attributes of an event (or of the current object) that differ from the desired object
+def setting_drift(desired, attrs):
+    if attrs.get("status") == "deleted":
+        return {"object": ("deleted", "present")}
+    return {key: (attrs[key], value) for key, value in desired["attributes"].items()
+            if key not in ("dn", "name") and key in attrs and str(attrs[key]) != str(value)}
+
+
+class FabricWatcher:
+    def __init__(self, fabric, remediate=False, on_event=None):
+        self.fabric = fabric
+        self.APIC_URL = fabric["APIC_URL"]
+        self.remediate = remediate
+        self.on_event = on_event
+        self.by_dn = {desired["attributes"]["dn"]: (name, desired) for name, desired in WATCHED_SETTINGS.items()}
+        self.subscriptions = {}
+        self.remediating = set()
+        self.tasks = set()
+        self.token = None
+        self.stats = {"events": 0, "drifts": 0, "remediations": 0, "reconnects": 0}
+
+    def report(self, kind, dn, detail):
+        event = {"ts": time.time(), "fabric": self.APIC_URL, "kind": kind, "dn": dn, "detail": detail}
+        print(f"[{time.strftime('%H:%M:%S')}] {self.APIC_URL} {kind}: {dn} {detail}", flush=True)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    async def _get(self, path, params=None):
+        response = await asyncio.to_thread(apic_get, self.APIC_URL, self.token, path, params)
+        response.raise_for_status()
+        return response.json()
+
+    async def _query(self, query):
+        response = await asyncio.to_thread(query.get, self.APIC_URL, self.token)
+        response.raise_for_status()
+        return response.json()
+
+    async def _login(self):
+        return await asyncio.to_thread(login, self.APIC_URL, self.fabric["USERNAME"], self.fabric["PASSWORD"])
+
+    # Subscribe to every watched DN and relation class; the answers give the current state
+    async def _subscribe(self):
+        self.subscriptions = {}
+        for dn, (name, desired) in self.by_dn.items():
+            data = await self._query(Query.of_mo(dn).props("config-only").param("subscription", "yes"))
+            self.subscriptions[data["subscriptionId"]] = name
+            imdata = data.get("imdata", [])
+            if not imdata:
+                self.report("missing", dn, f"{name} does not exist")
+                continue
+            for cls, mo in imdata[0].items():
+                changes = setting_drift(desired, mo["attributes"])
+                if changes:
+                    self._drift(name, desired, changes)
+        for cls in WATCHED_RELATIONS:
+            data = await self._query(Query.of_class(cls).props("naming-only").param("subscription", "yes"))
+            self.subscriptions[data["subscriptionId"]] = cls
+
+    def handle_event(self, cls, attrs):
+        self.stats["events"] += 1
+        dn = attrs.get("dn")
+        if dn in self.by_dn:
+            name, desired = self.by_dn[dn]
+            changes = setting_drift(desired, attrs)
+            if changes:
+                self._drift(name, desired, changes)
+        elif cls in WATCHED_RELATIONS:
+            group_dn = dn.rsplit("/", 1)[0]
+            if attrs.get("status") == "deleted":
+                self.report("relation-removed", group_dn, f"{WATCHED_RELATIONS[cls]} removed")
+            elif attrs.get("status") == "modified":
+                targets = {k: v for k, v in attrs.items() if k.startswith("tn") or k == "tDn"}
+                if targets:
+                    self.report("relation-changed", group_dn, f"{WATCHED_RELATIONS[cls]} now {targets}")
+
+    def _drift(self, name, desired, changes):
+        self.stats["drifts"] += 1
+        dn = desired["attributes"]["dn"]
+        detail = ", ".join(f"{k}: {old} (expected {new})" for k, (old, new) in changes.items())
+        self.report("drift", dn, f"{name} {detail}")
+        if self.remediate and name not in self.remediating:
+            self.remediating.add(name)
+            task = asyncio.create_task(self._remediate(name, desired, time.perf_counter()))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _remediate(self, name, desired, detected):
+        dn = desired["attributes"]["dn"]
+        try:
+            diff, results = await asyncio.to_thread(converge, self.APIC_URL, self.token, [desired], None, False)
+            errors = [error for error in results.values() if error is not None]
+            if errors:
+                self.report("remediation-failed", dn, f"{name}: {errors[0]}")
+            elif diff:
+                self.stats["remediations"] += 1
+                self.report("remediated", dn, f"{name} in {time.perf_counter() - detected:.2f}s")
+        except Exception as e:
+            self.report("remediation-failed", dn, f"{name}: {e}")
+        finally:
+            self.remediating.discard(name)
+
+    async def _read(self, websocket):
+        while True:
+            message = json.loads(await websocket.recv())
+            for item in message.get("imdata", []):
+                for cls, mo in item.items():
+                    self.handle_event(cls, mo.get("attributes", {}))
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            # The websocket belongs to the token it was opened with; a new login needs a new socket
+            if await self._login() != self.token:
+                raise _Resubscribe("token renewed")
+            for sid in list(self.subscriptions):
+                await self._get("/api/subscriptionRefresh.json", {"id": sid})
+
+    async def _session(self, stop):
+        self.token = await self._login()
+        websocket = await WebSocketClient.connect(socket_url(self.APIC_URL, self.token))
+        tasks = set()
+        try:
+            await self._subscribe()
+            print(f"Watching {self.APIC_URL} ({len(self.subscriptions)} subscriptions).", flush=True)
+            tasks = {asyncio.create_task(self._read(websocket)), asyncio.create_task(self._refresh()),
+                     asyncio.create_task(stop.wait())}
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await websocket.close()
+
+    # Watch until stop is set, reconnecting with jittered exponential backoff
+    async def run(self, stop):
+        delay = 1
+        while not stop.is_set():
+            try:
+                await self._session(stop)
+                delay = 1
+            except asyncio.CancelledError:
+                raise
+            except _Resubscribe as e:
+                self.report("reconnect", self.APIC_URL, str(e))
+                self.stats["reconnects"] += 1
+                delay = 1
+            except Exception as e:
+                self.report("error", self.APIC_URL, f"{type(e).__name__}: {e}; retrying in up to {delay}s")
+                self.stats["reconnects"] += 1
+                try:
+                    await asyncio.wait_for(stop.wait(), random.uniform(0, delay))
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(RECONNECT_MAX, delay * 2)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def watch_fleet(fabrics, remediate=False, duration=None, on_event=None, stop=None):
+    stop = stop or asyncio.Event()
+    watchers = [FabricWatcher(fabric, remediate, on_event) for fabric in fabrics]
+    tasks = [asyncio.create_task(watcher.run(stop)) for watcher in watchers]
+    try:
+        if duration is not None:
+            await asyncio.sleep(duration)
+            stop.set()
+        await asyncio.gather(*tasks)
+    finally:
+        stop.set()
+    return watchers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch the fabrics for drift of the ACI Vetr settings")
+    parser.add_argument("--csv", help="CSV file with fabric credentials")
+    parser.add_argument("--remediate", action="store_true", help="re-apply a drifted setting at once")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds (default: run until Ctrl-C)")
+    args = parser.parse_args()
+    csv_path = args.csv or input("Enter path to CSV file with fabric credentials: ")
+    fabrics = read_fabric_credentials(csv_path)
+    try:
+        watchers = asyncio.run(watch_fleet(fabrics, args.remediate, args.duration))
+    except KeyboardInterrupt:
+        return
+    for watcher in watchers:
+        stats = watcher.stats
+        print(f"{watcher.APIC_URL}: {stats['events']} event(s), {stats['drifts']} drift(s), "
+              f"{stats['remediations']} remediation(s), {stats['reconnects']} reconnect(s)")
+
+
+if __name__ == "__main__":
+    main()
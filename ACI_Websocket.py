@@ -0,0 +1,188 @@
+##################
+# Minimal RFC 6455 websocket support (standard library only) for the APIC event channel
+# Flow of the code is as follows:
+# 1. WebSocketClient opens ws:// or wss:// (self-signed APIC certificates accepted) with asyncio,
+#    does the HTTP upgrade handshake and checks Sec-WebSocket-Accept.
+# 2. recv() returns the next text message, answering pings and joining fragmented frames.
+# 3. The frame helpers are shared with ACI_Simulator, which serves the same protocol.
+###################
+
+import asyncio
+import base64
+import hashlib
+import os
+import ssl
+import struct
+from urllib.parse import urlparse
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+# Largest message accepted from the peer
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class WebSocketError(Exception):
+    pass
+
+
+class ConnectionClosed(WebSocketError):
+    pass
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def _mask(data, key):
+    if not data:
+        return data
+    repeated = (key * (len(data) // 4 + 1))[:len(data)]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(data), "big")
+
+
+# Build one final frame; client frames must be masked, server frames must not
+def encode_frame(opcode, payload, mask=False):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header += bytes([mask_bit | length])
+    elif length < 1 << 16:
+        header += bytes([mask_bit | 126]) + struct.pack("!H", length)
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack("!Q", length)
+    if mask:
+        key = os.urandom(4)
+        return header + key + _mask(payload, key)
+    return header + payload
+
+
+def _parse_header(first):
+    fin = bool(first[0] & 0x80)
+    opcode = first[0] & 0x0F
+    masked = bool(first[1] & 0x80)
+    length = first[1] & 0x7F
+    return fin, opcode, masked, length
+
+
+# Read one frame from a blocking binary file (server side of the simulator)
+def read_frame_sync(rfile):
+    first = rfile.read(2)
+    if len(first) < 2:
+        raise ConnectionClosed("connection closed")
+    fin, opcode, masked, length = _parse_header(first)
+    if length == 126:
+        length = struct.unpack("!H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", rfile.read(8))[0]
+    if length > MAX_MESSAGE_SIZE:
+        raise WebSocketError(f"frame of {length} bytes is too large")
+    key = rfile.read(4) if masked else None
+    payload = rfile.read(length)
+    return fin, opcode, _mask(payload, key) if masked else payload
+
+
+async def _read_frame(reader):
+    try:
+        first = await reader.readexactly(2)
+        fin, opcode, masked, length = _parse_header(first)
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise WebSocketError(f"frame of {length} bytes is too large")
+        key = await reader.readexactly(4) if masked else None
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionClosed("connection closed")
+    return fin, opcode, _mask(payload, key) if masked else payload
+
+
+def _insecure_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class WebSocketClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, url, headers=None, timeout=30):
+        parsed = urlparse(url)
+        secure = parsed.scheme == "wss"
+        port = parsed.port or (443 if secure else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parsed.hostname, port, ssl=_insecure_context() if secure else None,
+                                    limit=MAX_MESSAGE_SIZE),
+            timeout)
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        lines = [f"GET {path} HTTP/1.1", f"Host: {parsed.hostname}:{port}", "Upgrade: websocket",
+                 "Connection: Upgrade", f"Sec-WebSocket-Key: {key}", "Sec-WebSocket-Version: 13"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        status_line, *header_lines = response.decode("latin-1").split("\r\n")
+        if " 101 " not in f"{status_line} ":
+            writer.close()
+            raise WebSocketError(f"websocket upgrade refused: {status_line}")
+        response_headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get("sec-websocket-accept") != accept_key(key):
+            writer.close()
+            raise WebSocketError("invalid Sec-WebSocket-Accept")
+        return cls(reader, writer)
+
+    async def _send_frame(self, opcode, payload):
+        self.writer.write(encode_frame(opcode, payload, mask=True))
+        await self.writer.drain()
+
+    async def send(self, text):
+        await self._send_frame(OP_TEXT, text.encode())
+
+    async def ping(self, data=b""):
+        await self._send_frame(OP_PING, data)
+
+    # Next text message; control frames are handled on the way
+    async def recv(self):
+        parts = []
+        while True:
+            fin, opcode, payload = await _read_frame(self.reader)
+            if opcode == OP_PING:
+                await self._send_frame(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                if not self.closed:
+                    self.closed = True
+                    try:
+                        await self._send_frame(OP_CLOSE, payload[:2])
+                    except ConnectionError:
+                        pass
+                raise ConnectionClosed(f"closed by peer {payload[:2].hex()}")
+            parts.append(payload)
+            if fin:
+                return b"".join(parts).decode()
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                await self._send_frame(OP_CLOSE, struct.pack("!H", 1000))
+            except ConnectionError:
+                pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, ssl.SSLError):
+            pass
@@ -0,0 +1,373 @@
+##################
+# Work queue that shards a fleet sweep over worker processes and hosts
+# Flow of the code is as follows:
+# 1. `enqueue` puts one task per fabric (its URL, fixes and fix arguments, no credentials) on the
+#    queue, from the credentials CSV or from the work items of an ACI Vetr findings export.
+# 2. `work` starts worker processes; each leases one task at a time, renews the lease with a
+#    heartbeat while it runs, and records the result (status, time, output, rollout verification).
+# 3. A task whose worker died (no heartbeat before the lease ran out) is leased again by another
+#    worker (at-least-once; the fixes only push what differs, so a second run is harmless).
+#    A failed task is retried up to ACI_QUEUE_MAX_ATTEMPTS times.
+# 4. `status` prints the aggregated results of all workers.
+# Workers read the credentials from their own CSV and run unattended (ACI_AUTO_ANSWER or --plan).
+# ACI_AUTO_ANSWER does not select DOM/MCP policy groups: queue them from findings or use --plan.
+# The queue is a SQLite file (ACI_WORK_QUEUE) for the workers of one host or of hosts sharing a
+# disk that supports SQLite locking; other backends plug in with register_backend().
+###################
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from ACI_Fixes import FIXES, fixes_status
+from ACI_Fleet import AUTO_ANSWER, capture_output, current_fabric, read_fabric_credentials, routed_output, set_decider
+from ACI_Plan import PlanDecider, load_plan
+from ACI_Query import QUERY_SAVINGS, print_savings
+from ACI_Verify import verify_rollouts
+from ACI_Vetr_Findings import FindingsIndex, read_findings, work_items
+from ACI_Vetr_Runner import run_fixes
+
+QUEUE_PATH = os.environ.get("ACI_WORK_QUEUE", "work_queue.db")
+# Name of the sweep in the queue; a new name starts a fresh sweep in the same file
+SWEEP_NAME = os.environ.get("ACI_QUEUE_SWEEP", "default")
+# Seconds a lease lasts without a heartbeat
+LEASE_SECONDS = float(os.environ.get("ACI_QUEUE_LEASE", "120"))
+MAX_ATTEMPTS = int(os.environ.get("ACI_QUEUE_MAX_ATTEMPTS", "3"))
+# Seconds between two looks at the queue while other workers still hold leases
+POLL_INTERVAL = float(os.environ.get("ACI_QUEUE_POLL", "2"))
+
+# Queue backends: {scheme: class}, opened with "<scheme>://<location>" (a plain path is SQLite)
+QUEUE_BACKENDS = {}
+
+
+def register_backend(scheme):
+    def decorator(cls):
+        QUEUE_BACKENDS[scheme] = cls
+        return cls
+    return decorator
+
+
+# What a backend provides; tasks are dicts {"id", "fabric", "fixes", "kwargs", "attempts"}
+class WorkQueue(ABC):
+    # Add tasks {"fabric", "fixes", "kwargs"}; returns how many were added
+    @abstractmethod
+    def put(self, tasks):
+        ...
+
+    # Lease the next pending (or expired) task for worker, or return None; an expired task
+    # that was already tried max_attempts times is failed instead
+    @abstractmethod
+    def lease(self, worker, lease_seconds, max_attempts):
+        ...
+
+    # Extend the lease; False when the worker lost it
+    @abstractmethod
+    def heartbeat(self, task_id, worker, lease_seconds):
+        ...
+
+    @abstractmethod
+    def complete(self, task_id, worker, result):
+        ...
+
+    # Give the task back for a retry, or fail it for good after max_attempts
+    @abstractmethod
+    def fail(self, task_id, worker, result, max_attempts):
+        ...
+
+    # Tasks that are pending or leased (a worker should keep waiting while there are any)
+    @abstractmethod
+    def unfinished(self):
+        ...
+
+    # Every task with its status and result, in the order it was queued
+    @abstractmethod
+    def tasks(self):
+        ...
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+
+@register_backend("sqlite")
+class SqliteWorkQueue(WorkQueue):
+    def __init__(self, path, sweep=None):
+        self.path = path
+        self.sweep = sweep or SWEEP_NAME
+        self.lock = threading.Lock()
+        # Autocommit; lease() takes the write lock itself with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sweep TEXT, fabric TEXT, payload TEXT,
+                status TEXT, worker TEXT, lease_until REAL, attempts INTEGER, result TEXT, updated REAL,
+                UNIQUE (sweep, fabric))
+        """)
+
+    def put(self, tasks):
+        now = time.time()
+        rows = [(self.sweep, task["fabric"], json.dumps({"fixes": task["fixes"], "kwargs": task.get("kwargs", {})}),
+                 "pending", None, 0.0, 0, None, now) for task in tasks]
+        with self.lock:
+            cursor = self.db.executemany("INSERT OR IGNORE INTO tasks (sweep, fabric, payload, status, worker,"
+                                         " lease_until, attempts, result, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         rows)
+        return cursor.rowcount
+
+    def lease(self, worker, lease_seconds, max_attempts):
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute("UPDATE tasks SET status='failed', updated=? WHERE sweep=? AND status='leased'"
+                                " AND lease_until<? AND attempts>=?", (now, self.sweep, now, max_attempts))
+                row = self.db.execute("SELECT id, fabric, payload, attempts FROM tasks WHERE sweep=? AND"
+                                      " (status='pending' OR (status='leased' AND lease_until<?)) ORDER BY id LIMIT 1",
+                                      (self.sweep, now)).fetchone()
+                if row is not None:
+                    self.db.execute("UPDATE tasks SET status='leased', worker=?, lease_until=?, attempts=attempts+1,"
+                                    " updated=? WHERE id=?", (worker, now + lease_seconds, now, row[0]))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        payload = json.loads(row[2])
+        return {"id": row[0], "fabric": row[1], "fixes": payload["fixes"], "kwargs": payload["kwargs"],
+                "attempts": row[3] + 1}
+
+    def heartbeat(self, task_id, worker, lease_seconds):
+        with self.lock:
+            cursor = self.db.execute("UPDATE tasks SET lease_until=? WHERE id=? AND worker=? AND status='leased'",
+                                     (time.time() + lease_seconds, task_id, worker))
+        return cursor.rowcount == 1
+
+    def _finish(self, task_id, worker, status, result):
+        with self.lock:
+            cursor = self.db.execute("UPDATE tasks SET status=?, result=?, lease_until=0, updated=?"
+                                     " WHERE id=? AND worker=? AND status='leased'",
+                                     (status, json.dumps(result), time.time(), task_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker, result):
+        return self._finish(task_id, worker, "done", result)
+
+    def fail(self, task_id, worker, result, max_attempts):
+        with self.lock:
+            row = self.db.execute("SELECT attempts FROM tasks WHERE id=?", (task_id,)).fetchone()
+        status = "failed" if row is None or row[0] >= max_attempts else "pending"
+        return self._finish(task_id, worker, status, result)
+
+    def unfinished(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM tasks WHERE sweep=? AND status IN ('pending', 'leased')",
+                                   (self.sweep,)).fetchone()[0]
+
+    def tasks(self):
+        with self.lock:
+            rows = self.db.execute("SELECT id, fabric, payload, status, worker, attempts, result FROM tasks"
+                                   " WHERE sweep=? ORDER BY id", (self.sweep,)).fetchall()
+        return [{"id": row[0], "fabric": row[1], **json.loads(row[2]), "status": row[3], "worker": row[4],
+                 "attempts": row[5], "result": json.loads(row[6]) if row[6] else None} for row in rows]
+
+    def reset(self):
+        with self.lock:
+            self.db.execute("DELETE FROM tasks WHERE sweep=?", (self.sweep,))
+
+
+def open_queue(location=None, sweep=None):
+    location = location or QUEUE_PATH
+    scheme, separator, rest = location.partition("://")
+    if not separator:
+        scheme, rest = "sqlite", location
+    if scheme not in QUEUE_BACKENDS:
+        raise ValueError(f"Unknown work queue backend {scheme!r}, known backends: {', '.join(QUEUE_BACKENDS)}")
+    return QUEUE_BACKENDS[scheme](rest, sweep)
+
+
+# Tasks for every fabric of the CSV file, or only for the fabrics and groups flagged by ACI Vetr
+def build_tasks(fabrics, fixes, findings_path=None):
+    if findings_path is None:
+        return [{"fabric": fabric["APIC_URL"], "fixes": list(fixes), "kwargs": {}} for fabric in fabrics]
+    items = work_items(fabrics, FindingsIndex(read_findings(findings_path)), fixes)
+    return [{"fabric": item["fabric"]["APIC_URL"], "fixes": item["fixes"], "kwargs": item["kwargs"]}
+            for item in items]
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Renew the lease of the running task until stopped; lost is set if another worker took it over
+def _heartbeat(queue, task, worker, lease_seconds, stop, lost):
+    while not stop.wait(lease_seconds / 3):
+        if not queue.heartbeat(task["id"], worker, lease_seconds):
+            lost.set()
+            return
+
+
+def run_task(task, fabric):
+    result = {"status": "ok", "error": None, "output": "", "seconds": 0.0, "verify": None, "outcomes": {}}
+    buffer = []
+    fabric_token = current_fabric.set(task["fabric"])
+    start = time.perf_counter()
+    try:
+        with capture_output(buffer, task["fabric"]):
+            result["outcomes"] = run_fixes(fabric, task["fixes"], task["kwargs"])
+            result["status"] = fixes_status(result["outcomes"])
+            failed = [name for name, outcome in result["outcomes"].items() if outcome == "failed"]
+            if failed:
+                result["error"] = f"fix(es) failed: {', '.join(failed)}"
+            verified = verify_rollouts([fabric])
+            if verified:
+                result["verify"] = verified[0]["status"]
+    except Exception as e:
+        result["status"], result["error"] = "failed", f"{type(e).__name__}: {e}"
+    finally:
+        current_fabric.reset(fabric_token)
+        result["seconds"] = time.perf_counter() - start
+        result["output"] = "".join(buffer)
+    return result
+
+
+# Lease and run tasks until the queue is drained (or max_tasks were run); returns the tasks run
+def run_worker(location, sweep, csv_path, plan_path=None, lease_seconds=None, max_tasks=None):
+    lease_seconds = lease_seconds or LEASE_SECONDS
+    credentials = {fabric["APIC_URL"]: fabric for fabric in read_fabric_credentials(csv_path)}
+    if plan_path is not None:
+        set_decider(PlanDecider(load_plan(plan_path)))
+    queue = open_queue(location, sweep)
+    worker = worker_name()
+    done = 0
+    with routed_output():
+        while max_tasks is None or done < max_tasks:
+            task = queue.lease(worker, lease_seconds, MAX_ATTEMPTS)
+            if task is None:
+                if queue.unfinished() == 0:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            fabric = credentials.get(task["fabric"])
+            if fabric is None:
+                result = {"status": "failed", "error": f"no credentials for {task['fabric']} on {worker}",
+                          "output": "", "seconds": 0.0, "verify": None, "outcomes": {}}
+            else:
+                stop, lost = threading.Event(), threading.Event()
+                beater = threading.Thread(target=_heartbeat, args=(queue, task, worker, lease_seconds, stop, lost),
+                                          daemon=True)
+                beater.start()
+                try:
+                    result = run_task(task, fabric)
+                finally:
+                    stop.set()
+                    beater.join()
+                if lost.is_set():
+                    print(f"[{worker}] lost the lease of {task['fabric']}; another worker runs it again.", flush=True)
+            if result["status"] == "failed":
+                queue.fail(task["id"], worker, result, MAX_ATTEMPTS)
+            else:
+                queue.complete(task["id"], worker, result)
+            done += 1
+            print(f"[{worker}] {task['fabric']}: {result['status']} in {result['seconds']:.2f}s"
+                  f" (attempt {task['attempts']})", flush=True)
+    if QUERY_SAVINGS:
+        print_savings()
+    return done
+
+
+def _worker_process(location, sweep, csv_path, plan_path):
+    try:
+        run_worker(location, sweep, csv_path, plan_path)
+    except KeyboardInterrupt:
+        pass
+
+
+def print_queue_summary(queue, show_output=False):
+    tasks = queue.tasks()
+    if not tasks:
+        print("The queue is empty.")
+        return
+    width = max(len("Fabric"), max(len(task["fabric"]) for task in tasks))
+    worker_width = max(len("Worker"), max(len(task["worker"] or "") for task in tasks))
+    print(f"\n{'Fabric':<{width}}  {'Queue':<7}  {'Result':<8}  {'Tries':>5}  {'Seconds':>8}  {'Verify':<9}  Worker")
+    print(f"{'-' * width}  {'-' * 7}  {'-' * 8}  {'-' * 5}  {'-' * 8}  {'-' * 9}  {'-' * worker_width}")
+    by_status, by_worker = {}, {}
+    for task in tasks:
+        result = task["result"] or {}
+        by_status[task["status"]] = by_status.get(task["status"], 0) + 1
+        if task["worker"] and result:
+            seconds = by_worker.setdefault(task["worker"], [0, 0.0])
+            seconds[0] += 1
+            seconds[1] += result["seconds"]
+        print(f"{task['fabric']:<{width}}  {task['status']:<7}  {result.get('status', '-'):<8}  {task['attempts']:>5}  "
+              f"{result.get('seconds', 0.0):>8.2f}  {result.get('verify') or '-':<9}  {task['worker'] or '-'}")
+    print("\n" + ", ".join(f"{count} {status}" for status, count in sorted(by_status.items())))
+    for worker, (count, seconds) in sorted(by_worker.items()):
+        print(f"{worker}: {count} task(s), {seconds:.2f}s")
+    for task in tasks:
+        result = task["result"] or {}
+        if result.get("error"):
+            print(f"{task['fabric']}: {result['error']}")
+        if show_output and result.get("output"):
+            print(f"\n--- {task['fabric']} ---\n{result['output']}", end="")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard a fleet sweep of the ACI Vetr fixes over worker processes")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="queue file or <backend>://<location> ($ACI_WORK_QUEUE)")
+    parser.add_argument("--sweep", default=SWEEP_NAME, help="sweep name ($ACI_QUEUE_SWEEP or 'default')")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="put one task per fabric on the queue")
+    enqueue.add_argument("--csv", required=True, help="CSV file with fabric credentials (only the URLs are queued)")
+    enqueue.add_argument("--fixes", default="all", help="comma separated fixes, or 'all' (default)")
+    enqueue.add_argument("--findings", help="ACI Vetr findings export: queue only the flagged fabrics and groups")
+    work = commands.add_parser("work", help="run worker processes until the queue is drained")
+    work.add_argument("--csv", required=True, help="CSV file with the credentials of the fabrics")
+    work.add_argument("--processes", type=int, default=1, help="worker processes on this host")
+    work.add_argument("--plan", help="plan file answering the questions (otherwise ACI_AUTO_ANSWER is needed)")
+    status = commands.add_parser("status", help="print the aggregated results")
+    status.add_argument("--output", action="store_true", help="also print the output of every fabric")
+    commands.add_parser("reset", help="forget the sweep")
+    args = parser.parse_args()
+    queue = open_queue(args.queue, args.sweep)
+    if args.command == "enqueue":
+        fixes = list(FIXES) if args.fixes.strip().lower() == "all" else [f.strip() for f in args.fixes.split(",")]
+        unknown = [name for name in fixes if name not in FIXES]
+        if unknown:
+            sys.exit(f"Unknown fix(es) {', '.join(unknown)}, known fixes: {', '.join(FIXES)}")
+        tasks = build_tasks(read_fabric_credentials(args.csv), fixes, args.findings)
+        print(f"{queue.put(tasks)} of {len(tasks)} task(s) queued in sweep '{args.sweep}'.")
+    elif args.command == "work":
+        if args.plan is None and AUTO_ANSWER is None:
+            sys.exit("Workers run unattended: set ACI_AUTO_ANSWER or pass --plan.")
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=_worker_process, args=(args.queue, args.sweep, args.csv, args.plan))
+                     for _ in range(max(1, args.processes))]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
+        print_queue_summary(queue)
+        print(f"Sweep wall time on this host: {time.perf_counter() - start:.2f}s with {len(processes)} worker(s)")
+    elif args.command == "status":
+        print_queue_summary(queue, args.output)
+    else:
+        queue.reset()
+        print(f"Sweep '{args.sweep}' reset.")
+
+
+if __name__ == "__main__":
+    main()